@@ -0,0 +1,88 @@
+"""
+Per-connection rate limits and load shedding for Socket.IO events
+"""
+
+import os
+import metrics
+from ratelimit import KeyedTokenBuckets
+
+# event=rate/burst per sid; a user's sids together get SOCKET_USER_LIMIT_FACTOR times that
+SOCKET_EVENT_LIMITS = os.getenv(
+    'SOCKET_EVENT_LIMITS',
+    'send_message=5/10,join_chat=2/8,mark_read=5/20,leave_chat=2/8,login=0.5/5'
+)
+SOCKET_USER_LIMIT_FACTOR = float(os.getenv('SOCKET_USER_LIMIT_FACTOR', 2))
+SOCKET_LIMITER_MAX_KEYS = int(os.getenv('SOCKET_LIMITER_MAX_KEYS', 50000))
+# Shed the expensive events while the DB pool or the AI reply queue is backed up
+ADMISSION_POOL_WAIT_MS = float(os.getenv('ADMISSION_POOL_WAIT_MS', 250))
+ADMISSION_AI_QUEUE_DEPTH = int(os.getenv('ADMISSION_AI_QUEUE_DEPTH', 200))
+ADMISSION_SHED_EVENTS = set(os.getenv('ADMISSION_SHED_EVENTS', 'send_message,join_chat').split(','))
+ADMISSION_RETRY_AFTER = float(os.getenv('ADMISSION_RETRY_AFTER', 2))
+
+def parse_limits(spec):
+    """'send_message=5/10,join_chat=2/8' -> {event: (rate, burst)}"""
+    limits = {}
+    for part in spec.split(','):
+        if not part.strip():
+            continue
+        event, _, value = part.partition('=')
+        rate, _, burst = value.partition('/')
+        limits[event.strip()] = (float(rate), float(burst or rate))
+    return limits
+
+class SocketLimiter:
+    """Token buckets per (event, sid) and per (event, user); events without a limit pass"""
+
+    def __init__(self, limits=None, user_factor=SOCKET_USER_LIMIT_FACTOR, max_keys=SOCKET_LIMITER_MAX_KEYS):
+        limits = parse_limits(SOCKET_EVENT_LIMITS) if limits is None else limits
+        self._sid_buckets = {}
+        self._user_buckets = {}
+        for event, (rate, burst) in limits.items():
+            self._sid_buckets[event] = KeyedTokenBuckets(rate, burst, max_keys)
+            self._user_buckets[event] = KeyedTokenBuckets(rate * user_factor, burst * user_factor, max_keys)
+
+    def check(self, event, sid, username=None):
+        """Return (allowed, retry_after_seconds)"""
+        sid_buckets = self._sid_buckets.get(event)
+        if sid_buckets is None:
+            return True, 0.0
+        allowed, retry_after = sid_buckets.try_acquire(sid)
+        if allowed and username:
+            allowed, retry_after = self._user_buckets[event].try_acquire(username)
+        return allowed, retry_after
+
+    def forget(self, sid):
+        """Drop a disconnected sid's buckets"""
+        for buckets in self._sid_buckets.values():
+            buckets.discard(sid)
+
+class AdmissionControl:
+    """Global load shedding driven by DB pool wait time and AI reply queue depth"""
+
+    def __init__(self, pool_wait_ms, ai_queue_depth, max_pool_wait_ms=ADMISSION_POOL_WAIT_MS,
+                 max_ai_queue_depth=ADMISSION_AI_QUEUE_DEPTH, shed_events=ADMISSION_SHED_EVENTS,
+                 retry_after=ADMISSION_RETRY_AFTER):
+        self.pool_wait_ms = pool_wait_ms
+        self.ai_queue_depth = ai_queue_depth
+        self.max_pool_wait_ms = max_pool_wait_ms
+        self.max_ai_queue_depth = max_ai_queue_depth
+        self.shed_events = shed_events
+        self.retry_after = retry_after
+
+    def overloaded(self):
+        """Name of the saturated resource, or None"""
+        if self.pool_wait_ms() > self.max_pool_wait_ms:
+            return "db_pool"
+        if self.ai_queue_depth() > self.max_ai_queue_depth:
+            return "ai_queue"
+        return None
+
+    def check(self, event):
+        """Return (allowed, reason, retry_after_seconds)"""
+        if event not in self.shed_events:
+            return True, None, 0.0
+        reason = self.overloaded()
+        if reason:
+            metrics.increment(f"socket_shed_{reason}")
+            return False, reason, self.retry_after
+        return True, None, 0.0
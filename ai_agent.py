@@ -1,14 +1,17 @@
-import requests
 import os
-from dotenv import load_dotenv
+import time
 from database import get_connection
 from encryption import decrypt_message
-
-# Load environment variables
-load_dotenv()
+from context_window import ContextWindowStore
+from prompt_builder import PromptBuilder
+from faq_engine import faq_engine
+from response_cache import response_cache, context_fingerprint
+from ai_guard import ai_guard, AIUnavailable
+import metrics
 
 OPENROUTER_API_KEY = os.getenv('OPENROUTER_API_KEY')
 AI_MODEL = os.getenv('AI_MODEL', 'qwen/qwen-2.5-7b-instruct')
+AI_FALLBACK_REPLY = "Sorry, I'm having trouble responding right now. Please try again later."
 
 SELLER_PERSONALITIES = {
     "seller1": {
@@ -38,20 +41,23 @@ SELLER_PERSONALITIES = {
     }
 }
 
-def get_conversation_history(buyer_id, seller_id, limit=10):
+def get_conversation_history(buyer_username, seller_username, limit=10):
     """Get last N messages between buyer and seller for context"""
     conn = get_connection()
     cur = conn.cursor()
     
+    # One query over the (buyer_id, seller_id) and (conversation_id, timestamp)
+    # indexes; the created_at bound lets the executor skip older partitions
     cur.execute("""
-        SELECT m.sender_id, u.username, m.encrypted_content, m.timestamp
-        FROM messages m
+        SELECT m.id, u.username, COALESCE(m.ciphertext, convert_to(m.encrypted_content, 'UTF8')), m.timestamp
+        FROM conversations c
+        JOIN messages m ON m.conversation_id = c.id AND m.timestamp >= c.created_at - INTERVAL '1 day'
         JOIN users u ON m.sender_id = u.id
-        JOIN conversations c ON m.conversation_id = c.id
-        WHERE (c.buyer_id = %s AND c.seller_id = %s) OR (c.buyer_id = %s AND c.seller_id = %s)
+        WHERE c.buyer_id = (SELECT id FROM users WHERE username = %s)
+          AND c.seller_id = (SELECT id FROM users WHERE username = %s)
         ORDER BY m.timestamp DESC
         LIMIT %s
-    """, (buyer_id, seller_id, seller_id, buyer_id, limit))
+    """, (buyer_username, seller_username, limit))
     
     messages = cur.fetchall()
     cur.close()
@@ -60,9 +66,10 @@ def get_conversation_history(buyer_id, seller_id, limit=10):
     # Decrypt messages and reverse to chronological order
     history = []
     for msg in reversed(messages):
-        sender_id, username, encrypted_content, timestamp = msg
+        message_id, username, encrypted_content, timestamp = msg
         decrypted_content = decrypt_message(encrypted_content)
         history.append({
+            "id": message_id,
             "sender": username,
             "message": decrypted_content,
             "timestamp": timestamp
@@ -70,18 +77,20 @@ def get_conversation_history(buyer_id, seller_id, limit=10):
     
     return history
 
-def get_user_id(username):
-    """Get user ID from username"""
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT id FROM users WHERE username = %s", (username,))
-    result = cur.fetchone()
-    cur.close()
-    conn.close()
-    return result[0] if result else None
+# Recent messages per conversation; handle_message appends to it so steady-state
+# replies never query the database for context
+context_windows = ContextWindowStore(get_conversation_history)
+prompt_builder = PromptBuilder()
 
 def ai_reply(message, seller_username, buyer_username=None):
     """Generate AI response with personality and conversation context"""
+    # Common questions are answered from the seller's FAQ without calling the model
+    faq_answer, faq_hits = faq_engine.answer(seller_username, message, buyer_username)
+    if faq_answer is not None:
+        print(f"📚 FAQ answer for {seller_username}")
+        metrics.increment("ai_faq_answers")
+        return faq_answer
+    
     if not OPENROUTER_API_KEY:
         print("Warning: OPENROUTER_API_KEY not found in environment variables")
         return "AI service is temporarily unavailable. Please try again later."
@@ -93,47 +102,52 @@ def ai_reply(message, seller_username, buyer_username=None):
     })
     
     # Get conversation history for context
-    buyer_id = get_user_id(buyer_username) if buyer_username else None
-    seller_id = get_user_id(seller_username)
-    
-    conversation_context = ""
-    if buyer_id and seller_id:
-        history = get_conversation_history(buyer_id, seller_id, limit=5)
-        if history:
-            conversation_context = "\n\nRecent conversation history:\n"
-            for msg in history:
-                conversation_context += f"{msg['sender']}: {msg['message']}\n"
+    history = context_windows.get(buyer_username, seller_username) if buyer_username else []
     
-    # Build system prompt with personality and context
-    system_prompt = f"""{seller_info['personality']}
+    # Repeated questions to the same seller are answered from the cache; the
+    # current message is last in the window, so fingerprint what came before it
+    fingerprint = context_fingerprint(history[:-1])
+    cached = response_cache.get(seller_username, message, buyer_username, fingerprint)
+    if cached is not None:
+        print(f"⚡ AI cache hit for {seller_username}")
+        return cached
     
-Your name is {seller_info['name']}. You are chatting with {buyer_username or 'a customer'}.
-{conversation_context}
-
-Respond naturally as {seller_info['name']}, maintaining your personality style ({seller_info['style']}). 
-Be helpful and address the customer's needs while staying in character."""
+    # Persona, rolling summary and the most recent turns, fitted to the token budget
+    messages, prompt_stats = prompt_builder.build(seller_info, buyer_username, seller_username, history, message,
+                                                   knowledge=faq_hits)
+    metrics.increment("ai_prompt_tokens", prompt_stats["prompt_tokens"])
 
     try:
-        response = requests.post(
-            "https://openrouter.ai/api/v1/chat/completions",
+        started = time.monotonic()
+        # Deadlines, retries, breaker and rate limits live in the guard; when it
+        # sheds or fails the buyer gets the canned fallback below right away
+        response = ai_guard.post(
+            seller_username,
             headers={
                 "Authorization": f"Bearer {OPENROUTER_API_KEY}",
                 "Content-Type": "application/json"
             },
-            json={
+            payload={
                 "model": AI_MODEL,
-                "messages": [
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": message}
-                ],
+                "messages": messages,
                 "temperature": 0.7,
                 "max_tokens": 300
             }
         )
         
-        response.raise_for_status()
-        return response.json()["choices"][0]["message"]["content"]
+        reply = response["choices"][0]["message"]["content"]
+        latency = time.monotonic() - started
+        metrics.increment("ai_upstream_calls")
+        metrics.increment("ai_upstream_latency_ms", int(latency * 1000))
+        
+        # Only successful upstream replies are cached, never the fallback text
+        response_cache.put(seller_username, message, reply, latency, buyer_username, fingerprint)
+        return reply
+    
+    except AIUnavailable as e:
+        print(f"AI upstream unavailable ({e.reason}): {e}")
+        return AI_FALLBACK_REPLY
     
     except Exception as e:
         print(f"AI API Error: {e}")
-        return f"Sorry, I'm having trouble responding right now. Please try again later."
+        return AI_FALLBACK_REPLY
@@ -0,0 +1,186 @@
+"""
+Failure isolation for the AI upstream: deadlines, retries, circuit breaker and rate limits
+"""
+
+import os
+import random
+import threading
+import time
+import requests
+import metrics
+from ratelimit import TokenBucket, KeyedTokenBuckets
+
+AI_API_URL = os.getenv('AI_API_URL', 'https://openrouter.ai/api/v1/chat/completions')
+AI_CONNECT_TIMEOUT = float(os.getenv('AI_CONNECT_TIMEOUT', 3.05))
+AI_READ_TIMEOUT = float(os.getenv('AI_READ_TIMEOUT', 20))
+AI_MAX_RETRIES = int(os.getenv('AI_MAX_RETRIES', 2))
+AI_RETRY_BACKOFF_BASE = float(os.getenv('AI_RETRY_BACKOFF_BASE', 0.25))
+AI_RETRY_BACKOFF_MAX = float(os.getenv('AI_RETRY_BACKOFF_MAX', 2.0))
+AI_BREAKER_FAILURE_THRESHOLD = int(os.getenv('AI_BREAKER_FAILURE_THRESHOLD', 5))
+AI_BREAKER_RESET_SECONDS = float(os.getenv('AI_BREAKER_RESET_SECONDS', 30))
+AI_GLOBAL_RATE = float(os.getenv('AI_GLOBAL_RATE', 5))
+AI_GLOBAL_BURST = float(os.getenv('AI_GLOBAL_BURST', 10))
+AI_SELLER_RATE = float(os.getenv('AI_SELLER_RATE', 1))
+AI_SELLER_BURST = float(os.getenv('AI_SELLER_BURST', 3))
+
+# The upstream never processed these, so retrying cannot double-bill a completion
+RETRYABLE_STATUSES = {429, 502, 503, 504}
+
+class AIUnavailable(Exception):
+    """The upstream call was shed or failed; callers fall back to a canned reply"""
+
+    def __init__(self, reason, message=None):
+        super().__init__(message or reason)
+        self.reason = reason
+
+class CircuitBreaker:
+    """Opens after consecutive failures, then lets one trial call through after a cooldown"""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold=AI_BREAKER_FAILURE_THRESHOLD, reset_timeout=AI_BREAKER_RESET_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == self.OPEN:
+                if time.monotonic() - self.opened_at < self.reset_timeout:
+                    return False
+                self.state = self.HALF_OPEN
+                self._trial_in_flight = False
+            if self.state == self.HALF_OPEN:
+                if self._trial_in_flight:
+                    return False
+                self._trial_in_flight = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    print(f"🔌 AI circuit breaker opened after {self.failures} failure(s)")
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+                self._trial_in_flight = False
+
+    def release(self):
+        """Give back a half-open trial that never reached the upstream"""
+        with self._lock:
+            self._trial_in_flight = False
+
+    def snapshot(self):
+        return {"state": self.state, "consecutive_failures": self.failures}
+
+class AIUpstreamGuard:
+    """Posts chat completions with deadlines, jittered retries, a breaker and token buckets"""
+
+    def __init__(self, url=AI_API_URL, connect_timeout=AI_CONNECT_TIMEOUT, read_timeout=AI_READ_TIMEOUT,
+                 max_retries=AI_MAX_RETRIES, backoff_base=AI_RETRY_BACKOFF_BASE,
+                 backoff_max=AI_RETRY_BACKOFF_MAX, breaker=None, global_bucket=None, seller_buckets=None):
+        self.url = url
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.breaker = breaker if breaker is not None else CircuitBreaker()
+        self.global_bucket = global_bucket if global_bucket is not None else TokenBucket(AI_GLOBAL_RATE, AI_GLOBAL_BURST)
+        self.seller_buckets = (seller_buckets if seller_buckets is not None
+                               else KeyedTokenBuckets(AI_SELLER_RATE, AI_SELLER_BURST))
+        # Keep-alive connections to the upstream across calls
+        self.session = requests.Session()
+
+    def backoff(self, attempt, retry_after=None):
+        """Full-jitter exponential backoff, honouring Retry-After when given"""
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, self.backoff_max))
+        return delay
+
+    def admit(self, seller_username):
+        """Shed the call unless the breaker and the seller and global buckets allow it.
+
+        A shed call uses up nothing: the breaker is asked first, and the seller's
+        token and any half-open trial are given back if a later check sheds it.
+        """
+        if not self.breaker.allow():
+            metrics.increment("ai_shed_circuit_open")
+            raise AIUnavailable("circuit_open")
+        allowed, _ = self.seller_buckets.try_acquire(seller_username)
+        if not allowed:
+            self.breaker.release()
+            metrics.increment("ai_shed_seller_rate_limited")
+            raise AIUnavailable("seller_rate_limited")
+        allowed, _ = self.global_bucket.try_acquire()
+        if not allowed:
+            self.seller_buckets.refund(seller_username)
+            self.breaker.release()
+            metrics.increment("ai_shed_global_rate_limited")
+            raise AIUnavailable("global_rate_limited")
+
+    def post(self, seller_username, headers, payload):
+        """Return the decoded JSON response or raise AIUnavailable"""
+        self.admit(seller_username)
+
+        attempt = 0
+        while True:
+            retry_after = None
+            try:
+                response = self.session.post(self.url, headers=headers, json=payload, timeout=self.timeout)
+            except requests.exceptions.ReadTimeout as e:
+                # The request may already have been processed, so it is not safe to retry
+                self.breaker.record_failure()
+                metrics.increment("ai_upstream_timeouts")
+                raise AIUnavailable("read_timeout", str(e))
+            except requests.exceptions.ConnectionError as e:
+                error = AIUnavailable("connect_error", str(e))
+            except requests.exceptions.RequestException as e:
+                self.breaker.record_failure()
+                raise AIUnavailable("request_error", str(e))
+            else:
+                if response.status_code < 400:
+                    self.breaker.record_success()
+                    return response.json()
+                if response.status_code not in RETRYABLE_STATUSES:
+                    if response.status_code >= 500:
+                        self.breaker.record_failure()
+                    else:
+                        # Our own request was rejected; the upstream itself is healthy
+                        self.breaker.release()
+                    raise AIUnavailable(f"http_{response.status_code}")
+                error = AIUnavailable(f"http_{response.status_code}")
+                try:
+                    retry_after = float(response.headers.get('Retry-After', ''))
+                except ValueError:
+                    retry_after = None
+
+            if attempt >= self.max_retries:
+                self.breaker.record_failure()
+                raise error
+            metrics.increment("ai_upstream_retries")
+            time.sleep(self.backoff(attempt, retry_after))
+            attempt += 1
+
+    def snapshot(self):
+        return {
+            "breaker": self.breaker.snapshot(),
+            "global_tokens": round(self.global_bucket.available(), 2),
+            "tracked_sellers": len(self.seller_buckets)
+        }
+
+ai_guard = AIUpstreamGuard()
+metrics.register_gauge("ai_upstream", ai_guard.snapshot)
@@ -1,28 +1,229 @@
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, Blueprint, current_app, g, render_template, request, jsonify, send_file, abort
+import mimetypes
 from flask_socketio import SocketIO, emit, join_room, leave_room
+import atexit
+import functools
+import hmac
 import os
-from dotenv import load_dotenv
-from encryption import encrypt_message
-from database import (save_message, get_message_history, get_users_by_role, get_user_id, 
-                     get_recent_conversations, search_messages, get_message_statistics, delete_message)
-from ai_agent import ai_reply
+import signal
+import threading
+import time
+from datetime import datetime
+from urllib.parse import quote, unquote
+if __name__ == "__main__":
+    # .env is read here, before any imported module reads its settings; importing never reads it
+    from dotenv import load_dotenv
+    load_dotenv()
+from encryption import encrypt_message, get_keyring
+from database import (save_message, save_message_once, get_message_receipt, get_message_history,
+                     get_messages_since, get_users_by_role, get_user_id, get_recent_conversations,
+                     search_messages, get_message_statistics, delete_message, get_inbox,
+                     mark_conversation_read, get_bootstrap, get_history_batch,
+                     HISTORY_BATCH_MAX_ITEMS, HISTORY_BATCH_MAX_LIMIT, pool as db_pool,
+                     get_password_hash, update_password_hash, warm_caches,
+                     merge_response_sketches, get_response_sketches, save_attachment, get_attachment)
+from partitions import ensure_partitions, keep_partitions_ahead, export_conversation
+from reply_scheduler import ReplyScheduler
+from dedupe import DedupeWindow
+from admission import SocketLimiter, AdmissionControl
+from auth import Authenticator, SessionManager, LoginBusy, session_secret
+from response_times import ResponseTimeTracker
+from ops import HandlerStats, OpsBroadcaster, OPS_NAMESPACE, OPS_TOKEN
+from profiling import Profiler, MODES as PROFILE_MODES
+from attachments import (store as attachment_store, parse_range, AttachmentError, AttachmentTooLarge,
+                         UnsupportedType)
+import assets
+import metrics
 
-# Load environment variables
-load_dotenv()
+SECRET_KEY = session_secret()
+# Work done by warmup() before /readyz reports ready
+WARMUP_DB_CONNECTIONS = int(os.getenv('WARMUP_DB_CONNECTIONS', 4))
+WARMUP_MAX_USERS = int(os.getenv('WARMUP_MAX_USERS', 10000))
+WARMUP_MAX_CONVERSATIONS = int(os.getenv('WARMUP_MAX_CONVERSATIONS', 50000))
 
-app = Flask(__name__)
-app.config['SECRET_KEY'] = os.getenv('FLASK_SECRET_KEY', 'secure_chat_secret_key_2024')
-socketio = SocketIO(app, cors_allowed_origins="*", async_mode='threading')
+# Routes and handlers attach here; create_app() binds them to an app
+web = Blueprint("web", __name__)
+socketio = SocketIO()
 
 # Track active users and their rooms
 active_users = {}
+sid_users = {}  # Reverse of active_users for O(1) lookups per event
 user_rooms = {}  # Track which rooms each user is in
 
+# Recently handled (sender, client_id) pairs; message_receipts is the durable copy
+MAX_CLIENT_ID_LENGTH = 64
+send_dedupe = DedupeWindow()
+
+def ai():
+    """ai_agent, imported on first use since it loads NumPy and the FAQ index"""
+    import ai_agent
+    return ai_agent
+
+def generate_ai_reply(message, seller_username, buyer_username):
+    return ai().ai_reply(message, seller_username, buyer_username)
+
 def get_room_name(user1, user2):
     """Generate deterministic room name from sorted usernames"""
     users = sorted([user1, user2])
     return f"{users[0]}_{users[1]}"
 
+def notify_inbox(receiver, sender, message_id):
+    """Tell an online receiver that a conversation has a new unread message"""
+    sid = active_users.get(receiver)
+    if sid and message_id:
+        socketio.emit("inbox_update", {"partner": sender, "message_id": message_id}, to=sid)
+
+def deliver_ai_reply(buyer, seller, reply):
+    """Save a debounced AI reply and send it to the conversation room"""
+    room = get_room_name(buyer, seller)
+    if reply is None:
+        socketio.emit("ai_error", {"message": "AI unavailable"}, room=room)
+        return
+    try:
+        reply_id = save_message(seller, buyer, encrypt_message(reply))
+        if reply_id:
+            ai().context_windows.append(buyer, seller, {
+                "id": reply_id,
+                "sender": seller,
+                "message": reply,
+                "timestamp": datetime.now()
+            })
+        
+        print(f"✅ AI response generated: '{reply[:50]}...'")
+        response_times.seller_reply(buyer, seller, is_ai=True)
+        
+        socketio.emit("receive_message", {
+            "id": reply_id,
+            "sender": seller,
+            "receiver": buyer,
+            "message": reply,
+            "timestamp": "now",
+            "is_ai": True
+        }, room=room)
+        
+        print(f"📤 AI response emitted to room: {room}")
+        
+        notify_inbox(buyer, seller, reply_id)
+    except Exception as e:
+        print(f"❌ AI response error: {e}")
+        socketio.emit("ai_error", {"message": "AI unavailable"}, room=room)
+
+reply_scheduler = ReplyScheduler(generate_ai_reply, deliver_ai_reply)
+metrics.register_gauge("ai_reply_queue", reply_scheduler.depth)
+
+socket_limiter = SocketLimiter()
+handler_stats = HandlerStats()
+profiler = Profiler()
+response_times = ResponseTimeTracker(merge_response_sketches, get_response_sketches)
+authenticator = Authenticator(get_password_hash, update_password_hash)
+sessions = SessionManager(SECRET_KEY)
+metrics.register_gauge("cached_sessions", sessions.__len__)
+admission = AdmissionControl(db_pool.wait_ms, reply_scheduler.queue_depth)
+
+def session_user(data):
+    """User this socket acts as: its login, or a valid session token sent along with the event"""
+    username = sid_users.get(request.sid)
+    if username is None:
+        username = sessions.verify(data.get("token"))
+        if username:
+            sid_users[request.sid] = username
+    return username
+
+def throttled(event):
+    """Reject an event over its rate limit, or while the server sheds load, with rate_limited"""
+    def decorator(handler):
+        @functools.wraps(handler)
+        def wrapper(*args):
+            sid = request.sid
+            allowed, retry_after = socket_limiter.check(event, sid, sid_users.get(sid))
+            reason = "rate" if not allowed else None
+            if allowed:
+                allowed, reason, retry_after = admission.check(event)
+            if not allowed:
+                metrics.increment(f"socket_rejected_{event}")
+                payload = {"event": event, "reason": reason, "retry_after": round(retry_after, 2)}
+                emit("rate_limited", payload)
+                return {"ok": False, "error": "rate_limited", **payload}
+            token = profiler.begin(event) if profiler.active else None
+            start = time.perf_counter()
+            try:
+                return handler(*args)
+            finally:
+                handler_stats.record(event, time.perf_counter() - start)
+                if token is not None:
+                    profiler.end(token)
+        return wrapper
+    return decorator
+
+warmup_state = {"ready": False, "seconds": None, "steps": {}}
+
+def warmup():
+    """Open DB connections, fill caches and load subsystems before the node reports ready"""
+    start = time.monotonic()
+    steps = [
+        # Make sure inserts always have a monthly partition to land in
+        ("partitions", ensure_partitions),
+        ("db_pool", lambda: db_pool.prefill(WARMUP_DB_CONNECTIONS)),
+        ("caches", lambda: warm_caches(WARMUP_MAX_USERS, WARMUP_MAX_CONVERSATIONS)),
+        ("crypto", lambda: get_keyring().current_version),
+        ("ai", lambda: len(ai().faq_engine.stats())),
+        ("auth", authenticator.warm)
+    ]
+    ready = True
+    for name, step in steps:
+        step_start = time.monotonic()
+        try:
+            result = step()
+            warmup_state["steps"][name] = {"ok": True, "result": result}
+        except Exception as e:
+            ready = False
+            warmup_state["steps"][name] = {"ok": False, "error": str(e)}
+            print(f"⚠️ Warmup step {name} failed: {e}")
+        warmup_state["steps"][name]["ms"] = round((time.monotonic() - step_start) * 1000, 1)
+    
+    warmup_state["seconds"] = round(time.monotonic() - start, 3)
+    warmup_state["ready"] = ready
+    print(f"{'✅' if ready else '⚠️'} Warmup finished in {warmup_state['seconds']}s, ready: {ready}")
+    return ready
+
+def create_app(config=None):
+    """Build the Flask app; subsystems load on first use or in warmup()"""
+    app = Flask(__name__)
+    app.config['SECRET_KEY'] = SECRET_KEY
+    if config:
+        app.config.update(config)
+    app.jinja_env.globals["asset_url"] = assets.asset_url
+    app.register_blueprint(web)
+    socketio.init_app(app, cors_allowed_origins="*", async_mode='threading')
+    return app
+
+def ops_snapshot():
+    """Aggregate state for the ops dashboard, computed once per tick for all viewers"""
+    elapsed, counts, latency = handler_stats.drain()
+    rooms = dict(socketio.server.manager.rooms.get("/", {})) if socketio.server else {}
+    # Every socket sits in the None room and in a room named after its own sid
+    chat_rooms = [members for name, members in rooms.items() if name is not None and name not in members]
+    p50, p99 = latency.quantile(0.5), latency.quantile(0.99)
+    return {
+        "time": datetime.now().isoformat(timespec="seconds"),
+        "ready": warmup_state["ready"],
+        "sockets": len(rooms.get(None, {})),
+        "connected_users": len(active_users),
+        "rooms": len(chat_rooms),
+        "room_members": sum(len(members) for members in chat_rooms),
+        "messages_per_sec": round(counts.get("send_message", 0) / elapsed, 2),
+        "events_per_sec": {event: round(count / elapsed, 2) for event, count in counts.items()},
+        "ai_queue": reply_scheduler.queue_depth(),
+        "db_pool": db_pool.stats(),
+        "handler_latency_ms": {
+            "count": latency.count,
+            "p50": round(p50, 2) if p50 is not None else None,
+            "p99": round(p99, 2) if p99 is not None else None
+        }
+    }
+
+ops_broadcaster = OpsBroadcaster(socketio, ops_snapshot)
+
 def log_room_membership():
     """Debug: Log current room membership"""
     try:
@@ -36,15 +237,69 @@ def log_room_membership():
     except Exception as e:
         print(f"🔍 Room membership debug error: {e}")
 
-@app.route("/")
+def request_user():
+    """User whose session token is in X-Session-Token, or None"""
+    return sessions.verify(request.headers.get("X-Session-Token"))
+
+def ops_token_valid(token):
+    """Ops access needs OPS_TOKEN; without it set everything ops is refused"""
+    return bool(OPS_TOKEN) and hmac.compare_digest(token or "", OPS_TOKEN)
+
+def ops_authorized():
+    """Admin requests carry OPS_TOKEN in X-Ops-Token, or ?token= for the dashboard page"""
+    return ops_token_valid(request.headers.get("X-Ops-Token") or request.args.get("token"))
+
+@web.before_request
+def begin_request_profile():
+    if profiler.active:
+        g.profile_token = profiler.begin(request.endpoint or "unknown")
+
+@web.teardown_request
+def end_request_profile(exc):
+    token = g.pop("profile_token", None)
+    if token is not None:
+        profiler.end(token)
+
+def cached_page(template):
+    """Serve a rendered page from memory, gzipped when the client accepts it"""
+    if not assets.PAGE_CACHE or current_app.debug:
+        return render_template(template)
+    page = assets.page_cache.get(template, render_template)
+    if page.etag in request.if_none_match:
+        response = current_app.response_class(status=304)
+    elif "gzip" in request.headers.get("Accept-Encoding", ""):
+        response = current_app.response_class(page.gzip, mimetype="text/html")
+        response.headers["Content-Encoding"] = "gzip"
+    else:
+        response = current_app.response_class(page.body, mimetype="text/html")
+    response.set_etag(page.etag)
+    response.headers["Vary"] = "Accept-Encoding"
+    response.headers["Cache-Control"] = f"public, max-age={assets.PAGE_CACHE_MAX_AGE}"
+    return response
+
+@web.route("/")
 def home():
-    return render_template("cyberpunk.html")
+    return cached_page("cyberpunk.html")
 
-@app.route("/classic")
+@web.route("/classic")
 def classic():
-    return render_template("chat.html")
+    return cached_page("chat.html")
 
-@app.route("/api/contacts/<role>")
+@web.route("/assets/<path:filename>")
+def serve_asset(filename):
+    """Hashed build output from assets.py: precompressed and cached for good"""
+    path, encoding = assets.manifest.resolve(filename, request.headers.get("Accept-Encoding", ""))
+    if path is None:
+        abort(404)
+    response = send_file(path, mimetype=mimetypes.guess_type(filename)[0], conditional=True,
+                         max_age=assets.ASSET_MAX_AGE)
+    if encoding:
+        response.headers["Content-Encoding"] = encoding
+    response.headers["Vary"] = "Accept-Encoding"
+    response.headers["Cache-Control"] = f"public, max-age={assets.ASSET_MAX_AGE}, immutable"
+    return response
+
+@web.route("/api/contacts/<role>")
 def get_contacts(role):
     """Get list of users by role"""
     if role not in ['buyer', 'seller']:
@@ -53,7 +308,18 @@ def get_contacts(role):
     users = get_users_by_role(role)
     return jsonify({"users": users})
 
-@app.route("/api/history/<buyer_username>/<seller_username>")
+@web.route("/api/bootstrap")
+def get_session_bootstrap():
+    """Contacts, recent conversations, unread counts and message previews of the session's user"""
+    username = request_user()
+    if not username:
+        return jsonify({"error": "Session expired"}), 401
+    bootstrap = get_bootstrap(username)
+    if bootstrap is None:
+        return jsonify({"error": "Unknown user"}), 404
+    return jsonify(bootstrap)
+
+@web.route("/api/history/<buyer_username>/<seller_username>")
 def get_history(buyer_username, seller_username):
     """Get message history between two users"""
     limit = request.args.get('limit', 50, type=int)
@@ -62,14 +328,52 @@ def get_history(buyer_username, seller_username):
     history = get_message_history(buyer_username, seller_username, limit, offset)
     return jsonify(history)
 
-@app.route("/api/conversations/<username>")
+@web.route("/api/history/batch", methods=["POST"])
+def get_history_batch_route():
+    """Last messages of many conversations in one request, e.g. a seller dashboard"""
+    # Conversations are filtered by this user, so it must come from the session
+    username = request_user()
+    if not username:
+        return jsonify({"error": "Session expired"}), 401
+    data = request.get_json(silent=True) or {}
+    items = data.get("items")
+    limit = data.get("limit", 20)
+    
+    if not isinstance(items, list) or not items:
+        return jsonify({"error": "A non-empty items list is required"}), 400
+    if len(items) > HISTORY_BATCH_MAX_ITEMS:
+        return jsonify({"error": f"At most {HISTORY_BATCH_MAX_ITEMS} items per batch"}), 400
+    if not isinstance(limit, int) or limit < 1:
+        return jsonify({"error": "limit must be a positive integer"}), 400
+    
+    for item in items:
+        if not isinstance(item, dict):
+            return jsonify({"error": "Each item must be an object"}), 400
+        has_id = isinstance(item.get("conversation_id"), int)
+        has_pair = isinstance(item.get("buyer"), str) and isinstance(item.get("seller"), str)
+        if not has_id and not has_pair:
+            return jsonify({"error": "Each item needs conversation_id or buyer and seller"}), 400
+        if item.get("before_id") is not None and not isinstance(item["before_id"], int):
+            return jsonify({"error": "before_id must be a message ID"}), 400
+    
+    results = get_history_batch(username, items, min(limit, HISTORY_BATCH_MAX_LIMIT))
+    metrics.increment("history_batch_requests")
+    metrics.increment("history_batch_items", len(items))
+    return jsonify({"results": results})
+
+@web.route("/api/conversations/<username>")
 def get_conversations(username):
     """Get recent conversations for a user"""
     limit = request.args.get('limit', 10, type=int)
     conversations = get_recent_conversations(username, limit)
     return jsonify({"conversations": conversations})
 
-@app.route("/api/search")
+@web.route("/api/inbox/<username>")
+def get_user_inbox(username):
+    """Unread counts and last message per conversation"""
+    return jsonify(get_inbox(username))
+
+@web.route("/api/search")
 def search():
     """Search messages within a conversation"""
     username = request.args.get('username')
@@ -83,14 +387,153 @@ def search():
     results = search_messages(username, partner, query, limit)
     return jsonify({"results": results})
 
-@app.route("/api/statistics/<username>")
+@web.route("/api/statistics/<username>")
 def get_statistics(username):
     """Get message statistics for a user"""
     days = request.args.get('days', 30, type=int)
     stats = get_message_statistics(username, days)
     return jsonify(stats)
 
-@app.route("/api/delete-message/<int:message_id>", methods=['DELETE'])
+@web.route("/api/analytics/seller/<username>")
+def seller_analytics(username):
+    """Response-time percentiles (human, AI and overall) from per-day sketches"""
+    user_info = get_user_id(username)
+    if not user_info or user_info[1] != 'seller':
+        return jsonify({"error": "Unknown seller"}), 404
+    days = request.args.get('days', 30, type=int)
+    return jsonify(response_times.report(username, days))
+
+@web.route("/api/export/<buyer_username>/<seller_username>")
+def export_history(buyer_username, seller_username):
+    """Export the full message history, including archived partitions"""
+    messages = export_conversation(buyer_username, seller_username)
+    return jsonify({"messages": messages, "total_count": len(messages)})
+
+@web.route("/api/metrics")
+def get_metrics():
+    """Get process counters and gauges"""
+    if not ops_authorized():
+        return jsonify({"error": "Forbidden"}), 403
+    return jsonify(metrics.snapshot())
+
+@web.route("/ops")
+def ops_dashboard():
+    if not ops_authorized():
+        return jsonify({"error": "Forbidden"}), 403
+    # Not through the public page cache: the URL carries the token
+    return render_template("ops.html")
+
+@web.route("/api/attachments", methods=["POST"])
+def upload_attachment():
+    """Stream the request body into the encrypted attachment store; the ID goes into send_message"""
+    username = sessions.verify(request.headers.get("X-Session-Token"))
+    if not username:
+        return jsonify({"error": "Session expired"}), 401
+    if request.content_length is not None and request.content_length > attachment_store.max_bytes:
+        return jsonify({"error": f"Attachments are limited to {attachment_store.max_bytes} bytes"}), 413
+    # Percent-encoded by the client, since header values are ASCII
+    filename = os.path.basename(unquote(request.headers.get("X-Filename", "")).replace("\\", "/"))
+    filename = "".join(ch for ch in filename if ch.isprintable())[:255] or None
+    
+    try:
+        address, size, content_type, created = attachment_store.put(request.stream)
+    except AttachmentTooLarge as e:
+        return jsonify({"error": str(e)}), 413
+    except UnsupportedType as e:
+        return jsonify({"error": str(e)}), 415
+    except AttachmentError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    attachment_id = save_attachment(username, address, size, content_type, filename)
+    metrics.increment("attachments_uploaded")
+    if not created:
+        metrics.increment("attachments_deduplicated")
+    print(f"📎 {username} uploaded {filename or 'attachment'} ({size} bytes, {'new' if created else 'deduplicated'})")
+    return jsonify({"id": attachment_id, "filename": filename, "content_type": content_type, "size": size}), 201
+
+@web.route("/api/attachments/<int:attachment_id>")
+def download_attachment(attachment_id):
+    """Decrypt an attachment (or a byte range of it) chunk by chunk for a participant"""
+    # img and a elements cannot set headers, so the token may come in the query string
+    token = request.headers.get("X-Session-Token") or request.args.get("token")
+    username = sessions.verify(token)
+    if not username:
+        return jsonify({"error": "Session expired"}), 401
+    attachment = get_attachment(attachment_id, username)
+    if not attachment:
+        return jsonify({"error": "Attachment not found"}), 404
+    if attachment["address"] in request.if_none_match:
+        response = current_app.response_class(status=304)
+        response.set_etag(attachment["address"])
+        return response
+    
+    try:
+        stored = attachment_store.open(attachment["address"])
+    except FileNotFoundError:
+        print(f"❌ Attachment {attachment_id} missing from the store")
+        return jsonify({"error": "Attachment not found"}), 404
+    try:
+        span = parse_range(request.headers.get("Range"), stored.size)
+    except ValueError:
+        stored.close()
+        response = current_app.response_class(status=416)
+        response.headers["Content-Range"] = f"bytes */{stored.size}"
+        return response
+    start, end = span or (0, stored.size)
+    
+    response = current_app.response_class(stored.iter_range(start, end), status=206 if span else 200,
+                                          mimetype=attachment["content_type"], direct_passthrough=True)
+    response.call_on_close(stored.close)
+    response.headers["Content-Length"] = str(end - start)
+    response.headers["Accept-Ranges"] = "bytes"
+    if span:
+        response.headers["Content-Range"] = f"bytes {start}-{end - 1}/{stored.size}"
+    inline = attachment["content_type"].startswith("image/") or attachment["content_type"] == "application/pdf"
+    filename = attachment["filename"] or f"attachment-{attachment_id}"
+    response.headers["Content-Disposition"] = f"{'inline' if inline else 'attachment'}; filename*=UTF-8''{quote(filename)}"
+    response.headers["X-Content-Type-Options"] = "nosniff"
+    # Content-addressed, so a cached copy never goes stale
+    response.set_etag(attachment["address"])
+    response.headers["Cache-Control"] = "private, max-age=31536000, immutable"
+    return response
+
+@web.route("/api/admin/profile", methods=["GET", "POST"])
+def profile_control():
+    """Start or stop a bounded profiling session; GET reports the current and last one"""
+    if not ops_authorized():
+        return jsonify({"error": "Forbidden"}), 403
+    if request.method == "GET":
+        return jsonify(profiler.status())
+    
+    data = request.get_json(silent=True) or {}
+    action = data.get("action", "start")
+    if action == "stop":
+        session = profiler.stop()
+        return jsonify({"stopped": session}) if session else (jsonify({"error": "Not profiling"}), 409)
+    if action != "start":
+        return jsonify({"error": "action must be start or stop"}), 400
+    
+    mode = data.get("mode", "sample")
+    seconds = data.get("seconds")
+    every = data.get("every", 10)
+    if mode not in PROFILE_MODES:
+        return jsonify({"error": f"mode must be one of {', '.join(PROFILE_MODES)}"}), 400
+    if seconds is not None and (not isinstance(seconds, (int, float)) or seconds <= 0):
+        return jsonify({"error": "seconds must be positive"}), 400
+    if not isinstance(every, int) or every < 1:
+        return jsonify({"error": "every must be a positive integer"}), 400
+    
+    session = profiler.start(mode, seconds, every)
+    if session is None:
+        return jsonify({"error": "Already profiling", **profiler.status()}), 409
+    return jsonify({"started": session})
+
+@web.route("/readyz")
+def readyz():
+    """200 once warmup() has finished, so rolling restarts only route to warm nodes"""
+    return jsonify(warmup_state), 200 if warmup_state["ready"] else 503
+
+@web.route("/api/delete-message/<int:message_id>", methods=['DELETE'])
 def delete_message_route(message_id):
     """Delete a message"""
     username = request.json.get('username')
@@ -118,6 +561,9 @@ def handle_disconnect():
             username_to_remove = username
             break
     
+    sid_users.pop(request.sid, None)
+    socket_limiter.forget(request.sid)
+    
     if username_to_remove:
         del active_users[username_to_remove]
         # Remove from room tracking
@@ -130,18 +576,54 @@ def handle_disconnect():
     
     log_room_membership()
 
+@socketio.on("connect", namespace=OPS_NAMESPACE)
+def handle_ops_connect(auth=None):
+    """Subscribe to the one-per-second ops snapshot; refused unless the OPS_TOKEN is presented"""
+    token = (auth or {}).get("token") or request.args.get("token")
+    if not ops_token_valid(token):
+        print(f"❌ Ops subscriber {request.sid} rejected")
+        return False
+    latest = ops_broadcaster.subscribe()
+    if latest:
+        emit("snapshot", latest)
+
+@socketio.on("disconnect", namespace=OPS_NAMESPACE)
+def handle_ops_disconnect():
+    ops_broadcaster.unsubscribe()
+
 @socketio.on("login")
+@throttled("login")
 def handle_login(data):
     username = data.get("username")
     password = data.get("password")
+    token = data.get("token")
     
     print(f"🔐 Login attempt: {username}")
     
-    # Validate user (simple password check for demo)
-    if password != "soweto311" or not username:
-        print(f"❌ Login failed for {username}")
-        emit("login_error", {"message": "Invalid credentials"})
-        return
+    # Reconnects present their session token and skip the password hash entirely
+    if token:
+        token_user = sessions.verify(token)
+        if not token_user or (username and username != token_user):
+            print(f"❌ Session resume failed for {username}")
+            emit("login_error", {"message": "Session expired", "expired": True})
+            return
+        username = token_user
+        metrics.increment("login_resumed")
+    else:
+        if not username or not password:
+            emit("login_error", {"message": "Invalid credentials"})
+            return
+        try:
+            verified = authenticator.verify(username, password)
+        except LoginBusy:
+            print(f"⏳ Login queue full, refusing {username}")
+            emit("login_error", {"message": "Server busy, try again shortly", "retry_after": 2})
+            return
+        if not verified:
+            print(f"❌ Login failed for {username}")
+            emit("login_error", {"message": "Invalid credentials"})
+            return
+        token = sessions.issue(username)
     
     # Handle reconnection - remove old session if exists
     if username in active_users:
@@ -150,10 +632,20 @@ def handle_login(data):
     
     # Add to active users
     active_users[username] = request.sid
+    sid_users[request.sid] = username
     print(f"✅ Login successful: {username} (SID: {request.sid})")
-    emit("login_success", {"username": username})
+    emit("login_success", {"username": username, "token": token, "expires_in": sessions.ttl})
+    
+    # Everything that arrived while offline, in one push instead of N history loads
+    try:
+        inbox = get_inbox(username)
+        emit("inbox", inbox)
+        print(f"📥 Inbox sent to {username}: {inbox['total_unread']} unread in {len(inbox['conversations'])} conversation(s)")
+    except Exception as e:
+        print(f"⚠️ Inbox for {username} failed: {e}")
 
 @socketio.on("join_chat")
+@throttled("join_chat")
 def handle_join_chat(data):
     username = data.get("username")
     partner_username = data.get("partner")
@@ -164,6 +656,11 @@ def handle_join_chat(data):
         print("❌ Missing username or partner")
         return
     
+    if session_user(data) != username:
+        print(f"❌ Socket {request.sid} is not logged in as {username}")
+        emit("login_error", {"message": "Please log in again", "expired": True})
+        return
+    
     # Get user roles for permission checking
     user_info = get_user_id(username)
     partner_info = get_user_id(partner_username)
@@ -184,28 +681,71 @@ def handle_join_chat(data):
     # Generate deterministic room name
     room = get_room_name(username, partner_username)
     
-    # Check if user is already in this room
+    # join_room is idempotent; a reconnected socket has a new sid that must join again
+    join_room(room)
     if username not in user_rooms:
         user_rooms[username] = []
-    
     if room not in user_rooms[username]:
-        # Join the room
-        join_room(room)
         user_rooms[username].append(room)
         print(f"✅ {username} joined room: {room}")
     else:
-        print(f"ℹ️ {username} already in room: {room}")
+        print(f"ℹ️ {username} rejoined room: {room}")
     
     # Send confirmation
     emit("joined_chat", {"room": room, "partner": partner_username})
     
-    # Load and send message history
-    history_data = get_message_history(username, partner_username, limit=50)
-    emit("chat_history", history_data)
+    if not data.get("sync"):
+        # Clients without a local message store get the full history page
+        history_data = get_message_history(username, partner_username, limit=50)
+        emit("chat_history", history_data)
+        print(f"📚 Sent chat history for {username} <-> {partner_username}")
+        return
+    
+    # Delta sync: only what the client's store is missing
+    last_seen_id = data.get("last_seen_id")
+    if last_seen_id is not None and (not isinstance(last_seen_id, int) or last_seen_id < 0):
+        last_seen_id = None
+    buyer, seller = (username, partner_username) if user_role == 'buyer' else (partner_username, username)
+    sync = get_messages_since(buyer, seller, last_seen_id)
+    
+    if sync["resync"]:
+        metrics.increment("chat_sync_resyncs")
+        print(f"🔁 {username} too far behind in {room}, asking for refetch")
+        emit("chat_resync", {"partner": partner_username, "room": room})
+        return
+    
+    metrics.increment(f"chat_sync_{sync['mode']}s")
+    emit("chat_sync", {
+        "partner": partner_username,
+        "room": room,
+        "mode": sync["mode"],
+        "messages": sync["messages"],
+        "latest_id": sync["latest_id"]
+    })
+    print(f"📚 Sent {sync['mode']} of {len(sync['messages'])} message(s) for {username} <-> {partner_username}")
+
+@socketio.on("mark_read")
+@throttled("mark_read")
+def handle_mark_read(data):
+    """Clear unread messages up to last_read_id; the ack carries what is still unread"""
+    username = data.get("username")
+    partner_username = data.get("partner")
+    last_read_id = data.get("last_read_id")
     
-    print(f"📚 Sent chat history for {username} <-> {partner_username}")
+    if not username or not partner_username:
+        return {"ok": False, "error": "missing_data"}
+    if session_user(data) != username:
+        return {"ok": False, "error": "unauthorized"}
+    if last_read_id is not None and not isinstance(last_read_id, int):
+        return {"ok": False, "error": "invalid_last_read_id"}
+    
+    unread = mark_conversation_read(username, partner_username, last_read_id)
+    if unread is None:
+        return {"ok": False, "error": "unknown_conversation"}
+    return {"ok": True, "partner": partner_username, "unread": unread}
 
 @socketio.on("leave_chat")
+@throttled("leave_chat")
 def handle_leave_chat(data):
     username = data.get("username")
     partner_username = data.get("partner")
@@ -222,25 +762,15 @@ def handle_leave_chat(data):
             if not user_rooms[username]:
                 del user_rooms[username]
 
-@socketio.on("send_message")
-def handle_message(data):
-    sender = data.get("sender")
-    receiver = data.get("receiver")
-    message = data.get("message")
-    
-    print(f"💬 Message: {sender} -> {receiver}: '{message[:50]}...'")
-    
-    if not sender or not receiver or not message:
-        print("❌ Missing message data")
-        return
-    
+def store_message(sender, receiver, message, client_id=None, attachment_id=None):
+    """Validate, encrypt, save and broadcast a chat message; returns the ack payload"""
     # Get user roles for permission checking
     sender_info = get_user_id(sender)
     receiver_info = get_user_id(receiver)
     
     if not sender_info or not receiver_info:
         print(f"❌ User info not found for {sender} or {receiver}")
-        return
+        return {"ok": False, "error": "unknown_user", "client_id": client_id}
     
     sender_id, sender_role = sender_info
     receiver_id, receiver_role = receiver_info
@@ -249,7 +779,23 @@ def handle_message(data):
     if not ((sender_role == 'buyer' and receiver_role == 'seller') or 
             (sender_role == 'seller' and receiver_role == 'buyer')):
         print(f"❌ Invalid role combination: {sender_role} -> {receiver_role}")
-        return
+        return {"ok": False, "error": "invalid_roles", "client_id": client_id}
+    
+    # A retry of a send another node (or an earlier process) already stored
+    if client_id:
+        existing_id = get_message_receipt(sender, client_id)
+        if existing_id:
+            metrics.increment("send_duplicates")
+            print(f"♻️ Duplicate send {client_id} from {sender}, already stored as {existing_id}")
+            return {"ok": True, "id": existing_id, "client_id": client_id, "duplicate": True}
+    
+    # Only the uploader may attach a file; the message then grants the receiver access
+    attachment = None
+    if attachment_id is not None:
+        attachment = get_attachment(attachment_id, sender, sent_only=True)
+        if not attachment:
+            return {"ok": False, "error": "invalid_attachment", "client_id": client_id}
+        attachment = {key: attachment[key] for key in ("id", "filename", "content_type", "size")}
     
     # Generate deterministic room name
     room = get_room_name(sender, receiver)
@@ -260,51 +806,112 @@ def handle_message(data):
     encrypted = encrypt_message(message)
     
     # Save to database
-    if not save_message(sender, receiver, encrypted):
+    if client_id:
+        message_id, created = save_message_once(sender, receiver, encrypted, client_id, attachment_id)
+    else:
+        message_id, created = save_message(sender, receiver, encrypted, attachment_id), True
+    if not message_id:
         print("❌ Failed to save message to database")
-        emit("send_error", {"message": "Failed to save message"})
-        return
+        emit("send_error", {"message": "Failed to save message", "client_id": client_id})
+        return {"ok": False, "error": "save_failed", "client_id": client_id}
+    if not created:
+        metrics.increment("send_duplicates")
+        return {"ok": True, "id": message_id, "client_id": client_id, "duplicate": True}
     
     print("✅ Message saved to database")
     
-    # Send message to deterministic room
+    # Keep the AI context window current without re-reading the database
+    buyer, seller = (sender, receiver) if sender_role == 'buyer' else (receiver, sender)
+    if attachment and not message:
+        message_for_ai = f"[sent {attachment['filename'] or 'an attachment'}]"
+    else:
+        message_for_ai = message
+    if sender_role == 'buyer':
+        response_times.buyer_message(buyer, seller)
+    else:
+        response_times.seller_reply(buyer, seller)
+    ai().context_windows.append(buyer, seller, {
+        "id": message_id,
+        "sender": sender,
+        "message": message_for_ai,
+        "timestamp": datetime.now()
+    })
+    
+    # Send message to deterministic room; client_id lets the sender match its pending bubble
     emit("receive_message", {
+        "id": message_id,
+        "client_id": client_id,
         "sender": sender,
         "receiver": receiver,
         "message": message,
+        "attachment": attachment,
         "timestamp": "now"  # Frontend will format
     }, room=room)
     
     print(f"📤 Message emitted to room: {room}")
     
-    # AI responds ONLY when buyer talks to seller
+    notify_inbox(receiver, sender, message_id)
+    
+    # AI responds ONLY when buyer talks to seller; rapid messages share one reply
     if sender_role == 'buyer' and receiver_role == 'seller':
-        print(f"🤖 Generating AI response for {receiver}")
-        
-        # Generate AI response in background
-        try:
-            reply = ai_reply(message, receiver, sender)
-            
-            # Save AI message to database
-            encrypted_reply = encrypt_message(reply)
-            save_message(receiver, sender, encrypted_reply)
-            
-            print(f"✅ AI response generated: '{reply[:50]}...'")
-            
-            # Send AI response to same room
-            emit("receive_message", {
-                "sender": receiver,
-                "receiver": sender,
-                "message": reply,
-                "timestamp": "now",
-                "is_ai": True
-            }, room=room)
-            
-            print(f"📤 AI response emitted to room: {room}")
-            
-        except Exception as e:
-            print(f"❌ AI response error: {e}")
-            emit("ai_error", {"message": "AI unavailable"})
+        print(f"🤖 Queuing AI response for {receiver}")
+        reply_scheduler.submit(sender, receiver, message_for_ai)
+    
+    return {"ok": True, "id": message_id, "client_id": client_id, "duplicate": False}
+
+@socketio.on("send_message")
+@throttled("send_message")
+def handle_message(data):
+    """Store a message; the return value is the client's ack"""
+    sender = data.get("sender")
+    receiver = data.get("receiver")
+    message = data.get("message") or ""
+    # Client-generated ID, reused on every retry of the same send
+    client_id = data.get("client_id")
+    # From POST /api/attachments; the text may then be empty
+    attachment_id = data.get("attachment_id")
+    
+    if not sender or not receiver or not (message or attachment_id):
+        print("❌ Missing message data")
+        return {"ok": False, "error": "missing_data", "client_id": client_id}
+    
+    if attachment_id is not None and (not isinstance(attachment_id, int) or isinstance(attachment_id, bool)):
+        return {"ok": False, "error": "invalid_attachment", "client_id": client_id}
+    
+    if session_user(data) != sender:
+        print(f"❌ Socket {request.sid} is not logged in as {sender}")
+        return {"ok": False, "error": "unauthorized", "client_id": client_id}
+    
+    if client_id is not None and (not isinstance(client_id, str) or not 0 < len(client_id) <= MAX_CLIENT_ID_LENGTH):
+        print(f"❌ Invalid client message ID from {sender}")
+        return {"ok": False, "error": "invalid_client_id"}
+    
+    print(f"💬 Message: {sender} -> {receiver}: '{message[:50]}...'")
+    
+    if not client_id:
+        return store_message(sender, receiver, message, attachment_id=attachment_id)
+    
+    # Retries racing the original send on this node wait for its result
+    # instead of encrypting, inserting and triggering the AI again
+    key = (sender, client_id)
+    owner, pending = send_dedupe.claim(key)
+    if not owner:
+        message_id = send_dedupe.wait(pending)
+        if not message_id:
+            return {"ok": False, "error": "retry", "client_id": client_id}
+        metrics.increment("send_duplicates")
+        print(f"♻️ Duplicate send {client_id} from {sender}, already stored as {message_id}")
+        return {"ok": True, "id": message_id, "client_id": client_id, "duplicate": True}
+    
+    ack = None
+    try:
+        ack = store_message(sender, receiver, message, client_id, attachment_id)
+    finally:
+        if ack and ack["ok"]:
+            send_dedupe.complete(key, ack["id"])
+        else:
+            send_dedupe.release(key)
+    return ack
 
 if __name__ == "__main__":
     print("🚀 Starting Secure Marketplace Chat Server...")
@@ -312,6 +919,16 @@ if __name__ == "__main__":
     print(f"🌐 Host: 0.0.0.0:5001")
     print(f"🔐 Tor Hidden Service: Ready")
     
+    app = create_app()
+    # Serve /readyz (503) while warming up instead of blocking startup
+    threading.Thread(target=warmup, name="warmup", daemon=True).start()
+    # warmup() creates the partitions ahead once; this keeps doing it while the node runs
+    keep_partitions_ahead()
+    atexit.register(response_times.flush)
+    # kill -USR2 <pid> starts a default sampling session, a second one stops it early
+    if hasattr(signal, "SIGUSR2"):
+        signal.signal(signal.SIGUSR2, lambda signum, frame: threading.Thread(target=profiler.toggle, daemon=True).start())
+    
     socketio.run(
         app,
         host="0.0.0.0",
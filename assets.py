@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""
+Fingerprinted, precompressed static assets.
+
+    python assets.py build    # minify, hash and compress static assets into static/dist
+    python assets.py list     # show the current manifest
+
+Templates reference assets through asset_url(), which points at the hashed
+copy once a build exists and at /static otherwise.
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import re
+import sys
+import threading
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+STATIC_DIR = os.getenv('STATIC_DIR', 'static')
+ASSET_DIST_DIR = os.getenv('ASSET_DIST_DIR', os.path.join(STATIC_DIR, 'dist'))
+ASSET_MANIFEST = os.path.join(ASSET_DIST_DIR, 'manifest.json')
+ASSETS = ["cyberpunk.js", "cyberpunk.css", "style.css"]
+# Hashed names never change content, so browsers may keep them for a year
+ASSET_MAX_AGE = 365 * 24 * 3600
+PAGE_CACHE_MAX_AGE = int(os.getenv('PAGE_CACHE_MAX_AGE', 60))
+PAGE_CACHE = os.getenv('PAGE_CACHE', 'True') == 'True'
+
+_CSS_COMMENT = re.compile(r"/\*.*?\*/", re.S)
+_CSS_SPACE = re.compile(r"\s+")
+_CSS_PUNCTUATION = re.compile(r"\s*([{};,])\s*")
+
+def minify_css(text):
+    text = _CSS_COMMENT.sub("", text)
+    text = _CSS_SPACE.sub(" ", text)
+    return _CSS_PUNCTUATION.sub(r"\1", text).replace(";}", "}").strip()
+
+def minify_js(text):
+    """Drop indentation, blank lines and whole-line // comments; newlines stay for ASI"""
+    lines = []
+    for line in text.splitlines():
+        line = line.strip()
+        if line and not line.startswith("//"):
+            lines.append(line)
+    return "\n".join(lines) + "\n"
+
+def minify(name, text):
+    if name.endswith(".css"):
+        return minify_css(text)
+    if name.endswith(".js"):
+        return minify_js(text)
+    return text
+
+def fingerprint(name, data):
+    """'cyberpunk.js' -> 'cyberpunk.<12 hex digits of sha256>.js'"""
+    stem, ext = os.path.splitext(name)
+    return f"{stem}.{hashlib.sha256(data).hexdigest()[:12]}{ext}"
+
+def build(static_dir=STATIC_DIR, dist_dir=ASSET_DIST_DIR, names=ASSETS):
+    """Write minified, hashed assets with .gz (and .br) siblings plus manifest.json"""
+    os.makedirs(dist_dir, exist_ok=True)
+    manifest = {}
+    for name in names:
+        with open(os.path.join(static_dir, name), encoding="utf-8") as f:
+            source = f.read()
+        data = minify(name, source).encode("utf-8")
+        hashed = fingerprint(name, data)
+        path = os.path.join(dist_dir, hashed)
+
+        with open(path, "wb") as f:
+            f.write(data)
+        # mtime=0 keeps rebuilds byte-identical
+        with open(path + ".gz", "wb") as f:
+            f.write(gzip.compress(data, 9, mtime=0))
+        if brotli is not None:
+            with open(path + ".br", "wb") as f:
+                f.write(brotli.compress(data, quality=11))
+
+        manifest[name] = hashed
+        print(f"📦 {name} -> {hashed} ({len(source.encode())} -> {len(data)} bytes)")
+
+    if brotli is None:
+        print("⚠️ brotli not installed, only gzip variants written")
+    tmp = os.path.join(dist_dir, "manifest.json.tmp")
+    with open(tmp, "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp, os.path.join(dist_dir, "manifest.json"))
+    return manifest
+
+class AssetManifest:
+    """Maps source asset names to their hashed copies in the dist directory"""
+
+    def __init__(self, dist_dir=ASSET_DIST_DIR):
+        self.dist_dir = dist_dir
+        self.files = {}
+        self.hashed = set()
+        self.version = ""
+        self.load()
+
+    def load(self):
+        path = os.path.join(self.dist_dir, "manifest.json")
+        try:
+            with open(path) as f:
+                self.files = json.load(f)
+        except FileNotFoundError:
+            self.files = {}
+        except ValueError as e:
+            print(f"⚠️ Asset manifest unreadable, serving unhashed assets: {e}")
+            self.files = {}
+        self.hashed = set(self.files.values())
+        self.version = hashlib.sha1(json.dumps(self.files, sort_keys=True).encode()).hexdigest()[:12]
+
+    def url(self, name):
+        hashed = self.files.get(name)
+        return f"/assets/{hashed}" if hashed else f"/static/{name}"
+
+    def resolve(self, filename, accept_encoding=""):
+        """Return (path, content_encoding) of the best variant, or (None, None) if unknown"""
+        if filename not in self.hashed:
+            return None, None
+        path = os.path.join(self.dist_dir, filename)
+        accepted = {part.split(";")[0].strip() for part in accept_encoding.lower().split(",")}
+        for encoding, suffix in (("br", ".br"), ("gzip", ".gz")):
+            if encoding in accepted and os.path.exists(path + suffix):
+                return path + suffix, encoding
+        return (path, None) if os.path.exists(path) else (None, None)
+
+class RenderedPage:
+    def __init__(self, body):
+        self.body = body
+        self.gzip = gzip.compress(body, 6, mtime=0)
+        self.etag = hashlib.sha1(body).hexdigest()[:16]
+
+class PageCache:
+    """Rendered template bytes and their gzip variant, kept until the manifest changes"""
+
+    def __init__(self, manifest):
+        self.manifest = manifest
+        self._pages = {}
+        self._lock = threading.Lock()
+
+    def get(self, template, render):
+        key = (template, self.manifest.version)
+        page = self._pages.get(key)
+        if page is None:
+            page = RenderedPage(render(template).encode("utf-8"))
+            with self._lock:
+                self._pages = {k: v for k, v in self._pages.items() if k[1] == self.manifest.version}
+                self._pages[key] = page
+        return page
+
+manifest = AssetManifest()
+page_cache = PageCache(manifest)
+
+def asset_url(name):
+    return manifest.url(name)
+
+def main():
+    command = sys.argv[1] if len(sys.argv) > 1 else "build"
+
+    if command == "build":
+        build()
+        print(f"✅ Assets built into {ASSET_DIST_DIR}")
+    elif command == "list":
+        for name, hashed in sorted(AssetManifest().files.items()):
+            print(f"   {name} -> {hashed}")
+    else:
+        print(__doc__)
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,234 @@
+"""
+Encrypted, content-addressed attachment storage with streaming writes and range reads
+"""
+
+import hashlib
+import hmac
+import mmap
+import os
+import re
+import struct
+import tempfile
+import threading
+from cryptography.fernet import InvalidToken
+from encryption import CIPHERTEXT_HEADER, get_keyring, get_or_create_key
+
+ATTACHMENT_DIR = os.getenv('ATTACHMENT_DIR', 'attachments')
+# Keys the content address, so equal files dedupe without revealing their hash
+ATTACHMENT_KEY_FILE = os.getenv('ATTACHMENT_KEY_FILE', 'attachment.key')
+ATTACHMENT_CHUNK_SIZE = int(os.getenv('ATTACHMENT_CHUNK_SIZE', 64 * 1024))
+ATTACHMENT_MAX_BYTES = int(os.getenv('ATTACHMENT_MAX_BYTES', 25 * 1024 * 1024))
+
+# File layout: header, then one record per chunk. Each record is binary
+# ciphertext (encryption.py format) of the chunk index followed by the chunk,
+# so every full chunk has the same record size and offsets are computable.
+FILE_HEADER = struct.Struct(">4sIQ")
+FILE_MAGIC = b"SMA1"
+CHUNK_INDEX = struct.Struct(">Q")
+
+# Leading bytes of the formats accepted; the client's Content-Type is not trusted
+ATTACHMENT_TYPES = (
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+    (b"%PDF-", "application/pdf"),
+)
+
+_ADDRESS = re.compile(r"^[0-9a-f]{64}$")
+_RANGE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+class AttachmentError(ValueError):
+    """An upload that cannot be stored"""
+
+class AttachmentTooLarge(AttachmentError):
+    pass
+
+class UnsupportedType(AttachmentError):
+    pass
+
+def sniff_type(head):
+    for magic, content_type in ATTACHMENT_TYPES:
+        if head.startswith(magic):
+            return content_type
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    return None
+
+def record_size(chunk_length):
+    """Bytes on disk for a chunk: header, Fernet overhead and CBC padding of index + chunk"""
+    padded = ((CHUNK_INDEX.size + chunk_length) // 16 + 1) * 16
+    return CIPHERTEXT_HEADER.size + 1 + 8 + 16 + padded + 32
+
+def parse_range(header, size):
+    """(start, end) with end exclusive for a single-range Range header; None for the whole
+    file, ValueError if unsatisfiable"""
+    if not header:
+        return None
+    match = _RANGE.match(header.strip())
+    if not match or match.groups() == ("", ""):
+        # Multiple or malformed ranges: serve the whole file, which the spec allows
+        return None
+    first, last = match.groups()
+    if first == "":
+        length = int(last)
+        if length == 0:
+            raise ValueError("empty suffix range")
+        return max(size - length, 0), size
+    start = int(first)
+    end = min(int(last) + 1, size) if last else size
+    if start >= size or end <= start:
+        raise ValueError("range not satisfiable")
+    return start, end
+
+class StoredAttachment:
+    """An open attachment file, read through mmap one chunk at a time"""
+
+    def __init__(self, path, keyring):
+        self.keyring = keyring
+        self._file = open(path, "rb")
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self._file.close()
+            raise
+        magic, self.chunk_size, self.size = FILE_HEADER.unpack_from(self._map)
+        if magic != FILE_MAGIC:
+            self.close()
+            raise InvalidToken("not an attachment file")
+        self._full_record = record_size(self.chunk_size)
+
+    def chunk(self, index):
+        start = index * self.chunk_size
+        length = min(self.chunk_size, self.size - start)
+        offset = FILE_HEADER.size + index * self._full_record
+        data = self.keyring.decrypt_bytes(self._map[offset:offset + record_size(length)])
+        # Records carry their index, so swapped or repeated chunks do not decrypt
+        if data[:CHUNK_INDEX.size] != CHUNK_INDEX.pack(index) or len(data) != CHUNK_INDEX.size + length:
+            raise InvalidToken(f"chunk {index} is out of place")
+        return data[CHUNK_INDEX.size:]
+
+    def iter_range(self, start=0, end=None):
+        """Plaintext bytes [start, end), decrypting only the chunks that overlap"""
+        end = self.size if end is None else min(end, self.size)
+        if start >= end:
+            return
+        for index in range(start // self.chunk_size, (end - 1) // self.chunk_size + 1):
+            base = index * self.chunk_size
+            data = self.chunk(index)
+            yield data[max(start - base, 0):end - base]
+
+    def read(self, start=0, end=None):
+        return b"".join(self.iter_range(start, end))
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class AttachmentStore:
+    """
+    Uploads are encrypted chunk by chunk into a temporary file while their keyed
+    hash is computed, then renamed to directory/ab/cd/<address>. A file whose
+    address already exists is dropped, so identical uploads share one copy.
+    Memory per upload is one chunk, whatever the file size.
+    """
+
+    def __init__(self, directory=ATTACHMENT_DIR, keyring=None, chunk_size=ATTACHMENT_CHUNK_SIZE,
+                 max_bytes=ATTACHMENT_MAX_BYTES, address_key=None):
+        self.directory = directory
+        self.chunk_size = chunk_size
+        self.max_bytes = max_bytes
+        self._keyring = keyring
+        self._address_key = address_key
+        self._lock = threading.Lock()
+
+    @property
+    def keyring(self):
+        return self._keyring or get_keyring()
+
+    @property
+    def address_key(self):
+        if self._address_key is None:
+            with self._lock:
+                if self._address_key is None:
+                    self._address_key = get_or_create_key(ATTACHMENT_KEY_FILE).strip()
+        return self._address_key
+
+    def path(self, address):
+        if not _ADDRESS.match(address):
+            raise ValueError("invalid attachment address")
+        return os.path.join(self.directory, address[:2], address[2:4], address)
+
+    def put(self, stream):
+        """Store everything read from stream; returns (address, size, content_type, created)"""
+        keyring = self.keyring
+        digest = hmac.new(self.address_key, digestmod=hashlib.sha256)
+        tmp_dir = os.path.join(self.directory, "tmp")
+        os.makedirs(tmp_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=tmp_dir)
+        try:
+            with os.fdopen(fd, "wb") as out:
+                out.write(FILE_HEADER.pack(FILE_MAGIC, self.chunk_size, 0))
+                size = index = 0
+                content_type = None
+                for chunk in self._chunks(stream):
+                    if index == 0:
+                        content_type = sniff_type(chunk)
+                        if content_type is None:
+                            raise UnsupportedType("only JPEG, PNG, GIF, WebP and PDF files are accepted")
+                    size += len(chunk)
+                    if size > self.max_bytes:
+                        raise AttachmentTooLarge(f"attachments are limited to {self.max_bytes} bytes")
+                    digest.update(chunk)
+                    record = keyring.encrypt_bytes(CHUNK_INDEX.pack(index) + chunk)
+                    if len(record) != record_size(len(chunk)):
+                        raise RuntimeError("unexpected ciphertext size")
+                    out.write(record)
+                    index += 1
+                if size == 0:
+                    raise AttachmentError("empty upload")
+                out.seek(0)
+                out.write(FILE_HEADER.pack(FILE_MAGIC, self.chunk_size, size))
+                out.flush()
+                os.fsync(out.fileno())
+
+            address = digest.hexdigest()
+            target = self.path(address)
+            if os.path.exists(target):
+                os.unlink(tmp_path)
+                return address, size, content_type, False
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            os.replace(tmp_path, target)
+            return address, size, content_type, True
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+
+    def _chunks(self, stream):
+        """Exactly chunk_size pieces (the last may be shorter) from a stream of any read sizes"""
+        buffer = bytearray()
+        while True:
+            data = stream.read(self.chunk_size - len(buffer))
+            if not data:
+                break
+            buffer += data
+            if len(buffer) == self.chunk_size:
+                yield bytes(buffer)
+                buffer.clear()
+        if buffer:
+            yield bytes(buffer)
+
+    def open(self, address):
+        return StoredAttachment(self.path(address), self.keyring)
+
+    def exists(self, address):
+        return os.path.exists(self.path(address))
+
+store = AttachmentStore()
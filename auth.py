@@ -0,0 +1,200 @@
+"""
+Password hashing off the handler threads, and signed session tokens for reconnects
+"""
+
+import base64
+import hashlib
+import hmac
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from encryption import get_or_create_key
+import metrics
+
+# scrypt cost; raising these rehashes each user on their next password login
+PASSWORD_SCRYPT_N = int(os.getenv('PASSWORD_SCRYPT_N', 2 ** 14))
+PASSWORD_SCRYPT_R = int(os.getenv('PASSWORD_SCRYPT_R', 8))
+PASSWORD_SCRYPT_P = int(os.getenv('PASSWORD_SCRYPT_P', 1))
+# Concurrent hash verifications, and how many more may queue before logins are refused
+LOGIN_WORKERS = int(os.getenv('LOGIN_WORKERS', 4))
+LOGIN_MAX_PENDING = int(os.getenv('LOGIN_MAX_PENDING', 64))
+LOGIN_TIMEOUT = float(os.getenv('LOGIN_TIMEOUT', 10))
+SESSION_TOKEN_TTL = int(os.getenv('SESSION_TOKEN_TTL', 3600))
+SESSION_CACHE_MAX = int(os.getenv('SESSION_CACHE_MAX', 50000))
+# Signs session tokens when FLASK_SECRET_KEY is unset; share it between nodes
+SESSION_KEY_FILE = os.getenv('SESSION_KEY_FILE', 'session.key')
+# Published in old setup instructions, so it signs nothing
+PUBLIC_DEFAULT_SECRET = 'secure_chat_secret_key_2024'
+
+HASH_SCHEME = "scrypt"
+
+class LoginBusy(Exception):
+    """Too many password verifications are already queued"""
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+def _b64decode(text):
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+def _scrypt(password, salt, n, r, p):
+    return hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p, maxmem=256 * n * r, dklen=32)
+
+def hash_password(password, n=PASSWORD_SCRYPT_N, r=PASSWORD_SCRYPT_R, p=PASSWORD_SCRYPT_P):
+    """Return 'scrypt$n$r$p$salt$digest' for storage in users.password"""
+    salt = os.urandom(16)
+    return f"{HASH_SCHEME}${n}${r}${p}${_b64encode(salt)}${_b64encode(_scrypt(password, salt, n, r, p))}"
+
+def verify_password(password, stored):
+    """Return (matches, needs_rehash); plaintext legacy values always need a rehash"""
+    if not stored:
+        return False, False
+    if not stored.startswith(HASH_SCHEME + "$"):
+        return hmac.compare_digest(password.encode(), stored.encode()), True
+    try:
+        _, n, r, p, salt, digest = stored.split("$")
+        n, r, p = int(n), int(r), int(p)
+        expected = _b64decode(digest)
+        actual = _scrypt(password, _b64decode(salt), n, r, p)
+    except (ValueError, TypeError):
+        return False, False
+    current = (n, r, p) == (PASSWORD_SCRYPT_N, PASSWORD_SCRYPT_R, PASSWORD_SCRYPT_P)
+    return hmac.compare_digest(actual, expected), not current
+
+class Authenticator:
+    """Checks passwords on a bounded worker pool, upgrading stored hashes as it goes"""
+
+    def __init__(self, lookup, update_hash, workers=LOGIN_WORKERS, max_pending=LOGIN_MAX_PENDING):
+        self.lookup = lookup
+        self.update_hash = update_hash
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="login")
+        self._slots = threading.BoundedSemaphore(workers + max_pending)
+        self._dummy_hash = None
+
+    def warm(self):
+        """Compute the hash unknown users are checked against, so they cost as much as wrong passwords"""
+        if self._dummy_hash is None:
+            self._dummy_hash = hash_password(os.urandom(8).hex())
+
+    def verify(self, username, password, timeout=LOGIN_TIMEOUT):
+        """True if the password is right; raises LoginBusy when the queue is full"""
+        if not self._slots.acquire(blocking=False):
+            metrics.increment("login_busy")
+            raise LoginBusy()
+        try:
+            future = self._executor.submit(self._check, username, password)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            return future.result(timeout)
+        except FutureTimeout:
+            metrics.increment("login_timeouts")
+            return False
+
+    def _check(self, username, password):
+        metrics.increment("login_verifications")
+        stored = self.lookup(username)
+        if stored is None:
+            self.warm()
+            verify_password(password, self._dummy_hash)
+            metrics.increment("login_failures")
+            return False
+        ok, needs_rehash = verify_password(password, stored)
+        if not ok:
+            metrics.increment("login_failures")
+            return False
+        if needs_rehash:
+            try:
+                self.update_hash(username, hash_password(password))
+                metrics.increment("login_rehashes")
+            except Exception as e:
+                print(f"⚠️ Password rehash for {username} failed: {e}")
+        return True
+
+def session_secret():
+    """FLASK_SECRET_KEY, or a random secret generated once into SESSION_KEY_FILE"""
+    secret = os.getenv('FLASK_SECRET_KEY')
+    if secret == PUBLIC_DEFAULT_SECRET:
+        print(f"⚠️ FLASK_SECRET_KEY is the published default; using {SESSION_KEY_FILE} instead")
+        secret = None
+    return secret or get_or_create_key(SESSION_KEY_FILE).strip()
+
+class SessionManager:
+    """
+    Issues HMAC-signed, expiring session tokens. Verified tokens are cached, so a
+    reconnect storm costs dictionary lookups instead of password hashes.
+    """
+
+    def __init__(self, secret, ttl=SESSION_TOKEN_TTL, max_cached=SESSION_CACHE_MAX):
+        self.secret = secret.encode() if isinstance(secret, str) else secret
+        self.ttl = ttl
+        self.max_cached = max_cached
+        self._cache = OrderedDict()
+        self._revoked = {}
+        self._lock = threading.Lock()
+
+    def _sign(self, payload):
+        return _b64encode(hmac.new(self.secret, payload.encode(), hashlib.sha256).digest())
+
+    def issue(self, username):
+        expires = int(time.time()) + self.ttl
+        payload = f"{username}:{expires}:{_b64encode(os.urandom(9))}"
+        token = f"{_b64encode(payload.encode())}.{self._sign(payload)}"
+        with self._lock:
+            self._remember(token, username, expires)
+        return token
+
+    def _remember(self, token, username, expires):
+        self._cache[token] = (username, expires)
+        if len(self._cache) > self.max_cached:
+            self._cache.popitem(last=False)
+
+    def verify(self, token):
+        """Username the token was issued to, or None if it is forged, expired or revoked"""
+        if not token or not isinstance(token, str):
+            return None
+        now = time.time()
+        with self._lock:
+            cached = self._cache.get(token)
+            if cached is not None:
+                if cached[1] > now:
+                    self._cache.move_to_end(token)
+                    metrics.increment("session_cache_hits")
+                    return cached[0]
+                del self._cache[token]
+                return None
+            if token in self._revoked:
+                return None
+
+        try:
+            encoded, signature = token.split(".")
+            payload = _b64decode(encoded).decode()
+            username, expires, _ = payload.rsplit(":", 2)
+            expires = int(expires)
+        except (ValueError, UnicodeDecodeError):
+            return None
+        if not hmac.compare_digest(signature, self._sign(payload)) or expires <= now:
+            return None
+        # No token is issued for longer than ttl; a later expiry was not made here
+        if expires > now + self.ttl:
+            return None
+        with self._lock:
+            self._remember(token, username, expires)
+        return username
+
+    def revoke(self, token):
+        with self._lock:
+            entry = self._cache.pop(token, None)
+            self._revoked[token] = entry[1] if entry else time.time() + self.ttl
+            # Revocations only matter until the token would have expired anyway
+            now = time.time()
+            for revoked, expires in list(self._revoked.items()):
+                if expires <= now:
+                    del self._revoked[revoked]
+
+    def __len__(self):
+        return len(self._cache)
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Benchmark logins/sec under a reconnect storm.
+
+Every client logs in once with its password, then drops and reconnects
+--reconnects times, all clients at once. "rehash" verifies the password on
+every reconnect (what a memory-hard hash costs without sessions); "token"
+resumes with the session token issued at the first login.
+
+    python benchmarks/bench_login.py
+    python benchmarks/bench_login.py --clients 200 --reconnects 10 --workers 8
+"""
+
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from auth import Authenticator, SessionManager, LoginBusy, hash_password
+
+def storm(clients, reconnects, concurrency, login):
+    """Run each client's reconnects concurrently; returns (logins/sec, refused, p99 ms)"""
+    latencies = []
+    refused = 0
+
+    def client(index):
+        nonlocal refused
+        for _ in range(reconnects):
+            start = time.perf_counter()
+            try:
+                assert login(index)
+            except LoginBusy:
+                refused += 1
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(client, range(clients)))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    p99 = latencies[int(len(latencies) * 0.99) - 1] * 1000 if latencies else 0.0
+    return (len(latencies) - refused) / elapsed, refused, p99
+
+def main():
+    parser = argparse.ArgumentParser(description="Login reconnect storm benchmark")
+    parser.add_argument("--clients", type=int, default=50)
+    parser.add_argument("--reconnects", type=int, default=5)
+    parser.add_argument("--workers", type=int, default=4, help="password hashing workers")
+    parser.add_argument("--concurrency", type=int, default=32, help="simultaneous reconnecting clients")
+    args = parser.parse_args()
+
+    users = {f"buyer{i}": hash_password("soweto311") for i in range(args.clients)}
+    authenticator = Authenticator(users.get, users.__setitem__, workers=args.workers,
+                                  max_pending=args.clients * args.reconnects)
+    sessions = SessionManager("bench-secret")
+
+    start = time.perf_counter()
+    tokens = []
+    for i in range(args.clients):
+        assert authenticator.verify(f"buyer{i}", "soweto311")
+        tokens.append(sessions.issue(f"buyer{i}"))
+    first_login = (time.perf_counter() - start) / args.clients * 1000
+
+    results = {
+        "rehash": storm(args.clients, args.reconnects, args.concurrency,
+                        lambda i: authenticator.verify(f"buyer{i}", "soweto311")),
+        "token": storm(args.clients, args.reconnects, args.concurrency,
+                       lambda i: sessions.verify(tokens[i]) == f"buyer{i}")
+    }
+
+    print(f"{args.clients} clients x {args.reconnects} reconnects, {args.workers} hash workers, "
+          f"first password login {first_login:.1f} ms")
+    print(f"{'strategy':<10}{'logins/s':>12}{'p99 ms':>10}{'refused':>10}")
+    for strategy, (rate, refused, p99) in results.items():
+        print(f"{strategy:<10}{rate:>12.0f}{p99:>10.2f}{refused:>10}")
+
+if __name__ == "__main__":
+    main()
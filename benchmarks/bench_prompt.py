@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Benchmark prompt tokens, build latency and context recall on recorded conversations.
+
+Compares the old prompt (last 5 messages verbatim) with the token-budgeted
+prompt builder. Context recall is the fraction of each conversation's key
+facts still present in the prompt for its final question.
+
+    python benchmarks/bench_prompt.py            # offline
+    python benchmarks/bench_prompt.py --live     # also time upstream calls (needs OPENROUTER_API_KEY)
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from collections import deque
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from prompt_builder import PromptBuilder, estimate_tokens
+
+RECORDINGS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "recorded_conversations.json")
+WINDOW_SIZE = 10
+SELLER_INFO = {"name": "Seller", "personality": "You are a helpful marketplace seller.", "style": "helpful"}
+
+def legacy_messages(buyer, history, message):
+    """The prompt ai_reply built before the prompt builder"""
+    context = "\n\nRecent conversation history:\n" + "".join(f"{m['sender']}: {m['message']}\n" for m in history[-5:])
+    system_prompt = f"""{SELLER_INFO['personality']}
+
+Your name is {SELLER_INFO['name']}. You are chatting with {buyer}.
+{context}
+
+Respond naturally as {SELLER_INFO['name']}, maintaining your personality style ({SELLER_INFO['style']}).
+Be helpful and address the customer's needs while staying in character."""
+    return [{"role": "system", "content": system_prompt}, {"role": "user", "content": message}]
+
+def replay(conversation, strategy, builder=None):
+    """Feed messages through a context window, building a prompt at each buyer turn"""
+    buyer, seller = conversation["buyer"], conversation["seller"]
+    window = deque(maxlen=WINDOW_SIZE)
+    total_tokens = 0
+    max_tokens = 0
+    build_seconds = 0.0
+    builds = 0
+    prompt = None
+    for message_id, (sender, text) in enumerate(conversation["messages"], 1):
+        window.append({"id": message_id, "sender": sender, "message": text})
+        if sender != buyer:
+            continue
+        started = time.perf_counter()
+        if strategy == "legacy":
+            prompt = legacy_messages(buyer, list(window), text)
+        else:
+            prompt, _ = builder.build(SELLER_INFO, buyer, seller, list(window), text)
+        build_seconds += time.perf_counter() - started
+        builds += 1
+        tokens = sum(estimate_tokens(m["content"]) for m in prompt)
+        total_tokens += tokens
+        max_tokens = max(max_tokens, tokens)
+
+    final_text = "\n".join(m["content"] for m in prompt).lower()
+    recall = sum(1 for fact in conversation["facts"] if fact.lower() in final_text) / len(conversation["facts"])
+    return {
+        "final_tokens": sum(estimate_tokens(m["content"]) for m in prompt),
+        "mean_tokens": total_tokens / builds,
+        "max_tokens": max_tokens,
+        "build_us": build_seconds / builds * 1e6,
+        "recall": recall,
+        "prompt": prompt
+    }
+
+def time_upstream(prompt, seller):
+    from ai_agent import OPENROUTER_API_KEY, AI_MODEL
+    from ai_guard import ai_guard
+    started = time.monotonic()
+    ai_guard.post(seller, headers={"Authorization": f"Bearer {OPENROUTER_API_KEY}", "Content-Type": "application/json"},
+                  payload={"model": AI_MODEL, "messages": prompt, "temperature": 0.7, "max_tokens": 300})
+    return time.monotonic() - started
+
+def main():
+    parser = argparse.ArgumentParser(description="Prompt builder benchmark")
+    parser.add_argument("--live", action="store_true", help="also time one upstream call per prompt")
+    args = parser.parse_args()
+
+    with open(RECORDINGS) as f:
+        conversations = json.load(f)
+
+    print(f"{'conversation':<18}{'strategy':<10}{'final tok':>10}{'mean tok':>10}{'max tok':>10}{'build µs':>10}{'recall':>8}"
+          + (f"{'upstream s':>12}" if args.live else ""))
+    totals = {}
+    for conversation in conversations:
+        label = f"{conversation['buyer']}->{conversation['seller']}"
+        for strategy in ("legacy", "budgeted"):
+            result = replay(conversation, strategy, PromptBuilder())
+            row = (f"{label:<18}{strategy:<10}{result['final_tokens']:>10}{result['mean_tokens']:>10.0f}{result['max_tokens']:>10}"
+                   f"{result['build_us']:>10.1f}{result['recall']:>8.0%}")
+            if args.live:
+                row += f"{time_upstream(result['prompt'], conversation['seller']):>12.2f}"
+            print(row)
+            total = totals.setdefault(strategy, [0, 0.0])
+            total[0] += result["final_tokens"]
+            total[1] += result["recall"]
+
+    print()
+    for strategy, (tokens, recall) in totals.items():
+        print(f"📊 {strategy}: {tokens} final prompt tokens, mean recall {recall / len(conversations):.0%}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+In-memory context windows of recent messages per conversation, used to build AI prompts
+"""
+
+import os
+import threading
+from collections import OrderedDict, deque
+
+AI_CONTEXT_WINDOW_SIZE = int(os.getenv('AI_CONTEXT_WINDOW_SIZE', 10))
+AI_CONTEXT_MAX_CONVERSATIONS = int(os.getenv('AI_CONTEXT_MAX_CONVERSATIONS', 5000))
+
+class ContextWindowStore:
+    """
+    Bounded LRU of conversation -> last N messages.
+
+    Windows are filled from the database once (via loader) and then kept
+    current by append() from the message handler. Messages handled by other
+    nodes only show up after the window is evicted and reloaded.
+    """
+
+    def __init__(self, loader, window_size=AI_CONTEXT_WINDOW_SIZE,
+                 max_conversations=AI_CONTEXT_MAX_CONVERSATIONS):
+        # loader(buyer_username, seller_username, limit) -> messages oldest first
+        self.loader = loader
+        self.window_size = window_size
+        self.max_conversations = max_conversations
+        self._windows = OrderedDict()
+        self._loading = set()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, buyer_username, seller_username):
+        """Return the window (oldest first), loading it from the database on a miss"""
+        key = (buyer_username, seller_username)
+        with self._lock:
+            window = self._windows.get(key)
+            if window is not None and key not in self._loading:
+                self._windows.move_to_end(key)
+                self.hits += 1
+                return list(window)
+            self.misses += 1
+            if window is None:
+                # Appends arriving while we load are kept and merged below
+                self._insert(key, deque(maxlen=self.window_size))
+            self._loading.add(key)
+
+        try:
+            loaded = self.loader(buyer_username, seller_username, self.window_size)
+        except Exception:
+            with self._lock:
+                self._loading.discard(key)
+                self._windows.pop(key, None)
+            raise
+
+        with self._lock:
+            self._loading.discard(key)
+            window = self._windows.get(key)
+            seen = {message.get("id") for message in loaded}
+            merged = list(loaded)
+            if window is not None:
+                merged.extend(m for m in window if m.get("id") is None or m.get("id") not in seen)
+            merged = merged[-self.window_size:]
+            self._insert(key, deque(merged, maxlen=self.window_size))
+            return merged
+
+    def append(self, buyer_username, seller_username, message):
+        """Add a just-handled message to a cached window; uncached windows load later"""
+        key = (buyer_username, seller_username)
+        with self._lock:
+            window = self._windows.get(key)
+            if window is None:
+                return False
+            window.append(message)
+            self._windows.move_to_end(key)
+            return True
+
+    def invalidate(self, buyer_username, seller_username):
+        with self._lock:
+            self._windows.pop((buyer_username, seller_username), None)
+
+    def _insert(self, key, window):
+        self._windows[key] = window
+        self._windows.move_to_end(key)
+        # Evict least recently used windows, skipping ones still loading
+        for oldest in list(self._windows):
+            if len(self._windows) <= self.max_conversations:
+                break
+            if oldest != key and oldest not in self._loading:
+                del self._windows[oldest]
+
+    def __len__(self):
+        return len(self._windows)
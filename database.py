@@ -1,40 +1,264 @@
 import psycopg2
+import psycopg2.extensions
+import functools
 import os
+import random
+import time
 from datetime import datetime, timedelta
-from dotenv import load_dotenv
-from encryption import decrypt_message
+from encryption import decrypt_message, decrypt_messages
+from db_pool import ConnectionPool
+from replication import ReadRouter, parse_hosts, DB_REPLICA_HOSTS, DB_REPLICA_POOL_SIZE, REPLICA_CONNECT_TIMEOUT
+from query_log import InstrumentedCursor, helper, queries
+from sketches import DDSketch
+import metrics
 
-# Load environment variables
-load_dotenv()
+# messages is partitioned by month on timestamp. Queries bound timestamp by the
+# conversation's created_at so the planner skips older partitions; the margin
+# absorbs clock skew between the app (message timestamps) and the database.
+PARTITION_PRUNE_MARGIN = timedelta(days=1)
 
-def get_connection():
+# A reconnecting client missing more messages than this is told to refetch
+SYNC_MAX_DELTA = int(os.getenv('SYNC_MAX_DELTA', 200))
+SYNC_SNAPSHOT_SIZE = int(os.getenv('SYNC_SNAPSHOT_SIZE', 50))
+INBOX_PREVIEW_CHARS = int(os.getenv('INBOX_PREVIEW_CHARS', 100))
+BOOTSTRAP_PREVIEW_MESSAGES = int(os.getenv('BOOTSTRAP_PREVIEW_MESSAGES', 20))
+BOOTSTRAP_MAX_CONVERSATIONS = int(os.getenv('BOOTSTRAP_MAX_CONVERSATIONS', 200))
+HISTORY_BATCH_MAX_ITEMS = int(os.getenv('HISTORY_BATCH_MAX_ITEMS', 200))
+HISTORY_BATCH_MAX_LIMIT = int(os.getenv('HISTORY_BATCH_MAX_LIMIT', 50))
+
+# Users and conversations are looked up on every message; both are effectively
+# immutable, so keep them in process instead of re-querying. The lookups take a
+# pooled connection of their own on a miss, so callers resolve them before
+# acquiring theirs: holding one connection while waiting for a second deadlocks
+# once every pooled connection is held that way.
+USER_CACHE_TTL_SECONDS = float(os.getenv('USER_CACHE_TTL_SECONDS', 300))
+CONVERSATION_CACHE_MAX = 100000
+_user_cache = {}
+_conversation_cache = {}
+
+class PreparingConnection(psycopg2.extensions.connection):
+    """Connection that remembers which STATEMENTS it has already prepared; its cursors are instrumented"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = set()
+        self.cursor_factory = InstrumentedCursor
+
+def _connect(host=None, port=None, connect_timeout=None):
     return psycopg2.connect(
         dbname=os.getenv('DB_NAME', 'chatdb'),
         user=os.getenv('DB_USER', 'moturi311'),
         password=os.getenv('DB_PASSWORD', 'soweto311'),
-        host=os.getenv('DB_HOST', 'localhost')
+        host=host or os.getenv('DB_HOST', 'localhost'),
+        port=port or os.getenv('DB_PORT'),
+        connect_timeout=connect_timeout,
+        connection_factory=PreparingConnection
     )
 
+# Callers still close() their connections; that returns them to the pool
+pool = ConnectionPool(_connect)
+metrics.register_gauge("db_pool", pool.stats)
+
+# A replica that drops packets fails over after REPLICA_CONNECT_TIMEOUT instead of the OS TCP timeout
+replica_pools = [ConnectionPool(functools.partial(_connect, host, port, REPLICA_CONNECT_TIMEOUT),
+                                size=DB_REPLICA_POOL_SIZE)
+                 for host, port in parse_hosts(DB_REPLICA_HOSTS)]
+router = ReadRouter(pool, replica_pools)
+metrics.register_gauge("db_replicas", router.stats)
+
+def get_connection():
+    queries.connection_acquired()
+    return pool.acquire()
+
+def get_read_connection(*usernames):
+    """Connection for read-only queries; may be a replica unless one of usernames just wrote"""
+    queries.connection_acquired()
+    return router.acquire_read(*usernames)
+
+_MESSAGE_CONTENT = "COALESCE(m.ciphertext, convert_to(m.encrypted_content, 'UTF8'))"
+# Metadata of a message's attachment as a dict (psycopg2 decodes json), NULL without one
+_MESSAGE_ATTACHMENT = """
+    (SELECT json_build_object('id', a.id, 'filename', a.filename, 'content_type', a.content_type, 'size', a.size)
+     FROM attachments a WHERE a.id = m.attachment_id)
+"""
+
+# Hot statements are prepared once per pooled connection and afterwards run with
+# EXECUTE, so the server neither parses nor plans them again. Steps that used to
+# be separate round trips (conversation lookup, page, count; message, receipt)
+# are folded into one statement each.
+STATEMENTS = {
+    "user_by_name": "SELECT id, role FROM users WHERE username = $1",
+    "conversation_id": "SELECT id FROM conversations WHERE buyer_id = $1 AND seller_id = $2",
+    "insert_message": """
+        WITH inserted AS (
+            INSERT INTO messages (conversation_id, sender_id, receiver_id, ciphertext, timestamp, attachment_id)
+            VALUES ($1, $2, $3, $4, $5, $6)
+            RETURNING id, timestamp
+        )
+        UPDATE conversations c
+        SET last_message_id = inserted.id,
+            last_message_at = inserted.timestamp,
+            buyer_unread = c.buyer_unread + CASE WHEN c.buyer_id = $3 THEN 1 ELSE 0 END,
+            seller_unread = c.seller_unread + CASE WHEN c.seller_id = $3 THEN 1 ELSE 0 END
+        FROM inserted
+        WHERE c.id = $1
+        RETURNING inserted.id
+    """,
+    "insert_message_once": """
+        WITH inserted AS (
+            INSERT INTO messages (conversation_id, sender_id, receiver_id, ciphertext, timestamp, attachment_id)
+            VALUES ($1, $2, $3, $4, $5, $6)
+            RETURNING id, timestamp
+        ), bumped AS (
+            UPDATE conversations c
+            SET last_message_id = inserted.id,
+                last_message_at = inserted.timestamp,
+                buyer_unread = c.buyer_unread + CASE WHEN c.buyer_id = $3 THEN 1 ELSE 0 END,
+                seller_unread = c.seller_unread + CASE WHEN c.seller_id = $3 THEN 1 ELSE 0 END
+            FROM inserted
+            WHERE c.id = $1
+            RETURNING inserted.id
+        ), receipt AS (
+            INSERT INTO message_receipts (sender_id, client_msg_id, message_id)
+            SELECT $2, $7::varchar, id FROM inserted
+            ON CONFLICT (sender_id, client_msg_id) DO NOTHING
+            RETURNING message_id
+        )
+        SELECT bumped.id, EXISTS (SELECT 1 FROM receipt) FROM bumped
+    """,
+    "receipt_by_sender_id": "SELECT message_id FROM message_receipts WHERE sender_id = $1 AND client_msg_id = $2",
+    "receipt_by_username": """
+        SELECT r.message_id FROM message_receipts r
+        JOIN users u ON u.id = r.sender_id
+        WHERE u.username = $1 AND r.client_msg_id = $2
+    """,
+    # One row per message plus the total; a single row of NULLs for an empty
+    # conversation and no rows when there is no conversation
+    "history_page": f"""
+        WITH conv AS (
+            SELECT id, created_at - $3::interval AS since
+            FROM conversations WHERE buyer_id = $1 AND seller_id = $2
+        )
+        SELECT (SELECT COUNT(*) FROM messages WHERE conversation_id = conv.id AND timestamp >= conv.since),
+               page.id, page.username, page.content, page.timestamp, page.attachment
+        FROM conv
+        LEFT JOIN LATERAL (
+            SELECT m.id, u.username, {_MESSAGE_CONTENT} AS content, m.timestamp, {_MESSAGE_ATTACHMENT} AS attachment
+            FROM messages m
+            JOIN users u ON m.sender_id = u.id
+            WHERE m.conversation_id = conv.id AND m.timestamp >= conv.since
+            ORDER BY m.timestamp ASC
+            LIMIT $4 OFFSET $5
+        ) page ON true
+        ORDER BY page.timestamp ASC
+    """,
+    "messages_snapshot": f"""
+        WITH conv AS (
+            SELECT c.id, c.created_at - $3::interval AS since FROM conversations c
+            WHERE c.buyer_id = (SELECT id FROM users WHERE username = $1)
+              AND c.seller_id = (SELECT id FROM users WHERE username = $2)
+        )
+        SELECT conv.id, page.id, page.username, page.content, page.timestamp, page.attachment
+        FROM conv
+        LEFT JOIN LATERAL (
+            SELECT m.id, u.username, {_MESSAGE_CONTENT} AS content, m.timestamp, {_MESSAGE_ATTACHMENT} AS attachment
+            FROM messages m
+            JOIN users u ON m.sender_id = u.id
+            WHERE m.conversation_id = conv.id AND m.timestamp >= conv.since
+            ORDER BY m.timestamp DESC, m.id DESC
+            LIMIT $4
+        ) page ON true
+        ORDER BY page.timestamp ASC, page.id ASC
+    """,
+    # Bound timestamp by the last seen message too, so run-time pruning skips
+    # every partition older than it
+    "messages_delta": f"""
+        WITH conv AS (
+            SELECT c.id, c.created_at - $3::interval AS since FROM conversations c
+            WHERE c.buyer_id = (SELECT id FROM users WHERE username = $1)
+              AND c.seller_id = (SELECT id FROM users WHERE username = $2)
+        )
+        SELECT conv.id, page.id, page.username, page.content, page.timestamp, page.attachment
+        FROM conv
+        LEFT JOIN LATERAL (
+            SELECT m.id, u.username, {_MESSAGE_CONTENT} AS content, m.timestamp, {_MESSAGE_ATTACHMENT} AS attachment
+            FROM messages m
+            JOIN users u ON m.sender_id = u.id
+            WHERE m.conversation_id = conv.id
+              AND m.timestamp >= COALESCE(
+                  (SELECT s.timestamp FROM messages s
+                   WHERE s.id = $4 AND s.conversation_id = conv.id AND s.timestamp >= conv.since) - $3::interval,
+                  conv.since)
+              AND m.id > $4
+            ORDER BY m.timestamp ASC, m.id ASC
+            LIMIT $5
+        ) page ON true
+        ORDER BY page.timestamp ASC, page.id ASC
+    """
+}
+
+@helper
+def execute_prepared(cur, name, params=()):
+    """Run a STATEMENTS entry, preparing it first if this connection has not yet"""
+    prepared = cur.connection.prepared
+    if name not in prepared:
+        cur.execute(f"PREPARE {name} AS {STATEMENTS[name]}")
+        # Prepared statements belong to the session, not the transaction, so
+        # they survive the rollback the pool does on release
+        prepared.add(name)
+        metrics.increment("db_statements_prepared")
+    if params:
+        cur.execute(f"EXECUTE {name} ({', '.join(['%s'] * len(params))})", params)
+    else:
+        cur.execute(f"EXECUTE {name}")
+
 def get_user_id(username):
     """Get user ID from username"""
+    cached = _user_cache.get(username)
+    if cached is not None and cached[0] > time.monotonic():
+        return cached[1]
+    
     conn = get_connection()
     cur = conn.cursor()
-    cur.execute("SELECT id, role FROM users WHERE username = %s", (username,))
+    execute_prepared(cur, "user_by_name", (username,))
     result = cur.fetchone()
     cur.close()
     conn.close()
+    # Unknown names are not cached, so typos cannot grow the cache
+    if result:
+        _user_cache[username] = (time.monotonic() + USER_CACHE_TTL_SECONDS, result)
     return result if result else None
 
+def get_password_hash(username):
+    """Stored password hash (or legacy plaintext) for a user, None if unknown"""
+    conn = get_connection()
+    cur = conn.cursor()
+    cur.execute("SELECT password FROM users WHERE username = %s", (username,))
+    result = cur.fetchone()
+    cur.close()
+    conn.close()
+    return result[0] if result else None
+
+def update_password_hash(username, password_hash):
+    """Replace a user's stored password hash"""
+    conn = get_connection()
+    cur = conn.cursor()
+    cur.execute("UPDATE users SET password = %s WHERE username = %s", (password_hash, username))
+    conn.commit()
+    cur.close()
+    conn.close()
+
 def get_or_create_conversation(buyer_id, seller_id):
     """Get existing conversation or create new one"""
+    conversation_id = _conversation_cache.get((buyer_id, seller_id))
+    if conversation_id is not None:
+        return conversation_id
+    
     conn = get_connection()
     cur = conn.cursor()
     
     # Try to get existing conversation
-    cur.execute(
-        "SELECT id FROM conversations WHERE buyer_id = %s AND seller_id = %s",
-        (buyer_id, seller_id)
-    )
+    execute_prepared(cur, "conversation_id", (buyer_id, seller_id))
     result = cur.fetchone()
     
     if result:
@@ -50,20 +274,49 @@ def get_or_create_conversation(buyer_id, seller_id):
     
     cur.close()
     conn.close()
+    if len(_conversation_cache) >= CONVERSATION_CACHE_MAX:
+        _conversation_cache.clear()
+    _conversation_cache[(buyer_id, seller_id)] = conversation_id
     return conversation_id
 
-def save_message(sender_username, receiver_username, content):
-    """Save encrypted message to database"""
+def warm_caches(max_users=10000, max_conversations=50000):
+    """Preload the user and conversation caches; returns (users, conversations) loaded"""
     conn = get_connection()
     cur = conn.cursor()
+    cur.execute("SELECT username, id, role FROM users ORDER BY id LIMIT %s", (max_users,))
+    users = cur.fetchall()
+    # The most recently active conversations are the ones about to be written to
+    cur.execute("""
+        SELECT buyer_id, seller_id, id FROM conversations
+        ORDER BY last_message_at DESC NULLS LAST
+        LIMIT %s
+    """, (min(max_conversations, CONVERSATION_CACHE_MAX),))
+    conversations = cur.fetchall()
+    cur.close()
+    conn.close()
     
+    # Spread the expiries so the warmed users do not all miss at once
+    now = time.monotonic()
+    for username, user_id, role in users:
+        _user_cache[username] = (now + USER_CACHE_TTL_SECONDS * random.uniform(0.5, 1), (user_id, role))
+    for buyer_id, seller_id, conversation_id in conversations:
+        _conversation_cache[(buyer_id, seller_id)] = conversation_id
+    return len(users), len(conversations)
+
+def _insert_message(cur, conversation_id, sender_id, receiver_id, content, attachment_id=None):
+    """Insert a message and bump the conversation's last message and receiver's unread count"""
+    # One round trip; the conversation row update commits or rolls back with the message
+    execute_prepared(cur, "insert_message",
+                     (conversation_id, sender_id, receiver_id, content, datetime.now(), attachment_id))
+    return cur.fetchone()[0]
+
+def save_message(sender_username, receiver_username, content, attachment_id=None):
+    """Save encrypted message to database"""
     # Get user IDs
     sender_info = get_user_id(sender_username)
     receiver_info = get_user_id(receiver_username)
     
     if not sender_info or not receiver_info:
-        cur.close()
-        conn.close()
         return False
     
     sender_id, sender_role = sender_info
@@ -75,88 +328,123 @@ def save_message(sender_username, receiver_username, content):
     elif sender_role == 'seller' and receiver_role == 'buyer':
         buyer_id, seller_id = receiver_id, sender_id
     else:
-        cur.close()
-        conn.close()
         return False
     
     # Get or create conversation
     conversation_id = get_or_create_conversation(buyer_id, seller_id)
     
-    # Insert message with timestamp
-    cur.execute(
-        "INSERT INTO messages (conversation_id, sender_id, receiver_id, encrypted_content, timestamp) VALUES (%s, %s, %s, %s, %s) RETURNING id",
-        (conversation_id, sender_id, receiver_id, content, datetime.now())
-    )
-    
-    message_id = cur.fetchone()[0]
+    conn = get_connection()
+    cur = conn.cursor()
+    # Insert message with timestamp (content is binary ciphertext from encrypt_message)
+    message_id = _insert_message(cur, conversation_id, sender_id, receiver_id, content, attachment_id)
     conn.commit()
     cur.close()
     conn.close()
+    router.note_write(sender_username)
     return message_id
 
-def get_message_history(buyer_username, seller_username, limit=50, offset=0):
-    """Get decrypted message history between buyer and seller with pagination"""
+def get_message_receipt(sender_username, client_msg_id):
+    """Return the message ID already stored for a client message ID, or None"""
+    conn = get_connection()
+    cur = conn.cursor()
+    execute_prepared(cur, "receipt_by_username", (sender_username, client_msg_id))
+    result = cur.fetchone()
+    cur.close()
+    conn.close()
+    return result[0] if result else None
+
+def save_message_once(sender_username, receiver_username, content, client_msg_id, attachment_id=None):
+    """Save a message unless this client message ID was already stored.
+
+    Returns (message_id, created); message_id is False if the message was rejected.
+    """
+    sender_info = get_user_id(sender_username)
+    receiver_info = get_user_id(receiver_username)
+    if not sender_info or not receiver_info:
+        return False, False
+    
+    sender_id, sender_role = sender_info
+    receiver_id, receiver_role = receiver_info
+    if sender_role == 'buyer' and receiver_role == 'seller':
+        buyer_id, seller_id = sender_id, receiver_id
+    elif sender_role == 'seller' and receiver_role == 'buyer':
+        buyer_id, seller_id = receiver_id, sender_id
+    else:
+        return False, False
+    
+    conversation_id = get_or_create_conversation(buyer_id, seller_id)
+    
     conn = get_connection()
     cur = conn.cursor()
+    # Message, conversation bump and receipt in one statement. A concurrent send
+    # with the same ID blocks on the receipt key until this transaction ends;
+    # the loser rolls back its message row
+    execute_prepared(cur, "insert_message_once",
+                     (conversation_id, sender_id, receiver_id, content, datetime.now(), attachment_id,
+                      client_msg_id))
+    message_id, created = cur.fetchone()
+    if created:
+        conn.commit()
+        router.note_write(sender_username)
+    else:
+        conn.rollback()
+        execute_prepared(cur, "receipt_by_sender_id", (sender_id, client_msg_id))
+        message_id = cur.fetchone()[0]
     
+    cur.close()
+    conn.close()
+    return message_id, created
+
+def purge_message_receipts(days):
+    """Delete receipts older than days; clients stop retrying long before that"""
+    conn = get_connection()
+    cur = conn.cursor()
+    cur.execute("DELETE FROM message_receipts WHERE created_at < %s", (datetime.now() - timedelta(days=days),))
+    deleted = cur.rowcount
+    conn.commit()
+    cur.close()
+    conn.close()
+    return deleted
+
+def get_message_history(buyer_username, seller_username, limit=50, offset=0):
+    """Get decrypted message history between buyer and seller with pagination"""
+    # Either participant's recent message keeps the whole conversation on the primary
     # Get user IDs
     buyer_info = get_user_id(buyer_username)
     seller_info = get_user_id(seller_username)
     
     if not buyer_info or not seller_info:
-        cur.close()
-        conn.close()
         return []
     
+    conn = get_read_connection(buyer_username, seller_username)
+    cur = conn.cursor()
+    
     buyer_id = buyer_info[0]
     seller_id = seller_info[0]
     
-    # Get conversation
-    cur.execute(
-        "SELECT id FROM conversations WHERE buyer_id = %s AND seller_id = %s",
-        (buyer_id, seller_id)
-    )
-    conversation_result = cur.fetchone()
-    
-    if not conversation_result:
-        cur.close()
-        conn.close()
-        return []
-    
-    conversation_id = conversation_result[0]
-    
-    # Get messages with pagination
-    cur.execute("""
-        SELECT m.id, u.username, m.encrypted_content, m.timestamp
-        FROM messages m
-        JOIN users u ON m.sender_id = u.id
-        WHERE m.conversation_id = %s
-        ORDER BY m.timestamp ASC
-        LIMIT %s OFFSET %s
-    """, (conversation_id, limit, offset))
-    
-    messages = cur.fetchall()
-    
-    # Get total message count for pagination info
-    cur.execute(
-        "SELECT COUNT(*) FROM messages WHERE conversation_id = %s",
-        (conversation_id,)
-    )
-    total_count = cur.fetchone()[0]
-    
+    # Conversation, page and total count in one round trip
+    execute_prepared(cur, "history_page", (buyer_id, seller_id, PARTITION_PRUNE_MARGIN, limit, offset))
+    rows = cur.fetchall()
     cur.close()
     conn.close()
     
+    if not rows:
+        return []
+    total_count = rows[0][0]
+    
     # Decrypt messages and convert timestamps to strings
     history = []
-    for message_id, username, encrypted_content, timestamp in messages:
+    for _, message_id, username, encrypted_content, timestamp, attachment in rows:
+        if message_id is None:
+            continue
         try:
             decrypted_content = decrypt_message(encrypted_content)
             history.append({
                 "id": message_id,
                 "sender": username,
                 "message": decrypted_content,
-                "timestamp": timestamp.isoformat() if timestamp else None
+                "timestamp": timestamp.isoformat() if timestamp else None,
+                "attachment": attachment
             })
         except Exception as e:
             print(f"Error decrypting message {message_id}: {e}")
@@ -168,19 +456,61 @@ def get_message_history(buyer_username, seller_username, limit=50, offset=0):
         "has_more": offset + limit < total_count
     }
 
-def get_recent_conversations(username, limit=10):
-    """Get recent conversations for a user"""
+def get_messages_since(buyer_username, seller_username, last_seen_id=None,
+                       limit=SYNC_MAX_DELTA, snapshot_size=SYNC_SNAPSHOT_SIZE):
+    """Messages a client is missing from a conversation.
+
+    With last_seen_id, returns the messages after it ("delta"), or resync=True
+    without decrypting anything when more than limit are missing. Without it,
+    returns the newest snapshot_size messages ("snapshot").
+    """
     conn = get_connection()
     cur = conn.cursor()
     
+    # The conversation lookup rides along with the page query
+    if last_seen_id is None:
+        mode = "snapshot"
+        execute_prepared(cur, "messages_snapshot",
+                         (buyer_username, seller_username, PARTITION_PRUNE_MARGIN, snapshot_size))
+    else:
+        mode = "delta"
+        execute_prepared(cur, "messages_delta",
+                         (buyer_username, seller_username, PARTITION_PRUNE_MARGIN, last_seen_id, limit + 1))
+    rows = [row[1:] for row in cur.fetchall() if row[1] is not None]
+    cur.close()
+    conn.close()
+    
+    if mode == "delta" and len(rows) > limit:
+        return {"mode": mode, "messages": [], "latest_id": last_seen_id, "resync": True}
+    
+    history = []
+    for message_id, username, encrypted_content, timestamp, attachment in rows:
+        try:
+            history.append({
+                "id": message_id,
+                "sender": username,
+                "message": decrypt_message(encrypted_content),
+                "timestamp": timestamp.isoformat() if timestamp else None,
+                "attachment": attachment
+            })
+        except Exception as e:
+            print(f"Error decrypting message {message_id}: {e}")
+            continue
+    
+    latest_id = max([row[0] for row in rows], default=last_seen_id)
+    return {"mode": mode, "messages": history, "latest_id": latest_id, "resync": False}
+
+def get_recent_conversations(username, limit=10):
+    """Get recent conversations for a user"""
     # Get user info
     user_info = get_user_id(username)
     if not user_info:
-        cur.close()
-        conn.close()
         return []
     
-    user_id, user_role = user_info[0]
+    conn = get_read_connection(username)
+    cur = conn.cursor()
+    
+    user_id, user_role = user_info
     
     # Get conversations where user is either buyer or seller
     if user_role == 'buyer':
@@ -224,20 +554,284 @@ def get_recent_conversations(username, limit=10):
     conn.close()
     return conversations
 
-def search_messages(username, partner_username, query, limit=20):
-    """Search messages within a conversation"""
+def get_inbox(username, preview_chars=INBOX_PREVIEW_CHARS):
+    """Unread count and last message of every conversation of a user, newest first"""
+    conn = get_connection()
+    cur = conn.cursor()
+    
+    # Joining on (id, timestamp) of the last message lets run-time pruning
+    # visit a single partition per conversation
+    cur.execute("""
+        SELECT c.id, p.username, p.role,
+               CASE WHEN c.buyer_id = me.id THEN c.buyer_unread ELSE c.seller_unread END,
+               c.last_message_id, c.last_message_at, s.username,
+               COALESCE(m.ciphertext, convert_to(m.encrypted_content, 'UTF8'))
+        FROM users me
+        JOIN conversations c ON me.id IN (c.buyer_id, c.seller_id)
+        JOIN users p ON p.id = CASE WHEN c.buyer_id = me.id THEN c.seller_id ELSE c.buyer_id END
+        LEFT JOIN messages m ON m.id = c.last_message_id AND m.timestamp = c.last_message_at
+        LEFT JOIN users s ON s.id = m.sender_id
+        WHERE me.username = %s
+        ORDER BY c.last_message_at DESC NULLS LAST
+    """, (username,))
+    rows = cur.fetchall()
+    cur.close()
+    conn.close()
+    
+    conversations = []
+    for conv_id, partner, partner_role, unread, last_id, last_at, last_sender, encrypted_content in rows:
+        last_message = None
+        if encrypted_content is not None:
+            try:
+                text = decrypt_message(encrypted_content)
+                last_message = {
+                    "id": last_id,
+                    "sender": last_sender,
+                    "preview": text[:preview_chars],
+                    "timestamp": last_at.isoformat() if last_at else None
+                }
+            except Exception as e:
+                print(f"Error decrypting message {last_id}: {e}")
+        conversations.append({
+            "conversation_id": conv_id,
+            "partner": partner,
+            "partner_role": partner_role,
+            "unread": unread,
+            "last_message": last_message
+        })
+    
+    return {
+        "conversations": conversations,
+        "total_unread": sum(c["unread"] for c in conversations)
+    }
+
+def get_bootstrap(username, preview_messages=BOOTSTRAP_PREVIEW_MESSAGES,
+                  max_conversations=BOOTSTRAP_MAX_CONVERSATIONS):
+    """Everything the client needs after login, in two queries and one decrypt pass"""
     conn = get_connection()
     cur = conn.cursor()
     
+    cur.execute("""
+        SELECT me.id, me.role,
+               ARRAY(SELECT u.username FROM users u WHERE u.role <> me.role ORDER BY u.username)
+        FROM users me
+        WHERE me.username = %s
+    """, (username,))
+    user_row = cur.fetchone()
+    if not user_row:
+        cur.close()
+        conn.close()
+        return None
+    user_id, role, contacts = user_row
+    
+    # The newest conversations, each with its last few messages; the LATERAL
+    # subquery walks idx_messages_conversation backwards and stops after K rows
+    cur.execute("""
+        SELECT c.id, p.username, p.role,
+               CASE WHEN c.buyer_id = %s THEN c.buyer_unread ELSE c.seller_unread END,
+               c.last_message_at, m.id, s.username, m.content, m.timestamp
+        FROM (
+            SELECT * FROM conversations
+            WHERE buyer_id = %s OR seller_id = %s
+            ORDER BY last_message_at DESC NULLS LAST
+            LIMIT %s
+        ) c
+        JOIN users p ON p.id = CASE WHEN c.buyer_id = %s THEN c.seller_id ELSE c.buyer_id END
+        LEFT JOIN LATERAL (
+            SELECT mm.id, mm.sender_id, mm.timestamp,
+                   COALESCE(mm.ciphertext, convert_to(mm.encrypted_content, 'UTF8')) AS content
+            FROM messages mm
+            WHERE mm.conversation_id = c.id AND mm.timestamp >= c.created_at - %s
+            ORDER BY mm.timestamp DESC
+            LIMIT %s
+        ) m ON TRUE
+        LEFT JOIN users s ON s.id = m.sender_id
+        ORDER BY c.last_message_at DESC NULLS LAST, c.id, m.timestamp ASC
+    """, (user_id, user_id, user_id, max_conversations, user_id, PARTITION_PRUNE_MARGIN, preview_messages))
+    rows = cur.fetchall()
+    cur.close()
+    conn.close()
+    
+    plaintexts = decrypt_messages([row[7] for row in rows])
+    
+    conversations = []
+    by_id = {}
+    for row, text in zip(rows, plaintexts):
+        conv_id, partner, partner_role, unread, last_at, message_id, sender, _, timestamp = row
+        conv = by_id.get(conv_id)
+        if conv is None:
+            conv = by_id[conv_id] = {
+                "conversation_id": conv_id,
+                "partner": partner,
+                "partner_role": partner_role,
+                "unread": unread,
+                "last_message_time": last_at.isoformat() if last_at else None,
+                "messages": []
+            }
+            conversations.append(conv)
+        if message_id is not None and text is not None:
+            conv["messages"].append({
+                "id": message_id,
+                "sender": sender,
+                "message": text,
+                "timestamp": timestamp.isoformat() if timestamp else None
+            })
+    
+    return {
+        "username": username,
+        "role": role,
+        "contacts": list(contacts),
+        "conversations": conversations,
+        "total_unread": sum(c["unread"] for c in conversations)
+    }
+
+def get_history_batch(username, items, limit=20):
+    """Last limit messages of many conversations in one query.
+
+    items are dicts with either conversation_id or buyer and seller, plus an
+    optional before_id cursor. Only conversations username takes part in are
+    returned; results come back in request order.
+    """
+    conversation_ids, buyers, sellers, cursors = [], [], [], []
+    for item in items:
+        conversation_ids.append(item.get("conversation_id"))
+        buyers.append(item.get("buyer"))
+        sellers.append(item.get("seller"))
+        cursors.append(item.get("before_id"))
+    
+    conn = get_connection()
+    cur = conn.cursor()
+    
+    # One row per requested item resolves its conversation, then LATERAL reads
+    # limit + 1 rows per conversation (the extra one only signals has_more)
+    cur.execute("""
+        WITH req AS (
+            SELECT * FROM unnest(%s::int[], %s::text[], %s::text[], %s::int[])
+                WITH ORDINALITY AS r(conversation_id, buyer, seller, before_id, idx)
+        ),
+        conv AS (
+            SELECT req.idx, req.before_id, c.id, c.created_at
+            FROM req
+            JOIN conversations c ON c.id = COALESCE(req.conversation_id, (
+                SELECT c2.id FROM conversations c2
+                JOIN users b ON b.id = c2.buyer_id
+                JOIN users s ON s.id = c2.seller_id
+                WHERE b.username = req.buyer AND s.username = req.seller))
+            JOIN users viewer ON viewer.username = %s AND viewer.id IN (c.buyer_id, c.seller_id)
+        )
+        SELECT conv.idx, conv.id, m.id, u.username, m.content, m.timestamp
+        FROM conv
+        LEFT JOIN LATERAL (
+            SELECT mm.id, mm.sender_id, mm.timestamp,
+                   COALESCE(mm.ciphertext, convert_to(mm.encrypted_content, 'UTF8')) AS content
+            FROM messages mm
+            WHERE mm.conversation_id = conv.id
+              AND mm.timestamp >= conv.created_at - %s
+              AND (conv.before_id IS NULL OR mm.id < conv.before_id)
+            ORDER BY mm.timestamp DESC, mm.id DESC
+            LIMIT %s
+        ) m ON TRUE
+        LEFT JOIN users u ON u.id = m.sender_id
+        ORDER BY conv.idx, m.timestamp DESC, m.id DESC
+    """, (conversation_ids, buyers, sellers, cursors, username, PARTITION_PRUNE_MARGIN, limit + 1))
+    rows = cur.fetchall()
+    cur.close()
+    conn.close()
+    
+    # Keep at most limit rows per item before decrypting anything
+    pages = {}
+    kept = []
+    for idx, conversation_id, message_id, sender, content, timestamp in rows:
+        page = pages.setdefault(idx, {"conversation_id": conversation_id, "rows": [], "has_more": False})
+        if message_id is None:
+            continue
+        if len(page["rows"]) == limit:
+            page["has_more"] = True
+            continue
+        page["rows"].append((message_id, sender, timestamp))
+        kept.append(content)
+    
+    plaintexts = iter(decrypt_messages(kept))
+    results = []
+    for idx, item in enumerate(items, 1):
+        page = pages.get(idx)
+        if page is None:
+            results.append({"request": item, "error": "not_found"})
+            continue
+        messages = []
+        for message_id, sender, timestamp in page["rows"]:
+            text = next(plaintexts)
+            if text is not None:
+                messages.append({
+                    "id": message_id,
+                    "sender": sender,
+                    "message": text,
+                    "timestamp": timestamp.isoformat() if timestamp else None
+                })
+        messages.reverse()
+        results.append({
+            "request": item,
+            "conversation_id": page["conversation_id"],
+            "messages": messages,
+            "has_more": page["has_more"],
+            # Pass back as before_id to page further into the past
+            "next_cursor": page["rows"][-1][0] if page["has_more"] else None
+        })
+    return results
+
+def mark_conversation_read(reader_username, partner_username, last_read_id=None):
+    """Clear the reader's unread count up to last_read_id (everything if None); returns what is left"""
+    conn = get_connection()
+    cur = conn.cursor()
+    
+    cur.execute("""
+        SELECT c.id, c.buyer_id = r.id, c.last_message_id, c.created_at, r.id
+        FROM users r
+        JOIN users p ON p.username = %s
+        JOIN conversations c ON (c.buyer_id = r.id AND c.seller_id = p.id)
+                             OR (c.seller_id = r.id AND c.buyer_id = p.id)
+        WHERE r.username = %s
+        FOR UPDATE OF c
+    """, (partner_username, reader_username))
+    result = cur.fetchone()
+    if not result:
+        cur.close()
+        conn.close()
+        return None
+    
+    # The row lock holds back concurrent inserts until the new count is written
+    conversation_id, reader_is_buyer, last_message_id, created_at, reader_id = result
+    column = "buyer_unread" if reader_is_buyer else "seller_unread"
+    
+    if last_read_id is None or last_message_id is None or last_read_id >= last_message_id:
+        unread = 0
+    else:
+        # The reader has not caught up; count what arrived after what they saw
+        cur.execute("""
+            SELECT COUNT(*) FROM messages
+            WHERE conversation_id = %s AND timestamp >= %s AND id > %s AND receiver_id = %s
+        """, (conversation_id, created_at - PARTITION_PRUNE_MARGIN, last_read_id, reader_id))
+        unread = cur.fetchone()[0]
+    
+    cur.execute(f"UPDATE conversations SET {column} = %s WHERE id = %s", (unread, conversation_id))
+    conn.commit()
+    cur.close()
+    conn.close()
+    router.note_write(reader_username)
+    return unread
+
+def search_messages(username, partner_username, query, limit=20):
+    """Search messages within a conversation"""
     # Get user IDs
     buyer_info = get_user_id(username) if username.startswith('buyer') else get_user_id(partner_username)
     seller_info = get_user_id(partner_username) if partner_username.startswith('seller') else get_user_id(username)
     
     if not buyer_info or not seller_info:
-        cur.close()
-        conn.close()
         return []
     
+    conn = get_read_connection(username, partner_username)
+    cur = conn.cursor()
+    
     buyer_id = buyer_info[0]
     seller_id = seller_info[0]
     
@@ -257,7 +851,7 @@ def search_messages(username, partner_username, query, limit=20):
     
     # Search messages (we need to decrypt to search, so we'll fetch and filter)
     cur.execute("""
-        SELECT m.id, u.username, m.encrypted_content, m.timestamp
+        SELECT m.id, u.username, COALESCE(m.ciphertext, convert_to(m.encrypted_content, 'UTF8')), m.timestamp
         FROM messages m
         JOIN users u ON m.sender_id = u.id
         WHERE m.conversation_id = %s
@@ -290,20 +884,18 @@ def search_messages(username, partner_username, query, limit=20):
 
 def get_message_statistics(username, days=30):
     """Get message statistics for a user"""
-    conn = get_connection()
-    cur = conn.cursor()
-    
     # Get user info
     user_info = get_user_id(username)
     if not user_info:
-        cur.close()
-        conn.close()
         return {}
     
-    user_id, user_role = user_info[0]
+    conn = get_read_connection(username)
+    cur = conn.cursor()
+    
+    user_id, user_role = user_info
     cutoff_date = datetime.now() - timedelta(days=days)
     
-    # Get message statistics
+    # Get message statistics; the timestamp bound prunes older partitions
     if user_role == 'buyer':
         cur.execute("""
             SELECT 
@@ -312,7 +904,7 @@ def get_message_statistics(username, days=30):
                 COUNT(DISTINCT DATE(m.timestamp)) as active_days
             FROM messages m
             JOIN conversations c ON m.conversation_id = c.id
-            WHERE m.sender_id = %s OR m.receiver_id = %s
+            WHERE (m.sender_id = %s OR m.receiver_id = %s)
             AND m.timestamp >= %s
         """, (user_id, user_id, cutoff_date))
     else:  # seller
@@ -323,7 +915,7 @@ def get_message_statistics(username, days=30):
                 COUNT(DISTINCT DATE(m.timestamp)) as active_days
             FROM messages m
             JOIN conversations c ON m.conversation_id = c.id
-            WHERE m.sender_id = %s OR m.receiver_id = %s
+            WHERE (m.sender_id = %s OR m.receiver_id = %s)
             AND m.timestamp >= %s
         """, (user_id, user_id, cutoff_date))
     
@@ -338,6 +930,103 @@ def get_message_statistics(username, days=30):
         "period_days": days
     }
 
+def merge_response_sketches(deltas):
+    """Merge {(seller, day, kind): DDSketch} deltas into the stored per-day sketches"""
+    sellers = {seller_username: get_user_id(seller_username) for seller_username, _, _ in deltas}
+    conn = get_connection()
+    cur = conn.cursor()
+    empty = DDSketch().to_bytes()
+    try:
+        # Sorted keys lock rows in the same order on every node
+        for (seller_username, day, kind), delta in sorted(deltas.items()):
+            seller_info = sellers[seller_username]
+            if not seller_info:
+                continue
+            key = (seller_info[0], day, kind)
+            # Create the row first so concurrent flushes serialise on its lock
+            cur.execute("""
+                INSERT INTO response_time_sketches (seller_id, day, kind, sketch)
+                VALUES (%s, %s, %s, %s)
+                ON CONFLICT (seller_id, day, kind) DO NOTHING
+            """, key + (empty,))
+            cur.execute("""
+                SELECT sketch FROM response_time_sketches
+                WHERE seller_id = %s AND day = %s AND kind = %s
+                FOR UPDATE
+            """, key)
+            merged = DDSketch.from_bytes(cur.fetchone()[0]).merge(delta)
+            cur.execute("""
+                UPDATE response_time_sketches SET sketch = %s, updated_at = CURRENT_TIMESTAMP
+                WHERE seller_id = %s AND day = %s AND kind = %s
+            """, (merged.to_bytes(),) + key)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+        conn.close()
+
+def get_response_sketches(seller_username, since_day):
+    """[(day, kind, DDSketch)] for a seller from since_day on; one row per day and kind"""
+    seller_info = get_user_id(seller_username)
+    if not seller_info:
+        return []
+    
+    conn = get_connection()
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT day, kind, sketch FROM response_time_sketches
+        WHERE seller_id = %s AND day >= %s
+        ORDER BY day
+    """, (seller_info[0], since_day))
+    rows = cur.fetchall()
+    cur.close()
+    conn.close()
+    return [(day, kind, DDSketch.from_bytes(sketch)) for day, kind, sketch in rows]
+
+def save_attachment(uploader_username, address, size, content_type, filename=None):
+    """Record an upload stored under address; returns the attachment ID, None for unknown users"""
+    uploader_info = get_user_id(uploader_username)
+    if not uploader_info:
+        return None
+    conn = get_connection()
+    cur = conn.cursor()
+    cur.execute("""
+        INSERT INTO attachments (uploader_id, address, size, content_type, filename)
+        VALUES (%s, %s, %s, %s, %s)
+        RETURNING id
+    """, (uploader_info[0], address, size, content_type, filename))
+    attachment_id = cur.fetchone()[0]
+    conn.commit()
+    cur.close()
+    conn.close()
+    return attachment_id
+
+def get_attachment(attachment_id, username, sent_only=False):
+    """Attachment metadata if username uploaded it or sent/received a message carrying it.
+
+    With sent_only, only the uploader qualifies (used before attaching it to a message).
+    """
+    conn = get_connection()
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT a.id, a.address, a.size, a.content_type, a.filename
+        FROM attachments a
+        JOIN users u ON u.username = %s
+        WHERE a.id = %s
+          AND (a.uploader_id = u.id
+               OR (NOT %s AND EXISTS (
+                   SELECT 1 FROM messages m
+                   WHERE m.attachment_id = a.id AND (m.sender_id = u.id OR m.receiver_id = u.id))))
+    """, (username, attachment_id, sent_only))
+    result = cur.fetchone()
+    cur.close()
+    conn.close()
+    if not result:
+        return None
+    return dict(zip(("id", "address", "size", "content_type", "filename"), result))
+
 def delete_message(message_id, username):
     """Delete a message (only if user is sender)"""
     conn = get_connection()
@@ -363,11 +1052,12 @@ def delete_message(message_id, username):
     
     cur.close()
     conn.close()
+    router.note_write(username)
     return True
 
 def get_users_by_role(role):
     """Get all users with specific role"""
-    conn = get_connection()
+    conn = get_read_connection()
     cur = conn.cursor()
     cur.execute("SELECT username FROM users WHERE role = %s ORDER BY username", (role,))
     users = [row[0] for row in cur.fetchall()]
@@ -0,0 +1,152 @@
+"""
+Bounded PostgreSQL connection pool that tracks how long callers wait for a connection
+"""
+
+import os
+import threading
+import time
+from collections import deque
+import psycopg2
+import metrics
+
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 20))
+# A caller that cannot get a connection within this many seconds gets PoolTimeout
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', 5))
+# Half-life of the wait-time average once acquisitions stop
+DB_POOL_WAIT_HALF_LIFE = float(os.getenv('DB_POOL_WAIT_HALF_LIFE', 2))
+
+class PoolTimeout(psycopg2.OperationalError):
+    """No pooled connection became free in time"""
+
+class PooledConnection:
+    """Wraps a psycopg2 connection; close() hands it back to the pool"""
+
+    def __init__(self, pool, raw):
+        self.__dict__["_pool"] = pool
+        self.__dict__["_raw"] = raw
+
+    def __getattr__(self, name):
+        raw = self.__dict__.get("_raw")
+        if raw is None:
+            if name == "closed":
+                return 1
+            raise psycopg2.InterfaceError("connection already returned to the pool")
+        return getattr(raw, name)
+
+    def __setattr__(self, name, value):
+        setattr(self._raw, name, value)
+
+    def __enter__(self):
+        self._raw.__enter__()
+        return self
+
+    def __exit__(self, *exc):
+        return self._raw.__exit__(*exc)
+
+    def close(self):
+        raw = self.__dict__.pop("_raw", None)
+        if raw is not None:
+            self._pool.release(raw)
+
+    def __del__(self):
+        # Safety net for code paths that raise before closing
+        if self.__dict__.get("_raw") is not None:
+            self.close()
+
+class ConnectionPool:
+    """
+    At most size connections are checked out at once; further callers block
+    until one is returned. Idle connections are reused, broken ones replaced.
+    """
+
+    def __init__(self, connect, size=DB_POOL_SIZE, timeout=DB_POOL_TIMEOUT,
+                 half_life=DB_POOL_WAIT_HALF_LIFE):
+        self.connect = connect
+        self.size = size
+        self.timeout = timeout
+        self.half_life = half_life
+        self._idle = deque()
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+        self._in_use = 0
+        self._wait_ewma = 0.0
+        self._wait_updated = time.monotonic()
+
+    def acquire(self):
+        start = time.monotonic()
+        if not self._slots.acquire(timeout=self.timeout):
+            self._record_wait(time.monotonic() - start)
+            metrics.increment("db_pool_timeouts")
+            raise PoolTimeout(f"No database connection free within {self.timeout}s")
+        self._record_wait(time.monotonic() - start)
+
+        raw = None
+        with self._lock:
+            self._in_use += 1
+            while self._idle and raw is None:
+                candidate = self._idle.pop()
+                if not candidate.closed:
+                    raw = candidate
+        if raw is None:
+            try:
+                raw = self.connect()
+            except Exception:
+                with self._lock:
+                    self._in_use -= 1
+                self._slots.release()
+                raise
+        return PooledConnection(self, raw)
+
+    def prefill(self, count):
+        """Open up to count idle connections ahead of traffic; returns how many are idle"""
+        opened = []
+        try:
+            for _ in range(min(count, self.size)):
+                opened.append(self.acquire())
+        finally:
+            for conn in opened:
+                conn.close()
+        with self._lock:
+            return len(self._idle)
+
+    def release(self, raw):
+        try:
+            if not raw.closed:
+                # Never hand the next caller an open transaction or a changed mode
+                raw.rollback()
+                if raw.autocommit:
+                    raw.autocommit = False
+        except psycopg2.Error:
+            raw.close()
+        with self._lock:
+            self._in_use -= 1
+            if not raw.closed:
+                self._idle.append(raw)
+        self._slots.release()
+
+    def _record_wait(self, seconds):
+        with self._lock:
+            self._wait_ewma = self._decayed(time.monotonic()) * 0.8 + seconds * 1000 * 0.2
+            self._wait_updated = time.monotonic()
+
+    def _decayed(self, now):
+        return self._wait_ewma * 0.5 ** ((now - self._wait_updated) / self.half_life)
+
+    def wait_ms(self):
+        """Recent average wait for a connection, decaying while nobody acquires"""
+        with self._lock:
+            return self._decayed(time.monotonic())
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": self.size,
+                "in_use": self._in_use,
+                "idle": len(self._idle),
+                "wait_ms": round(self._decayed(time.monotonic()), 2)
+            }
+
+    def close_all(self):
+        with self._lock:
+            while self._idle:
+                self._idle.pop().close()
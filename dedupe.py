@@ -0,0 +1,73 @@
+"""
+Short-lived in-memory window of recently handled client message IDs
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+
+SEND_DEDUPE_TTL_SECONDS = float(os.getenv('SEND_DEDUPE_TTL_SECONDS', 300))
+SEND_DEDUPE_MAX_ENTRIES = int(os.getenv('SEND_DEDUPE_MAX_ENTRIES', 50000))
+# How long a retry waits for the original send still being processed
+SEND_DEDUPE_WAIT_SECONDS = float(os.getenv('SEND_DEDUPE_WAIT_SECONDS', 10))
+
+class PendingSend:
+    def __init__(self):
+        self.done = threading.Event()
+        self.message_id = None
+        self.expires_at = None
+
+class DedupeWindow:
+    """
+    Maps (sender, client_msg_id) to the stored message ID. The first send claims
+    the key; retries arriving while it is still being stored wait for its result
+    instead of inserting again. The database receipt table stays the source of
+    truth once entries expire or another node handled the first send.
+    """
+
+    def __init__(self, ttl=SEND_DEDUPE_TTL_SECONDS, max_entries=SEND_DEDUPE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def claim(self, key):
+        """Return (True, None) if the caller owns the send, else (False, pending entry)"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires_at is not None and entry.expires_at < now:
+                del self._entries[key]
+                entry = None
+            if entry is not None:
+                return False, entry
+            self._entries[key] = PendingSend()
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            return True, None
+
+    def wait(self, entry, timeout=SEND_DEDUPE_WAIT_SECONDS):
+        """Message ID stored by the original send, or None if it failed or timed out"""
+        entry.done.wait(timeout)
+        return entry.message_id
+
+    def complete(self, key, message_id):
+        """Record the stored message ID and wake any waiting retries"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = self._entries[key] = PendingSend()
+            entry.message_id = message_id
+            entry.expires_at = time.monotonic() + self.ttl
+        entry.done.set()
+
+    def release(self, key):
+        """Forget a send that failed so the client's retry is processed afresh"""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+        if entry is not None:
+            entry.done.set()
+
+    def __len__(self):
+        return len(self._entries)
@@ -1,24 +1,273 @@
+import base64
 import os
-from cryptography.fernet import Fernet
+import struct
+import threading
+import time
+from cryptography.fernet import Fernet, MultiFernet, InvalidToken
+
+try:
+    import zstandard
+except ImportError:  # compression is optional
+    zstandard = None
 
 # Load or generate encryption key
 KEY_FILE = "encryption.key"
 
-def get_or_create_key():
-    if os.path.exists(KEY_FILE):
-        with open(KEY_FILE, 'rb') as f:
+# Versioned keys, one "<version>:<key>" per line. The highest version is the
+# primary key used for new messages; older versions stay readable.
+KEYRING_FILE = os.getenv('ENCRYPTION_KEYRING', 'encryption.keyring')
+KEYRING_RELOAD_INTERVAL = float(os.getenv('ENCRYPTION_KEYRING_RELOAD', 5))
+
+# Tokens written before key versioning carry no tag and belong to version 1
+LEGACY_KEY_VERSION = 1
+TOKEN_TAG_PREFIX = "v"
+TOKEN_TAG_SEPARATOR = ":"
+
+# Binary ciphertext layout: flag byte, key-version byte, raw Fernet token.
+# Flag bytes stay below 0x10 so they never collide with legacy base64 text
+# tokens, which start with "v" (tagged) or "g" (untagged).
+CIPHERTEXT_HEADER = struct.Struct(">BB")
+BINARY_FLAG_LIMIT = 0x10
+FLAG_ZSTD = 0x01
+MAX_KEY_VERSION = 0xFF
+
+# Long messages are zstd-compressed before encryption. Compression makes
+# ciphertext length depend on content, so it can be disabled.
+MESSAGE_COMPRESSION = os.getenv('MESSAGE_COMPRESSION', 'True') == 'True'
+MESSAGE_COMPRESS_MIN_BYTES = int(os.getenv('MESSAGE_COMPRESS_MIN_BYTES', 512))
+ZSTD_LEVEL = int(os.getenv('ZSTD_LEVEL', 3))
+
+_zstd = threading.local()
+
+def get_or_create_key(key_file=KEY_FILE):
+    if os.path.exists(key_file):
+        with open(key_file, 'rb') as f:
             return f.read()
     else:
         key = Fernet.generate_key()
-        with open(KEY_FILE, 'wb') as f:
+        with open(key_file, 'wb') as f:
             f.write(key)
         return key
 
-key = get_or_create_key()
-cipher = Fernet(key)
+def split_token(token):
+    """Split a stored token into (key_version, fernet_token)"""
+    if token.startswith(TOKEN_TAG_PREFIX):
+        version, _, body = token[len(TOKEN_TAG_PREFIX):].partition(TOKEN_TAG_SEPARATOR)
+        return int(version), body
+    # Untagged Fernet tokens always start with "gAAAA"
+    return LEGACY_KEY_VERSION, token
+
+def compress(data):
+    """zstd-compress with a per-thread compressor (they are not thread-safe)"""
+    if not hasattr(_zstd, 'compressor'):
+        _zstd.compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL)
+    return _zstd.compressor.compress(data)
+
+def decompress(data):
+    if zstandard is None:
+        raise RuntimeError("zstandard is required to read compressed messages")
+    if not hasattr(_zstd, 'decompressor'):
+        _zstd.decompressor = zstandard.ZstdDecompressor()
+    return _zstd.decompressor.decompress(data)
+
+def is_binary_ciphertext(data):
+    return isinstance(data, (bytes, bytearray)) and len(data) > 0 and data[0] < BINARY_FLAG_LIMIT
+
+class KeyRing:
+    """Versioned Fernet keys loaded from the keyring file"""
+
+    def __init__(self, path=KEYRING_FILE, legacy_key_file=KEY_FILE):
+        self.path = path
+        self.legacy_key_file = legacy_key_file
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._checked_at = 0.0
+        # (primary_version, {version: Fernet}, MultiFernet) swapped atomically on reload
+        self._state = None
+        self.load()
+
+    def load(self):
+        """(Re)load all key versions from disk"""
+        with self._lock:
+            if not os.path.exists(self.path):
+                # Bootstrap the ring from the original single key file
+                legacy_key = get_or_create_key(self.legacy_key_file).strip()
+                self._write({LEGACY_KEY_VERSION: legacy_key})
+
+            keys = self._read()
+            ciphers = {version: Fernet(key) for version, key in keys.items()}
+            # MultiFernet encrypts with its first key, so order newest first
+            multi = MultiFernet([ciphers[version] for version in sorted(ciphers, reverse=True)])
+            self._state = (max(ciphers), ciphers, multi)
+            self._mtime = os.path.getmtime(self.path)
+            self._checked_at = time.monotonic()
+
+    def _read(self):
+        keys = {}
+        with open(self.path) as f:
+            for line in f:
+                line = line.strip()
+                if not line or line.startswith('#'):
+                    continue
+                version, key = line.split(':', 1)
+                keys[int(version)] = key.encode()
+        return keys
+
+    def _write(self, keys):
+        tmp_path = f"{self.path}.tmp"
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            for version in sorted(keys):
+                f.write(f"{version}:{keys[version].decode()}\n")
+        os.replace(tmp_path, self.path)
+
+    def maybe_reload(self):
+        """Pick up keys rotated by another process, checked at most every few seconds"""
+        now = time.monotonic()
+        if now - self._checked_at < KEYRING_RELOAD_INTERVAL:
+            return
+        self._checked_at = now
+        try:
+            if os.path.getmtime(self.path) != self._mtime:
+                self.load()
+        except OSError as e:
+            print(f"⚠️ Keyring reload failed: {e}")
+
+    def rotate(self):
+        """Add a new primary key and return its version"""
+        with self._lock:
+            keys = self._read()
+            new_version = max(keys) + 1
+            if new_version > MAX_KEY_VERSION:
+                raise ValueError("Key version space exhausted")
+            keys[new_version] = Fernet.generate_key()
+            self._write(keys)
+        self.load()
+        return new_version
+
+    @property
+    def current_version(self):
+        return self._state[0]
+
+    @property
+    def versions(self):
+        return sorted(self._state[1])
+
+    def cipher(self, version):
+        """Return the Fernet for a key version, reloading once for unknown versions"""
+        ciphers = self._state[1]
+        if version not in ciphers:
+            self.load()
+            ciphers = self._state[1]
+            if version not in ciphers:
+                raise InvalidToken(f"Unknown key version {version}")
+        return ciphers[version]
+
+    def encrypt(self, message):
+        """Encrypt to compact binary ciphertext under the primary key"""
+        self.maybe_reload()
+        version, ciphers, _ = self._state
+        flags = 0
+        plaintext = message.encode()
+        if MESSAGE_COMPRESSION and zstandard is not None and len(plaintext) >= MESSAGE_COMPRESS_MIN_BYTES:
+            compressed = compress(plaintext)
+            if len(compressed) < len(plaintext):
+                plaintext = compressed
+                flags |= FLAG_ZSTD
+        token = ciphers[version].encrypt(plaintext)
+        return CIPHERTEXT_HEADER.pack(flags, version) + base64.urlsafe_b64decode(token)
+
+    def encrypt_bytes(self, data):
+        """Binary ciphertext of raw bytes, never compressed so its size depends only on len(data)"""
+        self.maybe_reload()
+        version, ciphers, _ = self._state
+        token = ciphers[version].encrypt(bytes(data))
+        return CIPHERTEXT_HEADER.pack(0, version) + base64.urlsafe_b64decode(token)
+
+    def decrypt_bytes(self, data):
+        """Raw plaintext bytes of binary ciphertext"""
+        flags, version = CIPHERTEXT_HEADER.unpack_from(data)
+        token = base64.urlsafe_b64encode(data[CIPHERTEXT_HEADER.size:])
+        plaintext = self.cipher(version).decrypt(token)
+        if flags & FLAG_ZSTD:
+            plaintext = decompress(plaintext)
+        return plaintext
+
+    def decrypt(self, data):
+        """Decrypt binary ciphertext or a legacy base64 text token"""
+        if isinstance(data, memoryview):
+            data = data.tobytes()
+        if not is_binary_ciphertext(data):
+            if isinstance(data, (bytes, bytearray)):
+                data = data.decode()
+            return self.decrypt_text(data)
+
+        # The header names the key directly, so reads never trial-decrypt
+        return self.decrypt_bytes(data).decode()
+
+    def decrypt_many(self, items):
+        """Decrypt a batch in one pass; rows that fail or are missing come back as None"""
+        self.maybe_reload()
+        results = []
+        for data in items:
+            if data is None:
+                results.append(None)
+                continue
+            try:
+                results.append(self.decrypt(data))
+            except Exception as e:
+                print(f"Error decrypting message: {e}")
+                results.append(None)
+        return results
+
+    def decrypt_text(self, token):
+        version, body = split_token(token)
+        return self.cipher(version).decrypt(body.encode()).decode()
+
+    def needs_reencryption(self, data):
+        """True for legacy text tokens and ciphertext under an old key"""
+        if isinstance(data, memoryview):
+            data = data.tobytes()
+        if not is_binary_ciphertext(data):
+            return True
+        return data[1] != self.current_version
+
+    def reencrypt(self, data):
+        """Rewrite as binary ciphertext under the primary key"""
+        if isinstance(data, memoryview):
+            data = data.tobytes()
+        if not is_binary_ciphertext(data):
+            # Legacy text rows are re-encrypted in full so long ones get compressed
+            return self.encrypt(self.decrypt(data))
+
+        # Binary rows keep their flags and original Fernet timestamp
+        self.maybe_reload()
+        version, _, multi = self._state
+        flags = data[0]
+        token = base64.urlsafe_b64encode(data[CIPHERTEXT_HEADER.size:])
+        rotated = multi.rotate(token)
+        return CIPHERTEXT_HEADER.pack(flags, version) + base64.urlsafe_b64decode(rotated)
+
+# Read (or created) from disk on first use rather than at import
+_keyring = None
+_keyring_lock = threading.Lock()
+
+def get_keyring():
+    global _keyring
+    if _keyring is None:
+        with _keyring_lock:
+            if _keyring is None:
+                _keyring = KeyRing()
+    return _keyring
 
 def encrypt_message(message):
-    return cipher.encrypt(message.encode()).decode()
+    return get_keyring().encrypt(message)
 
 def decrypt_message(token):
-    return cipher.decrypt(token.encode()).decode()
+    return get_keyring().decrypt(token)
+
+def decrypt_messages(tokens):
+    return get_keyring().decrypt_many(tokens)
+
+def rotate_key():
+    return get_keyring().rotate()
@@ -0,0 +1,151 @@
+"""
+Per-seller FAQ answering with a NumPy BM25 index, consulted before the AI upstream
+"""
+
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import numpy as np
+import metrics
+
+SELLER_FAQ_FILE = os.getenv('SELLER_FAQ_FILE', 'seller_faq.json')
+FAQ_RELOAD_INTERVAL = float(os.getenv('FAQ_RELOAD_INTERVAL', 10))
+# Confidence (0-1) above which the FAQ answer is sent without calling the model
+FAQ_ANSWER_THRESHOLD = float(os.getenv('FAQ_ANSWER_THRESHOLD', 0.75))
+# Weaker matches are only handed to the model as reference material
+FAQ_HINT_THRESHOLD = float(os.getenv('FAQ_HINT_THRESHOLD', 0.3))
+FAQ_HINTS = int(os.getenv('FAQ_HINTS', 2))
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+_WORD = re.compile(r"[a-z0-9]+")
+STOPWORDS = {
+    "a", "an", "the", "is", "are", "am", "was", "were", "be", "do", "does", "did",
+    "i", "you", "we", "it", "this", "that", "my", "your", "me", "to", "of", "for",
+    "in", "on", "at", "and", "or", "can", "could", "would", "will", "what", "how",
+    "hi", "hey", "hello", "please", "there", "any", "u", "so", "if", "with"
+}
+
+def tokenize(text):
+    words = _WORD.findall(text.lower())
+    # Crude plural folding so "returns" matches "return"
+    return [w[:-1] if len(w) > 3 and w.endswith("s") and not w.endswith("ss") else w
+            for w in words if len(w) > 1 and w not in STOPWORDS]
+
+class FAQIndex:
+    """BM25 over one seller's entries; each entry is indexed by its question and keywords"""
+
+    def __init__(self, entries):
+        self.entries = entries
+        docs = [tokenize(e["question"] + " " + " ".join(e.get("keywords", []))) for e in entries]
+        self.vocab = {}
+        for doc in docs:
+            for term in doc:
+                self.vocab.setdefault(term, len(self.vocab))
+
+        # docs x vocab term frequencies
+        self.tf = np.zeros((len(docs), len(self.vocab)), dtype=np.float32)
+        for row, doc in enumerate(docs):
+            for term in doc:
+                self.tf[row, self.vocab[term]] += 1
+
+        n_docs = len(docs)
+        df = (self.tf > 0).sum(axis=0)
+        self.idf = np.log(1 + (n_docs - df + 0.5) / (df + 0.5)).astype(np.float32)
+        # Query terms missing from the index count against confidence like the rarest indexed term
+        self.unknown_idf = float(np.log(1 + (n_docs - 0.5) / 1.5)) if n_docs else 1.0
+        lengths = self.tf.sum(axis=1)
+        avg_length = lengths.mean() if n_docs else 1.0
+        self.norm = (BM25_K1 * (1 - BM25_B + BM25_B * lengths / max(avg_length, 1e-9))).astype(np.float32)
+
+    def search(self, question, limit=3):
+        """Return [(confidence, entry)] best first"""
+        terms = tokenize(question)
+        if not terms or not self.entries:
+            return []
+        columns = [self.vocab[t] for t in terms if t in self.vocab]
+        ideal = sum(float(self.idf[self.vocab[t]]) if t in self.vocab else self.unknown_idf for t in terms)
+        if not columns:
+            return []
+
+        tf = self.tf[:, columns]
+        scores = (self.idf[columns] * tf * (BM25_K1 + 1) / (tf + self.norm[:, None])).sum(axis=1)
+        # A single-occurrence match on an average-length entry scores exactly its idf,
+        # so matching every query term that way is confidence 1
+        confidence = np.minimum(scores / ideal, 1.0)
+        top = np.argsort(-confidence)[:limit]
+        return [(float(confidence[i]), self.entries[i]) for i in top if confidence[i] > 0]
+
+class FAQEngine:
+    """Seller FAQ indexes loaded from SELLER_FAQ_FILE, rebuilt per seller when entries change"""
+
+    def __init__(self, path=SELLER_FAQ_FILE):
+        self.path = path
+        self._indexes = {}
+        self._digests = {}
+        self._mtime = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        """(Re)load the FAQ file, rebuilding only sellers whose entries changed"""
+        with self._lock:
+            self._checked_at = time.monotonic()
+            if not os.path.exists(self.path):
+                self._indexes, self._digests, self._mtime = {}, {}, None
+                return
+            with open(self.path) as f:
+                data = json.load(f)
+            self._mtime = os.path.getmtime(self.path)
+
+            indexes = {}
+            digests = {}
+            rebuilt = 0
+            for seller_username, entries in data.items():
+                digest = hashlib.sha1(json.dumps(entries, sort_keys=True).encode()).hexdigest()
+                digests[seller_username] = digest
+                if self._digests.get(seller_username) == digest:
+                    indexes[seller_username] = self._indexes[seller_username]
+                else:
+                    indexes[seller_username] = FAQIndex(entries)
+                    rebuilt += 1
+            self._indexes = indexes
+            self._digests = digests
+            if rebuilt:
+                print(f"📚 FAQ index rebuilt for {rebuilt} seller(s)")
+
+    def maybe_reload(self):
+        """Pick up edits to the FAQ file, checked at most every few seconds"""
+        now = time.monotonic()
+        if now - self._checked_at < FAQ_RELOAD_INTERVAL:
+            return
+        self._checked_at = now
+        try:
+            mtime = os.path.getmtime(self.path) if os.path.exists(self.path) else None
+            if mtime != self._mtime:
+                self.load()
+        except (OSError, ValueError) as e:
+            print(f"⚠️ FAQ reload failed: {e}")
+
+    def search(self, seller_username, question, limit=FAQ_HINTS):
+        self.maybe_reload()
+        index = self._indexes.get(seller_username)
+        return index.search(question, limit) if index is not None else []
+
+    def answer(self, seller_username, question, buyer_username=None):
+        """Return (direct_answer or None, hint entries for the prompt)"""
+        hits = self.search(seller_username, question)
+        if hits and hits[0][0] >= FAQ_ANSWER_THRESHOLD:
+            return hits[0][1]["answer"].replace("{buyer}", buyer_username or "there"), []
+        return None, [entry for confidence, entry in hits if confidence >= FAQ_HINT_THRESHOLD]
+
+    def stats(self):
+        return {seller: len(index.entries) for seller, index in self._indexes.items()}
+
+faq_engine = FAQEngine()
+metrics.register_gauge("faq_entries", faq_engine.stats)
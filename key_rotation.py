@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""
+Online encryption-key rotation and throttled background re-encryption of messages
+
+The same worker converts legacy base64 text rows to binary ciphertext
+(see migrations/001_binary_ciphertext.sql).
+
+Usage:
+    python key_rotation.py rotate   # add a new primary key, then re-encrypt
+    python key_rotation.py run      # resume re-encryption from the checkpoint
+    python key_rotation.py status   # print progress from the checkpoint
+"""
+
+import json
+import os
+import sys
+import threading
+import time
+from datetime import datetime
+from psycopg2.extras import execute_values
+if __name__ == "__main__":
+    # .env is read here, before any imported module reads its settings; importing never reads it
+    from dotenv import load_dotenv
+    load_dotenv()
+from database import get_connection
+from encryption import get_keyring, rotate_key
+
+REENCRYPT_BATCH_SIZE = int(os.getenv('REENCRYPT_BATCH_SIZE', 500))
+REENCRYPT_ROWS_PER_SEC = float(os.getenv('REENCRYPT_ROWS_PER_SEC', 2000))
+REENCRYPT_CHECKPOINT_FILE = os.getenv('REENCRYPT_CHECKPOINT_FILE', 'reencrypt_checkpoint.json')
+
+# Bumped when the stored format changes so finished checkpoints are not reused
+STORAGE_FORMAT = 2
+
+class ReencryptionWorker:
+    """Walks messages in id order and rewrites rows not in the current key and format"""
+
+    def __init__(self, batch_size=REENCRYPT_BATCH_SIZE, rows_per_sec=REENCRYPT_ROWS_PER_SEC,
+                 checkpoint_file=REENCRYPT_CHECKPOINT_FILE):
+        self.batch_size = batch_size
+        self.rows_per_sec = rows_per_sec
+        self.checkpoint_file = checkpoint_file
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.progress = self.load_checkpoint()
+
+    def load_checkpoint(self):
+        """Resume from the checkpoint unless the primary key changed since"""
+        target_version = get_keyring().current_version
+        if os.path.exists(self.checkpoint_file):
+            with open(self.checkpoint_file) as f:
+                progress = json.load(f)
+            if (progress.get("target_version") == target_version and
+                    progress.get("storage_format") == STORAGE_FORMAT):
+                return progress
+        return {
+            "target_version": target_version,
+            "storage_format": STORAGE_FORMAT,
+            "last_id": 0,
+            "max_id": None,
+            "scanned": 0,
+            "rewritten": 0,
+            "errors": 0,
+            "done": False,
+            "started_at": datetime.now().isoformat(),
+            "updated_at": None
+        }
+
+    def save_checkpoint(self):
+        self.progress["updated_at"] = datetime.now().isoformat()
+        tmp_path = f"{self.checkpoint_file}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self.progress, f)
+        os.replace(tmp_path, self.checkpoint_file)
+
+    def run_batch(self, conn):
+        """Re-encrypt one keyset page; returns the number of rows scanned"""
+        cur = conn.cursor()
+        cur.execute(
+            "SELECT id, ciphertext, encrypted_content FROM messages WHERE id > %s ORDER BY id LIMIT %s",
+            (self.progress["last_id"], self.batch_size)
+        )
+        rows = cur.fetchall()
+        if not rows:
+            cur.close()
+            return 0
+
+        keyring = get_keyring()
+        updates = []
+        for message_id, ciphertext, legacy_token in rows:
+            content = ciphertext if ciphertext is not None else legacy_token
+            if not keyring.needs_reencryption(content):
+                continue
+            try:
+                updates.append((message_id, ciphertext, legacy_token, keyring.reencrypt(content)))
+            except Exception as e:
+                print(f"Error re-encrypting message {message_id}: {e}")
+                self.progress["errors"] += 1
+
+        if updates:
+            # Only overwrite rows that still hold the content we read, so
+            # concurrent edits and deletes are never clobbered
+            execute_values(cur, """
+                UPDATE messages AS m SET ciphertext = v.new_ciphertext, encrypted_content = NULL
+                FROM (VALUES %s) AS v(id, old_ciphertext, old_content, new_ciphertext)
+                WHERE m.id = v.id
+                  AND m.ciphertext IS NOT DISTINCT FROM v.old_ciphertext
+                  AND m.encrypted_content IS NOT DISTINCT FROM v.old_content
+            """, updates, template="(%s, %s::bytea, %s::text, %s::bytea)", page_size=self.batch_size)
+            self.progress["rewritten"] += cur.rowcount
+        conn.commit()
+        cur.close()
+
+        self.progress["last_id"] = rows[-1][0]
+        self.progress["scanned"] += len(rows)
+        return len(rows)
+
+    def run(self):
+        """Re-encrypt until the table is exhausted or stop() is called"""
+        conn = get_connection()
+        try:
+            if self.progress["max_id"] is None:
+                cur = conn.cursor()
+                cur.execute("SELECT COALESCE(MAX(id), 0) FROM messages")
+                self.progress["max_id"] = cur.fetchone()[0]
+                cur.close()
+
+            print(f"🔑 Re-encrypting messages to key v{self.progress['target_version']} "
+                  f"from id {self.progress['last_id']}")
+            while not self.stop_event.is_set():
+                started = time.monotonic()
+                scanned = self.run_batch(conn)
+                if scanned == 0:
+                    self.progress["done"] = True
+                    self.save_checkpoint()
+                    break
+                self.save_checkpoint()
+                self.report()
+
+                # Throttle to the configured rows/sec so the chat keeps its DB headroom
+                elapsed = time.monotonic() - started
+                delay = scanned / self.rows_per_sec - elapsed
+                if delay > 0:
+                    self.stop_event.wait(delay)
+        finally:
+            conn.close()
+
+        if self.progress["done"]:
+            print(f"✅ Re-encryption complete: {self.progress['rewritten']} rewritten, "
+                  f"{self.progress['errors']} errors")
+        return self.progress
+
+    def report(self):
+        max_id = self.progress["max_id"] or 0
+        percent = min(100.0, 100.0 * self.progress["last_id"] / max_id) if max_id else 100.0
+        print(f"🔄 Re-encryption {percent:.1f}% (id {self.progress['last_id']}/{max_id}, "
+              f"{self.progress['rewritten']} rewritten, {self.progress['errors']} errors)")
+
+    def start(self):
+        """Run in a background thread"""
+        self.thread = threading.Thread(target=self.run, name="reencryption-worker", daemon=True)
+        self.thread.start()
+        return self.thread
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join()
+
+def main():
+    command = sys.argv[1] if len(sys.argv) > 1 else "status"
+
+    if command == "rotate":
+        version = rotate_key()
+        print(f"🔑 New primary key version: v{version}")
+        ReencryptionWorker().run()
+    elif command == "run":
+        ReencryptionWorker().run()
+    elif command == "status":
+        worker = ReencryptionWorker()
+        keyring = get_keyring()
+        print(f"🔑 Primary key version: v{keyring.current_version} (known: {keyring.versions})")
+        worker.report()
+        print(f"   Done: {worker.progress['done']} | Updated: {worker.progress['updated_at']}")
+    else:
+        print(__doc__)
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
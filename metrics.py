@@ -0,0 +1,37 @@
+"""
+Process-wide counters and gauges, exposed at /api/metrics
+"""
+
+import threading
+
+_lock = threading.Lock()
+_counters = {}
+_gauges = {}
+
+def increment(name, value=1):
+    """Add value to a counter"""
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+def register_gauge(name, read):
+    """Register a callable evaluated on every snapshot"""
+    with _lock:
+        _gauges[name] = read
+
+def get_counter(name):
+    return _counters.get(name, 0)
+
+def snapshot():
+    """Return current counter values and gauge readings"""
+    with _lock:
+        counters = dict(_counters)
+        gauges = dict(_gauges)
+
+    readings = {}
+    for name, read in gauges.items():
+        try:
+            readings[name] = read()
+        except Exception as e:
+            print(f"⚠️ Gauge {name} failed: {e}")
+            readings[name] = None
+    return {"counters": counters, "gauges": readings}
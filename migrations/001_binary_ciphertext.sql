@@ -0,0 +1,23 @@
+-- Migration: store message ciphertext as raw BYTEA instead of base64 TEXT
+--
+-- 1. Apply this file (metadata-only changes, no table rewrite):
+--      psql -h localhost -U moturi311 -d chatdb -f migrations/001_binary_ciphertext.sql
+-- 2. Convert existing rows in throttled batches while the chat keeps serving:
+--      python key_rotation.py run
+--    Converted rows get ciphertext set and encrypted_content cleared.
+-- 3. Reclaim the space of converted rows:
+--      VACUUM (ANALYZE) messages;
+
+BEGIN;
+
+ALTER TABLE messages ADD COLUMN IF NOT EXISTS ciphertext BYTEA;
+ALTER TABLE messages ALTER COLUMN ciphertext SET STORAGE EXTERNAL;
+ALTER TABLE messages ALTER COLUMN encrypted_content DROP NOT NULL;
+
+ALTER TABLE messages DROP CONSTRAINT IF EXISTS messages_content_present;
+ALTER TABLE messages ADD CONSTRAINT messages_content_present
+    CHECK (ciphertext IS NOT NULL OR encrypted_content IS NOT NULL) NOT VALID;
+
+COMMIT;
+
+ALTER TABLE messages VALIDATE CONSTRAINT messages_content_present;
@@ -0,0 +1,76 @@
+-- Migration: convert messages into a table partitioned by month on timestamp
+--
+--   psql -h localhost -U moturi311 -d chatdb -f migrations/002_partition_messages.sql
+--
+-- Requires migrations/001_binary_ciphertext.sql. The table is locked while rows
+-- are copied, so run it in a maintenance window. Afterwards partitions are kept
+-- ahead and old ones archived by `python partitions.py maintain`.
+
+BEGIN;
+
+LOCK TABLE messages IN ACCESS EXCLUSIVE MODE;
+
+ALTER TABLE messages RENAME TO messages_unpartitioned;
+ALTER TABLE messages_unpartitioned RENAME CONSTRAINT messages_content_present TO messages_unpartitioned_content_present;
+ALTER INDEX idx_messages_conversation RENAME TO idx_messages_unpartitioned_conversation;
+ALTER INDEX idx_messages_timestamp RENAME TO idx_messages_unpartitioned_timestamp;
+
+CREATE TABLE messages (
+    id INTEGER NOT NULL DEFAULT nextval('messages_id_seq'),
+    conversation_id INTEGER REFERENCES conversations(id) ON DELETE CASCADE,
+    sender_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
+    receiver_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
+    ciphertext BYTEA,
+    encrypted_content TEXT,
+    timestamp TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (id, timestamp),
+    CONSTRAINT messages_content_present CHECK (ciphertext IS NOT NULL OR encrypted_content IS NOT NULL)
+) PARTITION BY RANGE (timestamp);
+
+ALTER TABLE messages ALTER COLUMN ciphertext SET STORAGE EXTERNAL;
+ALTER SEQUENCE messages_id_seq OWNED BY messages.id;
+
+CREATE OR REPLACE FUNCTION ensure_message_partitions(
+    months_ahead INTEGER DEFAULT 3,
+    from_month DATE DEFAULT CURRENT_DATE
+) RETURNS INTEGER AS $$
+DECLARE
+    month_start DATE;
+    partition_name TEXT;
+    created INTEGER := 0;
+BEGIN
+    FOR i IN 0..months_ahead LOOP
+        month_start := (date_trunc('month', from_month) + make_interval(months => i))::date;
+        partition_name := 'messages_' || to_char(month_start, 'YYYY_MM');
+        IF to_regclass(partition_name) IS NULL THEN
+            EXECUTE format('CREATE TABLE %I PARTITION OF messages FOR VALUES FROM (%L) TO (%L)',
+                           partition_name, month_start, (month_start + INTERVAL '1 month')::date);
+            EXECUTE format('ALTER TABLE %I ALTER COLUMN ciphertext SET STORAGE EXTERNAL', partition_name);
+            created := created + 1;
+        END IF;
+    END LOOP;
+    RETURN created;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Partitions from the oldest message up to three months ahead
+SELECT ensure_message_partitions(
+    ((EXTRACT(YEAR FROM age(date_trunc('month', CURRENT_DATE), date_trunc('month', oldest))) * 12 +
+      EXTRACT(MONTH FROM age(date_trunc('month', CURRENT_DATE), date_trunc('month', oldest))))::integer + 3),
+    oldest::date
+)
+FROM (SELECT COALESCE(MIN(timestamp), CURRENT_TIMESTAMP) AS oldest FROM messages_unpartitioned) AS bounds;
+
+INSERT INTO messages (id, conversation_id, sender_id, receiver_id, ciphertext, encrypted_content, timestamp)
+SELECT id, conversation_id, sender_id, receiver_id, ciphertext, encrypted_content,
+       COALESCE(timestamp, CURRENT_TIMESTAMP)
+FROM messages_unpartitioned;
+
+CREATE INDEX idx_messages_conversation ON messages(conversation_id, timestamp);
+CREATE INDEX idx_messages_timestamp ON messages(timestamp);
+
+DROP TABLE messages_unpartitioned;
+
+COMMIT;
+
+ANALYZE messages;
@@ -0,0 +1,20 @@
+-- Migration: client message IDs for idempotent sends
+--
+--      psql -h localhost -U moturi311 -d chatdb -f migrations/003_message_receipts.sql
+--
+-- Receipts older than MESSAGE_RECEIPT_RETENTION_DAYS are purged by
+-- `python partitions.py maintain`.
+
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS message_receipts (
+    sender_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    client_msg_id VARCHAR(64) NOT NULL,
+    message_id INTEGER NOT NULL,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (sender_id, client_msg_id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_message_receipts_created ON message_receipts(created_at);
+
+COMMIT;
@@ -0,0 +1,23 @@
+-- Migration: per-conversation last message and unread counters for the login inbox
+--
+--      psql -h localhost -U moturi311 -d chatdb -f migrations/004_inbox_counters.sql
+--
+-- Existing messages are treated as read; counters grow from the next insert.
+
+BEGIN;
+
+ALTER TABLE conversations ADD COLUMN IF NOT EXISTS last_message_id INTEGER;
+ALTER TABLE conversations ADD COLUMN IF NOT EXISTS last_message_at TIMESTAMP;
+ALTER TABLE conversations ADD COLUMN IF NOT EXISTS buyer_unread INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE conversations ADD COLUMN IF NOT EXISTS seller_unread INTEGER NOT NULL DEFAULT 0;
+
+UPDATE conversations c
+SET last_message_id = latest.id, last_message_at = latest.timestamp
+FROM (
+    SELECT DISTINCT ON (conversation_id) conversation_id, id, timestamp
+    FROM messages
+    ORDER BY conversation_id, timestamp DESC, id DESC
+) latest
+WHERE latest.conversation_id = c.id;
+
+COMMIT;
@@ -0,0 +1,18 @@
+-- Migration: per-seller, per-day response-time sketches for /api/analytics/seller
+--
+--      psql -h localhost -U moturi311 -d chatdb -f migrations/005_response_time_sketches.sql
+--
+-- Response times are only recorded from now on; history is not backfilled.
+
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS response_time_sketches (
+    seller_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    day DATE NOT NULL,
+    kind VARCHAR(10) NOT NULL,
+    sketch BYTEA NOT NULL,
+    updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (seller_id, day, kind)
+);
+
+COMMIT;
@@ -0,0 +1,22 @@
+-- Migration: attachments table and a reference to it from messages
+--
+--      psql -h localhost -U moturi311 -d chatdb -f migrations/006_attachments.sql
+--
+-- Adding a nullable column without a default does not rewrite the partitions.
+
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS attachments (
+    id SERIAL PRIMARY KEY,
+    uploader_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    address CHAR(64) NOT NULL,
+    size BIGINT NOT NULL,
+    content_type VARCHAR(100) NOT NULL,
+    filename VARCHAR(255),
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+ALTER TABLE messages ADD COLUMN IF NOT EXISTS attachment_id INTEGER REFERENCES attachments(id) ON DELETE SET NULL;
+CREATE INDEX IF NOT EXISTS idx_messages_attachment ON messages(attachment_id) WHERE attachment_id IS NOT NULL;
+
+COMMIT;
@@ -0,0 +1,90 @@
+"""
+Live operations snapshot pushed to the /ops Socket.IO namespace
+"""
+
+import os
+import threading
+import time
+from collections import deque
+from sketches import DDSketch
+
+OPS_NAMESPACE = "/ops"
+OPS_TICK_SECONDS = float(os.getenv('OPS_TICK_SECONDS', 1.0))
+# Subscribers must present this token; unset leaves the dashboard open (development)
+OPS_TOKEN = os.getenv('OPS_TOKEN')
+# Handler timings kept between ticks; beyond this the oldest are dropped
+OPS_MAX_SAMPLES = int(os.getenv('OPS_MAX_SAMPLES', 100000))
+
+class HandlerStats:
+    """
+    Handler timings recorded without locks: deque.append is atomic, so handler
+    threads never contend. Each tick drains the samples into one fresh sketch.
+    """
+
+    def __init__(self, max_samples=OPS_MAX_SAMPLES):
+        self._samples = deque(maxlen=max_samples)
+        self._drained_at = time.monotonic()
+
+    def record(self, event, seconds):
+        self._samples.append((event, seconds))
+
+    def drain(self):
+        """Return (elapsed seconds, {event: count}, DDSketch of latencies in ms) since the last drain"""
+        now = time.monotonic()
+        elapsed = max(now - self._drained_at, 1e-6)
+        self._drained_at = now
+        counts = {}
+        sketch = DDSketch()
+        samples = self._samples
+        for _ in range(len(samples)):
+            try:
+                event, seconds = samples.popleft()
+            except IndexError:
+                break
+            counts[event] = counts.get(event, 0) + 1
+            # Milliseconds, so sub-millisecond handlers stay above the sketch's zero threshold
+            sketch.add(seconds * 1000)
+        return elapsed, counts, sketch
+
+class OpsBroadcaster:
+    """Computes one snapshot per tick while anyone is subscribed and broadcasts it to all of them"""
+
+    def __init__(self, socketio, collect, interval=OPS_TICK_SECONDS, namespace=OPS_NAMESPACE):
+        self.socketio = socketio
+        self.collect = collect
+        self.interval = interval
+        self.namespace = namespace
+        self.subscribers = 0
+        self.latest = None
+        self._running = False
+        self._lock = threading.Lock()
+
+    def subscribe(self):
+        with self._lock:
+            self.subscribers += 1
+            if not self._running:
+                self._running = True
+                self.socketio.start_background_task(self._loop)
+        return self.latest
+
+    def unsubscribe(self):
+        with self._lock:
+            self.subscribers = max(0, self.subscribers - 1)
+
+    def tick(self):
+        self.latest = self.collect()
+        # One emit to the namespace reaches every subscriber
+        self.socketio.emit("snapshot", self.latest, namespace=self.namespace)
+        return self.latest
+
+    def _loop(self):
+        while True:
+            with self._lock:
+                if self.subscribers == 0:
+                    self._running = False
+                    return
+            try:
+                self.tick()
+            except Exception as e:
+                print(f"⚠️ Ops snapshot failed: {e}")
+            self.socketio.sleep(self.interval)
@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+"""
+Monthly partition maintenance, retention and cold archival for messages
+
+Usage:
+    python partitions.py maintain   # create partitions ahead, archive expired ones, purge old receipts
+    python partitions.py ensure     # only create partitions ahead
+    python partitions.py list       # show live partitions and archives
+"""
+
+import csv
+import gzip
+import os
+import re
+import sys
+import threading
+from datetime import date, datetime
+if __name__ == "__main__":
+    # .env is read here, before any imported module reads its settings; importing never reads it
+    from dotenv import load_dotenv
+    load_dotenv()
+from database import get_connection, get_user_id, purge_message_receipts, PARTITION_PRUNE_MARGIN
+from encryption import decrypt_message
+import metrics
+
+PARTITION_MONTHS_AHEAD = int(os.getenv('PARTITION_MONTHS_AHEAD', 3))
+# Running nodes create upcoming partitions this often, with or without the cron job
+PARTITION_CHECK_SECONDS = float(os.getenv('PARTITION_CHECK_SECONDS', 24 * 3600))
+# Partitions older than this many months are detached and archived (0 keeps everything)
+MESSAGE_RETENTION_MONTHS = int(os.getenv('MESSAGE_RETENTION_MONTHS', 12))
+ARCHIVE_DIR = os.getenv('MESSAGE_ARCHIVE_DIR', 'archive')
+# Send receipts only need to outlive client retries
+MESSAGE_RECEIPT_RETENTION_DAYS = int(os.getenv('MESSAGE_RECEIPT_RETENTION_DAYS', 7))
+
+PARTITION_NAME = re.compile(r"^messages_(\d{4})_(\d{2})$")
+ARCHIVE_NAME = re.compile(r"^messages_(\d{4})_(\d{2})\.csv\.gz$")
+ARCHIVE_COLUMNS = ["id", "conversation_id", "sender_id", "receiver_id",
+                   "ciphertext", "encrypted_content", "timestamp"]
+
+def partition_month(name):
+    """Return the first day of the month a partition or archive covers"""
+    match = PARTITION_NAME.match(name) or ARCHIVE_NAME.match(name)
+    return date(int(match.group(1)), int(match.group(2)), 1) if match else None
+
+def add_months(month_start, months):
+    index = month_start.year * 12 + month_start.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+def ensure_partitions(months_ahead=PARTITION_MONTHS_AHEAD):
+    """Create monthly partitions from the current month up to months_ahead later"""
+    conn = get_connection()
+    cur = conn.cursor()
+    cur.execute("SELECT ensure_message_partitions(%s)", (months_ahead,))
+    created = cur.fetchone()[0]
+    conn.commit()
+    cur.close()
+    conn.close()
+    if created:
+        print(f"🗂️ Created {created} message partition(s)")
+    return created
+
+def keep_partitions_ahead(interval=PARTITION_CHECK_SECONDS, ensure=ensure_partitions, stopped=None):
+    """Run ensure every interval on a daemon thread, so a long-running node never runs
+    out of partitions to insert into; returns the thread"""
+    stopped = stopped or threading.Event()
+
+    def loop():
+        while not stopped.wait(interval):
+            try:
+                ensure()
+            except Exception as e:
+                # Inserts start failing once the last partition is behind us
+                metrics.increment("partition_check_failures")
+                print(f"❌ Creating message partitions failed: {e}")
+
+    thread = threading.Thread(target=loop, name="partitions", daemon=True)
+    thread.start()
+    return thread
+
+def list_partitions():
+    """Return (name, month) for partitions attached to messages, oldest first"""
+    conn = get_connection()
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT c.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON i.inhrelid = c.oid
+        WHERE i.inhparent = 'messages'::regclass
+    """)
+    names = [row[0] for row in cur.fetchall()]
+    cur.close()
+    conn.close()
+    partitions = [(name, partition_month(name)) for name in names if partition_month(name)]
+    return sorted(partitions, key=lambda partition: partition[1])
+
+def list_detached_partitions():
+    """Partition tables left detached by an interrupted archive run"""
+    conn = get_connection()
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT c.relname
+        FROM pg_class c
+        JOIN pg_namespace n ON c.relnamespace = n.oid
+        WHERE n.nspname = current_schema() AND c.relkind = 'r'
+          AND c.relname ~ '^messages_[0-9]{4}_[0-9]{2}$'
+          AND NOT c.relispartition
+    """)
+    names = [row[0] for row in cur.fetchall()]
+    cur.close()
+    conn.close()
+    return sorted(names)
+
+def archive_path(name):
+    return os.path.join(ARCHIVE_DIR, f"{name}.csv.gz")
+
+def archive_partition(name, attached=True):
+    """Detach a partition, write it to a gzip'd CSV archive and drop it"""
+    os.makedirs(ARCHIVE_DIR, exist_ok=True)
+    path = archive_path(name)
+    tmp_path = f"{path}.tmp"
+
+    conn = get_connection()
+    cur = conn.cursor()
+    if attached:
+        # Once detached, queries on messages no longer see these rows
+        cur.execute(f'ALTER TABLE messages DETACH PARTITION "{name}"')
+        conn.commit()
+
+    # Ciphertext is archived as stored; archives stay encrypted at rest
+    with gzip.open(tmp_path, 'wb') as f:
+        cur.copy_expert(
+            f'COPY (SELECT {", ".join(ARCHIVE_COLUMNS)} FROM "{name}" '
+            f'ORDER BY conversation_id, timestamp) TO STDOUT WITH (FORMAT csv, HEADER)',
+            f
+        )
+    with open(tmp_path, 'rb') as f:
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+    cur.execute(f'DROP TABLE "{name}"')
+    conn.commit()
+    cur.close()
+    conn.close()
+    print(f"📦 Archived partition {name} to {path}")
+    return path
+
+def run_retention(retention_months=MESSAGE_RETENTION_MONTHS):
+    """Archive every partition that ended before the retention cutoff"""
+    archived = []
+    # Finish archives interrupted between detach and drop first
+    for name in list_detached_partitions():
+        archived.append(archive_partition(name, attached=False))
+
+    if retention_months <= 0:
+        return archived
+
+    cutoff = add_months(date.today().replace(day=1), -retention_months)
+    for name, month_start in list_partitions():
+        if add_months(month_start, 1) <= cutoff:
+            archived.append(archive_partition(name))
+    return archived
+
+def list_archives():
+    """Return (path, month) for every archive file, oldest first"""
+    if not os.path.isdir(ARCHIVE_DIR):
+        return []
+    archives = [(os.path.join(ARCHIVE_DIR, name), partition_month(name))
+                for name in os.listdir(ARCHIVE_DIR) if ARCHIVE_NAME.match(name)]
+    return sorted(archives, key=lambda archive: archive[1])
+
+def parse_bytea(value):
+    # COPY writes bytea in hex format: \x0102...
+    return bytes.fromhex(value[2:]) if value else None
+
+def iter_archived_messages(conversation_id, since=None):
+    """Yield archived message rows of one conversation in chronological order"""
+    for path, month_start in list_archives():
+        if since and add_months(month_start, 1) <= since.date().replace(day=1):
+            continue
+        with gzip.open(path, 'rt', newline='') as f:
+            for row in csv.DictReader(f):
+                if int(row["conversation_id"] or 0) != conversation_id:
+                    continue
+                yield {
+                    "id": int(row["id"]),
+                    "sender_id": int(row["sender_id"]),
+                    "content": parse_bytea(row["ciphertext"]) or row["encrypted_content"],
+                    "timestamp": datetime.fromisoformat(row["timestamp"])
+                }
+
+def export_conversation(buyer_username, seller_username):
+    """Export the full decrypted history of a conversation, archives included"""
+    buyer_info = get_user_id(buyer_username)
+    seller_info = get_user_id(seller_username)
+    if not buyer_info or not seller_info:
+        return []
+
+    conn = get_connection()
+    cur = conn.cursor()
+    cur.execute(
+        "SELECT id, created_at FROM conversations WHERE buyer_id = %s AND seller_id = %s",
+        (buyer_info[0], seller_info[0])
+    )
+    conversation = cur.fetchone()
+    if not conversation:
+        cur.close()
+        conn.close()
+        return []
+    conversation_id, created_at = conversation
+    since = created_at - PARTITION_PRUNE_MARGIN
+
+    cur.execute("""
+        SELECT m.id, m.sender_id, COALESCE(m.ciphertext, convert_to(m.encrypted_content, 'UTF8')), m.timestamp
+        FROM messages m
+        WHERE m.conversation_id = %s AND m.timestamp >= %s
+        ORDER BY m.timestamp ASC
+    """, (conversation_id, since))
+    live_rows = cur.fetchall()
+    cur.close()
+    conn.close()
+
+    usernames = {buyer_info[0]: buyer_username, seller_info[0]: seller_username}
+    rows = list(iter_archived_messages(conversation_id, since=since))
+    rows.extend({"id": message_id, "sender_id": sender_id, "content": content, "timestamp": timestamp}
+                for message_id, sender_id, content, timestamp in live_rows)
+
+    history = []
+    for row in rows:
+        try:
+            history.append({
+                "id": row["id"],
+                "sender": usernames.get(row["sender_id"]),
+                "message": decrypt_message(row["content"]),
+                "timestamp": row["timestamp"].isoformat()
+            })
+        except Exception as e:
+            print(f"Error decrypting message {row['id']}: {e}")
+            continue
+    return history
+
+def main():
+    command = sys.argv[1] if len(sys.argv) > 1 else "list"
+
+    if command == "maintain":
+        ensure_partitions()
+        archived = run_retention()
+        purged = purge_message_receipts(MESSAGE_RECEIPT_RETENTION_DAYS)
+        print(f"✅ Partition maintenance done, {len(archived)} partition(s) archived, {purged} receipt(s) purged")
+    elif command == "ensure":
+        ensure_partitions()
+    elif command == "list":
+        print("🗂️ Live partitions:")
+        for name, _ in list_partitions():
+            print(f"   {name}")
+        print("📦 Archives:")
+        for path, _ in list_archives():
+            print(f"   {path}")
+    else:
+        print(__doc__)
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,204 @@
+"""
+On-demand profiling of live handlers: stack sampling or cProfile for 1 in N events
+"""
+
+import cProfile
+import itertools
+import json
+import os
+import pstats
+import re
+import sys
+import threading
+import time
+from datetime import datetime
+
+PROFILE_DIR = os.getenv('PROFILE_DIR', 'profiles')
+# A session stops by itself after this long, whatever was requested
+PROFILE_MAX_SECONDS = float(os.getenv('PROFILE_MAX_SECONDS', 60))
+PROFILE_SAMPLE_INTERVAL = float(os.getenv('PROFILE_SAMPLE_INTERVAL', 0.005))
+# In cprofile mode, profile one event in this many
+PROFILE_EVERY = int(os.getenv('PROFILE_EVERY', 10))
+PROFILE_MAX_STACKS = 50000
+
+MODES = ("sample", "cprofile")
+
+def _safe_name(label):
+    return re.sub(r"[^\w.-]", "_", label) or "unknown"
+
+def fold(frame, label):
+    """'label;outer (file.py:12);...;inner (file.py:40)' as used by flamegraph.pl and speedscope"""
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    stack.append(label)
+    return ";".join(reversed(stack))
+
+class Profiler:
+    """
+    Handlers call begin(label)/end(token) around their work, but only while
+    active is set, so a disabled profiler costs one attribute check per event.
+    In sample mode a background thread folds the stacks of threads inside a
+    handler every interval; in cprofile mode every Nth event runs under
+    cProfile. Results land in directory/<session id>/ when the session ends.
+    """
+
+    def __init__(self, directory=PROFILE_DIR, interval=PROFILE_SAMPLE_INTERVAL, max_seconds=PROFILE_MAX_SECONDS):
+        self.directory = directory
+        self.interval = interval
+        self.max_seconds = max_seconds
+        self.active = False
+        self.mode = None
+        self.session = None
+        self.last = None
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._reset(PROFILE_EVERY)
+
+    def _reset(self, every):
+        self._every = max(1, every)
+        self._events = itertools.count()
+        self._labels = {}
+        self._samples = {}
+        self._profiles = {}
+        self._calls = {}
+
+    def start(self, mode="sample", seconds=None, every=PROFILE_EVERY):
+        """Begin a session; returns it, or None if one is already running"""
+        if mode not in MODES:
+            raise ValueError(f"mode must be one of {', '.join(MODES)}")
+        seconds = min(float(seconds or self.max_seconds), self.max_seconds)
+        with self._lock:
+            if self.active:
+                return None
+            self._reset(every)
+            self.session = {
+                "id": datetime.now().strftime("%Y%m%d-%H%M%S-%f"),
+                "mode": mode,
+                "seconds": seconds,
+                "every": self._every if mode == "cprofile" else None,
+                "started": datetime.now().isoformat(timespec="seconds")
+            }
+            self.mode = mode
+            # Per session, so a stopping session's thread never runs into the next one
+            self._stopped = stopped = threading.Event()
+            self.active = True
+        threading.Thread(target=self._run, args=(seconds, stopped), name="profiler", daemon=True).start()
+        print(f"🔬 Profiling started: {mode} for {seconds:.0f}s")
+        return self.session
+
+    def toggle(self):
+        """Start a default sampling session, or stop the running one (for a signal handler)"""
+        return self.stop() if self.active else self.start()
+
+    def _run(self, seconds, stopped):
+        deadline = time.monotonic() + seconds
+        sampling = self.mode == "sample"
+        while not stopped.wait(self.interval if sampling else 0.25):
+            if time.monotonic() >= deadline:
+                self.stop()
+                return
+            if sampling:
+                self._sample()
+
+    def _sample(self):
+        me = threading.get_ident()
+        labels = dict(self._labels)
+        stacks = [fold(frame, labels[ident]) for ident, frame in sys._current_frames().items()
+                  if ident in labels and ident != me]
+        with self._lock:
+            samples = self._samples
+            for stack in stacks:
+                if stack in samples or len(samples) < PROFILE_MAX_STACKS:
+                    samples[stack] = samples.get(stack, 0) + 1
+
+    def begin(self, label):
+        """Mark this thread as running label; returns a token for end(), or None to skip"""
+        if not self.active:
+            return None
+        if self.mode == "cprofile":
+            if next(self._events) % self._every:
+                return None
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+            except ValueError:
+                # Another profiler owns this thread
+                return None
+            return label, profile
+        self._labels[threading.get_ident()] = label
+        return label, None
+
+    def end(self, token):
+        label, profile = token
+        if profile is None:
+            self._labels.pop(threading.get_ident(), None)
+            return
+        profile.disable()
+        with self._lock:
+            stats = self._profiles.get(label)
+            if stats is None:
+                self._profiles[label] = pstats.Stats(profile)
+            else:
+                stats.add(profile)
+            self._calls[label] = self._calls.get(label, 0) + 1
+
+    def stop(self):
+        """End the session and write its output; returns the session, or None if none was running"""
+        with self._lock:
+            if not self.active:
+                return None
+            self.active = False
+            session = self.session
+            # Late end() and _sample() calls land in the fresh dicts, not in what is being written
+            samples, profiles, calls = self._samples, self._profiles, self._calls
+            self._samples, self._profiles, self._calls = {}, {}, {}
+            stopped = self._stopped
+        stopped.set()
+        session["stopped"] = datetime.now().isoformat(timespec="seconds")
+        try:
+            session["files"] = self._write(session, samples, profiles, calls)
+            print(f"🔬 Profile {session['id']} written to {os.path.join(self.directory, session['id'])}")
+        except OSError as e:
+            session["error"] = str(e)
+            print(f"❌ Writing profile {session['id']} failed: {e}")
+        self.last = session
+        return session
+
+    def _write(self, session, samples, profiles, calls):
+        path = os.path.join(self.directory, session["id"])
+        os.makedirs(path, exist_ok=True)
+        files = []
+
+        if samples:
+            by_label = {}
+            for stack, count in samples.items():
+                by_label.setdefault(stack.split(";", 1)[0], []).append((stack, count))
+            session["samples"] = {label: sum(count for _, count in stacks) for label, stacks in by_label.items()}
+            groups = [("all", list(samples.items()))] + sorted(by_label.items())
+            for label, stacks in groups:
+                name = f"{_safe_name(label)}.folded"
+                with open(os.path.join(path, name), "w") as f:
+                    f.writelines(f"{stack} {count}\n" for stack, count in sorted(stacks))
+                files.append(name)
+
+        if profiles:
+            session["calls"] = dict(calls)
+            for label, stats in profiles.items():
+                name = f"{_safe_name(label)}.pstats"
+                stats.dump_stats(os.path.join(path, name))
+                files.append(name)
+                with open(os.path.join(path, f"{_safe_name(label)}.txt"), "w") as f:
+                    stats.stream = f
+                    stats.sort_stats("cumulative").print_stats(40)
+                files.append(f"{_safe_name(label)}.txt")
+
+        files.append("session.json")
+        with open(os.path.join(path, "session.json"), "w") as f:
+            json.dump({**session, "files": files}, f, indent=2)
+        return files
+
+    def status(self):
+        return {"active": self.active, "session": self.session if self.active else None, "last": self.last}
@@ -0,0 +1,224 @@
+"""
+Token-budgeted AI prompts with a rolling extractive summary per conversation
+"""
+
+import os
+import re
+import threading
+from collections import OrderedDict
+from context_window import AI_CONTEXT_MAX_CONVERSATIONS
+
+# Whole system prompt: persona, summary and recent turns
+AI_PROMPT_TOKEN_BUDGET = int(os.getenv('AI_PROMPT_TOKEN_BUDGET', 900))
+AI_SUMMARY_TOKEN_BUDGET = int(os.getenv('AI_SUMMARY_TOKEN_BUDGET', 160))
+# A pasted listing is cut down to this many tokens per turn
+AI_PROMPT_MAX_TURN_TOKENS = int(os.getenv('AI_PROMPT_MAX_TURN_TOKENS', 120))
+AI_PROMPT_MAX_INPUT_TOKENS = int(os.getenv('AI_PROMPT_MAX_INPUT_TOKENS', 300))
+AI_PROMPT_MAX_TURNS = int(os.getenv('AI_PROMPT_MAX_TURNS', 6))
+
+_TOKEN = re.compile(r"\w+|[^\w\s]")
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+|\n+")
+_DIGIT = re.compile(r"\d")
+_WHITESPACE = re.compile(r"\s+")
+
+# Sentences mentioning these carry the facts a seller needs to stay consistent
+SUMMARY_KEYWORDS = {
+    "price", "cost", "discount", "deal", "offer", "budget", "pay", "payment",
+    "ship", "shipping", "deliver", "delivery", "address", "order", "stock",
+    "available", "size", "color", "colour", "model", "warranty", "return",
+    "refund", "quantity", "condition", "new", "used", "want", "need", "prefer"
+}
+
+def _piece_tokens(piece):
+    # Common words are a single BPE token; longer ones split every ~6 characters
+    return 1 + (len(piece) - 1) // 6
+
+def estimate_tokens(text):
+    """Approximate BPE token count without a tokenizer"""
+    return sum(_piece_tokens(piece) for piece in _TOKEN.findall(text or ""))
+
+def truncate_tokens(text, limit):
+    """Cut text to roughly limit tokens, marking the cut"""
+    if estimate_tokens(text) <= limit:
+        return text
+    count = 0
+    for match in _TOKEN.finditer(text):
+        count += _piece_tokens(match.group())
+        if count > limit:
+            return text[:match.start()].rstrip() + " …"
+    return text
+
+def split_sentences(text):
+    return [s.strip() for s in _SENTENCE_END.split(text or "") if s.strip()]
+
+def score_sentence(sentence):
+    """Cheap salience score: numbers, questions and commerce keywords rank highest"""
+    words = {w.lower() for w in re.findall(r"[A-Za-z]+", sentence)}
+    score = 1.0
+    if _DIGIT.search(sentence):
+        score += 2.0
+    if "$" in sentence or "€" in sentence or "£" in sentence:
+        score += 1.0
+    if sentence.endswith("?"):
+        score += 1.0
+    score += 1.5 * len(words & SUMMARY_KEYWORDS)
+    # Greetings and acknowledgements ("ok", "thanks!") carry no context
+    if len(words) <= 2:
+        score -= 1.5
+    return score
+
+class RollingSummary:
+    """Extractive summary of the messages that have scrolled out of the prompt"""
+
+    def __init__(self, budget=AI_SUMMARY_TOKEN_BUDGET):
+        self.budget = budget
+        # [order, line, tokens, score]
+        self.sentences = []
+        self.seen = set()
+        self.last_id = 0
+        self._order = 0
+
+    def absorb(self, messages):
+        """Fold messages newer than the last absorbed one into the summary"""
+        changed = False
+        for msg in messages:
+            message_id = msg.get("id") or 0
+            if message_id and message_id <= self.last_id:
+                continue
+            for sentence in split_sentences(msg["message"]):
+                key = _WHITESPACE.sub(" ", sentence.lower())
+                if key in self.seen:
+                    continue
+                self.seen.add(key)
+                line = f"{msg['sender']}: {truncate_tokens(sentence, 40)}"
+                self.sentences.append([self._order, line, estimate_tokens(line), score_sentence(sentence)])
+                self._order += 1
+                changed = True
+            self.last_id = max(self.last_id, message_id)
+        if changed:
+            self._trim()
+
+    def _trim(self):
+        """Drop the least salient (then oldest) sentences until within budget"""
+        total = sum(s[2] for s in self.sentences)
+        if total <= self.budget:
+            return
+        # Newer sentences win ties, so facts that were revised stay current
+        ranked = sorted(self.sentences, key=lambda s: (s[3], s[0]))
+        dropped = set()
+        for sentence in ranked:
+            if total <= self.budget:
+                break
+            dropped.add(sentence[0])
+            total -= sentence[2]
+        self.sentences = [s for s in self.sentences if s[0] not in dropped]
+        # Keep the dedupe set from growing with the conversation
+        if len(self.seen) > 4 * len(self.sentences) + 64:
+            self.seen = {_WHITESPACE.sub(" ", s[1].split(": ", 1)[-1].lower()) for s in self.sentences}
+
+    def render(self, limit=None):
+        """Summary lines in conversation order, within limit tokens"""
+        lines = []
+        used = 0
+        for _, line, tokens, _ in self.sentences:
+            if limit is not None and used + tokens > limit:
+                break
+            lines.append(line)
+            used += tokens
+        return "\n".join(lines)
+
+class PromptBuilder:
+    """Fits persona, rolling summary and recent turns into a token budget"""
+
+    def __init__(self, budget=AI_PROMPT_TOKEN_BUDGET, summary_budget=AI_SUMMARY_TOKEN_BUDGET,
+                 max_turn_tokens=AI_PROMPT_MAX_TURN_TOKENS, max_input_tokens=AI_PROMPT_MAX_INPUT_TOKENS,
+                 max_turns=AI_PROMPT_MAX_TURNS, max_conversations=AI_CONTEXT_MAX_CONVERSATIONS):
+        self.budget = budget
+        self.summary_budget = summary_budget
+        self.max_turn_tokens = max_turn_tokens
+        self.max_input_tokens = max_input_tokens
+        self.max_turns = max_turns
+        self.max_conversations = max_conversations
+        self._summaries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def summary(self, buyer_username, seller_username):
+        key = (buyer_username, seller_username)
+        with self._lock:
+            summary = self._summaries.get(key)
+            if summary is None:
+                summary = self._summaries[key] = RollingSummary(self.summary_budget)
+                if len(self._summaries) > self.max_conversations:
+                    self._summaries.popitem(last=False)
+            else:
+                self._summaries.move_to_end(key)
+            return summary
+
+    def persona(self, seller_info, buyer_username):
+        return f"""{seller_info['personality']}
+
+Your name is {seller_info['name']}. You are chatting with {buyer_username or 'a customer'}.
+Respond naturally as {seller_info['name']}, maintaining your personality style ({seller_info['style']}).
+Be helpful and address the customer's needs while staying in character."""
+
+    def build(self, seller_info, buyer_username, seller_username, history, message, knowledge=None):
+        """Return (chat messages, stats) for the upstream call"""
+        user_message = truncate_tokens(message, self.max_input_tokens)
+        persona = self.persona(seller_info, buyer_username)
+        # Seller FAQ entries related to the question, placed right after the persona
+        if knowledge:
+            facts = "\n".join(f"- {entry['question']} {truncate_tokens(entry['answer'], self.max_turn_tokens)}"
+                              for entry in knowledge)
+            persona += f"\n\nStore information you can rely on:\n{facts}"
+
+        # The buyer's current message(s) are already the tail of the window
+        history = list(history)
+        while history and history[-1]["sender"] == buyer_username and history[-1]["message"] in message:
+            history.pop()
+
+        remaining = self.budget - estimate_tokens(persona) - estimate_tokens(user_message)
+        summary_room = max(0, min(self.summary_budget, remaining // 3))
+        remaining -= summary_room
+
+        turns = []
+        for msg in reversed(history):
+            if len(turns) >= self.max_turns:
+                break
+            line = f"{msg['sender']}: {truncate_tokens(msg['message'], self.max_turn_tokens)}"
+            tokens = estimate_tokens(line)
+            if tokens > remaining:
+                break
+            turns.append(line)
+            remaining -= tokens
+        turns.reverse()
+
+        # Everything older than the verbatim turns lives on only in the summary
+        summary_text = ""
+        if buyer_username:
+            summary = self.summary(buyer_username, seller_username)
+            with self._lock:
+                summary.absorb(history[:len(history) - len(turns)])
+                summary_text = summary.render(summary_room + max(0, remaining))
+
+        system_prompt = persona
+        if summary_text:
+            system_prompt += f"\n\nEarlier in this conversation:\n{summary_text}"
+        if turns:
+            system_prompt += "\n\nRecent conversation history:\n" + "\n".join(turns)
+
+        stats = {
+            "prompt_tokens": estimate_tokens(system_prompt) + estimate_tokens(user_message),
+            "summary_tokens": estimate_tokens(summary_text),
+            "turns": len(turns)
+        }
+        return [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_message}
+        ], stats
+
+    def forget(self, buyer_username, seller_username):
+        with self._lock:
+            self._summaries.pop((buyer_username, seller_username), None)
+
+    def __len__(self):
+        return len(self._summaries)
@@ -0,0 +1,215 @@
+"""
+Query instrumentation: per-statement fingerprints and timings, slow-query log and query budgets
+"""
+
+import os
+import re
+import sys
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+import psycopg2
+import psycopg2.extensions
+import metrics
+
+# Statements at least this slow are logged; 0 turns the slow-query log off
+SLOW_QUERY_MS = float(os.getenv('SLOW_QUERY_MS', 200))
+# Also capture the plan of slow statements (one extra EXPLAIN round trip each)
+SLOW_QUERY_EXPLAIN = os.getenv('SLOW_QUERY_EXPLAIN', 'false').lower() == 'true'
+SLOW_QUERY_LOG_SIZE = int(os.getenv('SLOW_QUERY_LOG_SIZE', 100))
+# Distinct fingerprints aggregated; further ones are only counted
+QUERY_FINGERPRINTS_MAX = int(os.getenv('QUERY_FINGERPRINTS_MAX', 1000))
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_PLACEHOLDER = re.compile(r"%s|%\(\w+\)s|\$\d+")
+_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_SPACE = re.compile(r"\s+")
+_EXPLAINABLE = (b"SELECT", b"WITH", b"INSERT", b"UPDATE", b"DELETE", b"EXECUTE", b"VALUES")
+
+# Frames of query helpers are skipped when attributing a statement to its caller
+_helpers = set()
+
+def fingerprint(sql):
+    """Statement shape with literals and placeholders replaced by ?, e.g. for grouping"""
+    if isinstance(sql, bytes):
+        sql = sql.decode("utf-8", "replace")
+    sql = _STRING.sub("?", sql)
+    sql = _PLACEHOLDER.sub("?", sql)
+    sql = _NUMBER.sub("?", sql)
+    sql = _SPACE.sub(" ", sql).strip()
+    return _LIST.sub("(...)", sql)
+
+def helper(func):
+    """Mark a function that runs queries on behalf of its caller"""
+    _helpers.add(func.__code__)
+    return func
+
+def _caller(depth=2):
+    """'database.py:save_message <- app.py:store_message' for the code that issued a query"""
+    frame = sys._getframe(depth)
+    names = []
+    while frame is not None and len(names) < 2:
+        code = frame.f_code
+        if code.co_filename != __file__ and code not in _helpers:
+            names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+        frame = frame.f_back
+    return " <- ".join(names)
+
+class Capture:
+    """Queries and connections seen by one thread inside QueryLog.capture()"""
+
+    def __init__(self):
+        self.queries = []
+        self.connections = 0
+
+    def __len__(self):
+        return len(self.queries)
+
+    def report(self):
+        counts = {}
+        for query in self.queries:
+            key = (query["caller"], query["fingerprint"])
+            counts[key] = counts.get(key, 0) + 1
+        return "\n".join(f"  {count}x {caller}: {fp[:160]}" for (caller, fp), count in counts.items())
+
+class QueryLog:
+    """
+    Aggregates every recorded statement by fingerprint and keeps the slowest ones
+    (with their plan when explain is on). capture() additionally hands the
+    current thread's queries to the caller, which is what query budgets use.
+    """
+
+    def __init__(self, slow_ms=SLOW_QUERY_MS, explain=SLOW_QUERY_EXPLAIN, slow_log_size=SLOW_QUERY_LOG_SIZE,
+                 max_fingerprints=QUERY_FINGERPRINTS_MAX):
+        self.slow_ms = slow_ms
+        self.explain = explain
+        self.max_fingerprints = max_fingerprints
+        self.slow = deque(maxlen=slow_log_size)
+        self._stats = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _scopes(self):
+        scopes = getattr(self._local, "scopes", None)
+        if scopes is None:
+            scopes = self._local.scopes = []
+        return scopes
+
+    @contextmanager
+    def capture(self):
+        scope = Capture()
+        scopes = self._scopes()
+        scopes.append(scope)
+        try:
+            yield scope
+        finally:
+            scopes.remove(scope)
+
+    def connection_acquired(self):
+        for scope in self._scopes():
+            scope.connections += 1
+
+    def record(self, sql, seconds, rows, caller, explain=None):
+        """Record one executed statement; explain() returns its plan if it turns out slow"""
+        ms = seconds * 1000
+        entry = {"fingerprint": fingerprint(sql), "ms": round(ms, 3), "rows": rows, "caller": caller}
+        for scope in self._scopes():
+            scope.queries.append(entry)
+
+        with self._lock:
+            stats = self._stats.get(entry["fingerprint"])
+            if stats is None and len(self._stats) < self.max_fingerprints:
+                stats = self._stats[entry["fingerprint"]] = {"count": 0, "total_ms": 0.0, "max_ms": 0.0,
+                                                            "rows": 0, "caller": caller}
+            if stats is not None:
+                stats["count"] += 1
+                stats["total_ms"] += ms
+                stats["max_ms"] = max(stats["max_ms"], ms)
+                stats["rows"] += max(rows or 0, 0)
+        metrics.increment("db_queries")
+
+        if self.slow_ms and ms >= self.slow_ms:
+            if self.explain and explain is not None:
+                entry["plan"] = explain()
+            self.slow.append(entry)
+            metrics.increment("db_slow_queries")
+            print(f"🐢 Slow query {ms:.0f}ms from {caller}: {entry['fingerprint'][:200]}")
+        return entry
+
+    def stats(self, top=10):
+        """Fingerprints with the most total time, plus the latest slow queries"""
+        with self._lock:
+            ranked = sorted(self._stats.items(), key=lambda item: item[1]["total_ms"], reverse=True)[:top]
+            return {
+                "fingerprints": len(self._stats),
+                "top": [{"fingerprint": fp, **stats, "total_ms": round(stats["total_ms"], 2),
+                         "max_ms": round(stats["max_ms"], 2)} for fp, stats in ranked],
+                "slow": list(self.slow)[-top:]
+            }
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+            self.slow.clear()
+
+queries = QueryLog()
+metrics.register_gauge("queries", queries.stats)
+
+class InstrumentedCursor(psycopg2.extensions.cursor):
+    """Cursor that reports every statement to query_log.queries"""
+
+    def execute(self, query, vars=None):
+        start = time.perf_counter()
+        ok = False
+        try:
+            result = super().execute(query, vars)
+            ok = True
+            return result
+        finally:
+            queries.record(self._text(query), time.perf_counter() - start, self.rowcount if ok else None,
+                           _caller(), self._explain if ok else None)
+
+    def executemany(self, query, vars_list):
+        start = time.perf_counter()
+        try:
+            return super().executemany(query, vars_list)
+        finally:
+            queries.record(self._text(query), time.perf_counter() - start, self.rowcount, _caller())
+
+    def _text(self, query):
+        return query if isinstance(query, (str, bytes)) else query.as_string(self)
+
+    def _explain(self):
+        """Plan of the statement just run, without disturbing the caller's transaction"""
+        statement = self.query or b""
+        if not statement.lstrip().upper().startswith(_EXPLAINABLE):
+            return None
+        cur = psycopg2.extensions.cursor(self.connection)
+        in_transaction = not self.connection.autocommit
+        try:
+            if in_transaction:
+                cur.execute("SAVEPOINT query_log_explain")
+            cur.execute(b"EXPLAIN " + statement)
+            plan = "\n".join(row[0] for row in cur.fetchall())
+            if in_transaction:
+                cur.execute("RELEASE SAVEPOINT query_log_explain")
+            return plan
+        except psycopg2.Error as e:
+            if in_transaction:
+                cur.execute("ROLLBACK TO SAVEPOINT query_log_explain")
+            return f"EXPLAIN failed: {e}"
+        finally:
+            cur.close()
+
+@contextmanager
+def assert_max_queries(max_queries, max_connections=None, log=None):
+    """Fail if the block runs more than max_queries statements (or opens more than max_connections)"""
+    with (log or queries).capture() as scope:
+        yield scope
+    if len(scope) > max_queries:
+        raise AssertionError(f"{len(scope)} queries, expected at most {max_queries}:\n{scope.report()}")
+    if max_connections is not None and scope.connections > max_connections:
+        raise AssertionError(f"{scope.connections} connections, expected at most {max_connections}:\n"
+                             f"{scope.report()}")
@@ -0,0 +1,79 @@
+"""
+Token-bucket rate limiting primitives
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+class TokenBucket:
+    """Refills at rate tokens/sec up to capacity"""
+
+    def __init__(self, rate, capacity):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self, tokens=1):
+        """Take tokens if available; returns (allowed, retry_after_seconds)"""
+        with self._lock:
+            self._refill(time.monotonic())
+            if self.tokens >= tokens:
+                self.tokens -= tokens
+                return True, 0.0
+            if self.rate <= 0:
+                return False, float('inf')
+            return False, (tokens - self.tokens) / self.rate
+
+    def refund(self, tokens=1):
+        """Give back tokens taken for work that was not done after all"""
+        with self._lock:
+            self._refill(time.monotonic())
+            self.tokens = min(self.capacity, self.tokens + tokens)
+
+    def available(self):
+        with self._lock:
+            self._refill(time.monotonic())
+            return self.tokens
+
+class KeyedTokenBuckets:
+    """One TokenBucket per key, keeping at most max_keys recently used buckets"""
+
+    def __init__(self, rate, capacity, max_keys=10000):
+        self.rate = rate
+        self.capacity = capacity
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def bucket(self, key):
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = TokenBucket(self.rate, self.capacity)
+                self._buckets[key] = bucket
+                if len(self._buckets) > self.max_keys:
+                    # An evicted bucket restarts full, which only ever errs on the permissive side
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+            return bucket
+
+    def try_acquire(self, key, tokens=1):
+        return self.bucket(key).try_acquire(tokens)
+
+    def refund(self, key, tokens=1):
+        self.bucket(key).refund(tokens)
+
+    def discard(self, key):
+        with self._lock:
+            self._buckets.pop(key, None)
+
+    def __len__(self):
+        return len(self._buckets)
@@ -0,0 +1,156 @@
+"""
+Read/write routing between the primary and streaming replicas
+"""
+
+import itertools
+import os
+import threading
+import time
+import psycopg2
+import metrics
+
+# Comma-separated host[:port] list; empty sends every read to the primary
+DB_REPLICA_HOSTS = os.getenv('DB_REPLICA_HOSTS', '')
+DB_REPLICA_POOL_SIZE = int(os.getenv('DB_REPLICA_POOL_SIZE', 10))
+# After writing, a user's reads stay on the primary this long so they see their own writes
+READ_YOUR_WRITES_SECONDS = float(os.getenv('READ_YOUR_WRITES_SECONDS', 5))
+REPLICA_CHECK_SECONDS = float(os.getenv('REPLICA_CHECK_SECONDS', 5))
+# Replicas replaying further behind than this are skipped until they catch up
+REPLICA_MAX_LAG_SECONDS = float(os.getenv('REPLICA_MAX_LAG_SECONDS', 2))
+# Seconds to wait for a replica connection (libpq connect_timeout, at least 2)
+REPLICA_CONNECT_TIMEOUT = int(os.getenv('REPLICA_CONNECT_TIMEOUT', 2))
+RECENT_WRITERS_MAX = 100000
+
+# A replica that has replayed everything it received is not lagging, however old
+# its last replayed transaction is (an idle primary sends nothing new)
+REPLICA_LAG_SQL = """
+    SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+                ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END
+"""
+
+def parse_hosts(spec):
+    """'db-r1,db-r2:5433' -> [('db-r1', None), ('db-r2', 5433)]"""
+    hosts = []
+    for entry in spec.split(","):
+        entry = entry.strip()
+        if not entry:
+            continue
+        host, _, port = entry.partition(":")
+        hosts.append((host, int(port) if port else None))
+    return hosts
+
+def replica_lag(pool):
+    """Seconds the replica's replay is behind the WAL it has received"""
+    conn = pool.acquire()
+    try:
+        cur = conn.cursor()
+        cur.execute(REPLICA_LAG_SQL)
+        lag = cur.fetchone()[0]
+        cur.close()
+    finally:
+        conn.close()
+    return float(lag or 0)
+
+class ReadRouter:
+    """
+    Writes always use the primary. Reads round-robin over replicas that passed
+    their last lag check, except for users who wrote within the read-your-writes
+    window, whose reads go to the primary. With no healthy replica, reads fall
+    back to the primary. Recent writers are tracked per process, so this relies
+    on a user's requests reaching the same node (sticky sessions).
+
+    Lag checks run on a background thread started by the first read; readers
+    only look at the last verdict, so a hanging replica never stalls a request.
+    Until its first check passes, a replica is not read from.
+    """
+
+    def __init__(self, primary, replicas=(), window=READ_YOUR_WRITES_SECONDS, check=replica_lag,
+                 check_interval=REPLICA_CHECK_SECONDS, max_lag=REPLICA_MAX_LAG_SECONDS):
+        self.primary = primary
+        self.replicas = list(replicas)
+        self.window = window
+        self.check = check
+        self.check_interval = check_interval
+        self.max_lag = max_lag
+        self._cycle = itertools.count()
+        self._writes = {}
+        self._health = [{"healthy": False, "lag": None} for _ in self.replicas]
+        self._last_check = float("-inf")
+        self._checker = None
+        self._lock = threading.Lock()
+
+    def note_write(self, *usernames):
+        deadline = time.monotonic() + self.window
+        with self._lock:
+            if len(self._writes) >= RECENT_WRITERS_MAX:
+                now = time.monotonic()
+                self._writes = {name: until for name, until in self._writes.items() if until > now}
+            for username in usernames:
+                if username:
+                    self._writes[username] = deadline
+
+    def wrote_recently(self, usernames):
+        now = time.monotonic()
+        return any(self._writes.get(username, 0) > now for username in usernames)
+
+    def check_replicas(self):
+        """Check every replica's lag once and record the verdicts"""
+        self._last_check = time.monotonic()
+        for index, replica in enumerate(self.replicas):
+            try:
+                lag = self.check(replica)
+                healthy = lag <= self.max_lag
+            except Exception as e:
+                print(f"⚠️ Replica {index} failed its health check: {e}")
+                lag, healthy = None, False
+            with self._lock:
+                self._health[index].update(healthy=healthy, lag=lag)
+            if not healthy:
+                metrics.increment("db_replica_unhealthy")
+
+    def _check_loop(self):
+        while True:
+            time.sleep(max(0.0, self._last_check + self.check_interval - time.monotonic()))
+            if time.monotonic() - self._last_check >= self.check_interval:
+                self.check_replicas()
+
+    def _start_checker(self):
+        with self._lock:
+            if self._checker is None:
+                self._checker = threading.Thread(target=self._check_loop, name="replica-checks", daemon=True)
+                self._checker.start()
+
+    def reader(self, usernames=()):
+        """Pool to read from for a query concerning usernames"""
+        if not self.replicas or self.wrote_recently(usernames):
+            return self.primary
+        if self._checker is None:
+            self._start_checker()
+        start = next(self._cycle)
+        for offset in range(len(self.replicas)):
+            index = (start + offset) % len(self.replicas)
+            if self._health[index]["healthy"]:
+                return self.replicas[index]
+        return self.primary
+
+    def acquire_read(self, *usernames):
+        pool = self.reader(usernames)
+        if pool is not self.primary:
+            try:
+                conn = pool.acquire()
+                metrics.increment("db_reads_replica")
+                return conn
+            except psycopg2.OperationalError as e:
+                # Down until its next check passes
+                index = self.replicas.index(pool)
+                print(f"⚠️ Replica {index} unavailable, reading from primary: {e}")
+                with self._lock:
+                    self._health[index]["healthy"] = False
+        metrics.increment("db_reads_primary")
+        return self.primary.acquire()
+
+    def stats(self):
+        return {
+            "replicas": [{"healthy": state["healthy"], "lag": state["lag"]} for state in self._health],
+            "recent_writers": len(self._writes)
+        }
@@ -0,0 +1,117 @@
+"""
+Debounces rapid buyer messages per conversation into a single AI reply
+"""
+
+import os
+import threading
+import time
+import metrics
+
+AI_DEBOUNCE_SECONDS = float(os.getenv('AI_DEBOUNCE_SECONDS', 1.5))
+# Upper bound on how long a buyer who keeps typing waits for a reply
+AI_DEBOUNCE_MAX_WAIT = float(os.getenv('AI_DEBOUNCE_MAX_WAIT', 6))
+
+class PendingReply:
+    """Buyer messages not yet answered in one conversation"""
+
+    def __init__(self):
+        self.messages = []      # (arrived, text), oldest first
+        self.generation = 0
+        self.timer = None
+        self.running = False    # a generation for this conversation is in flight
+
+class ReplyScheduler:
+    """
+    Collects buyer messages per (buyer, seller) for a debounce window, then asks
+    for one reply covering all of them. A conversation has at most one generation
+    in flight. A buyer message arriving meanwhile supersedes it (its reply is
+    dropped and the next one covers every unanswered message), unless the oldest
+    message in the batch has already waited max_wait: then the reply is delivered
+    and the newer messages get a batch of their own.
+    """
+
+    def __init__(self, generate, deliver, debounce=AI_DEBOUNCE_SECONDS, max_wait=AI_DEBOUNCE_MAX_WAIT):
+        # generate(message, seller_username, buyer_username) -> reply text
+        self.generate = generate
+        # deliver(buyer_username, seller_username, reply) encrypts, saves and emits
+        self.deliver = deliver
+        self.debounce = debounce
+        self.max_wait = max_wait
+        self._pending = {}
+        self._in_flight = 0
+        self._lock = threading.Lock()
+
+    def submit(self, buyer_username, seller_username, message):
+        """Queue a buyer message and (re)start the conversation's debounce timer"""
+        key = (buyer_username, seller_username)
+        with self._lock:
+            pending = self._pending.get(key)
+            if pending is None:
+                pending = self._pending[key] = PendingReply()
+            pending.messages.append((time.monotonic(), message))
+            pending.generation += 1
+            if pending.timer is not None:
+                pending.timer.cancel()
+                pending.timer = None
+                metrics.increment("ai_messages_coalesced")
+            if not pending.running:
+                # Otherwise the running generation schedules the next batch when it ends
+                self._schedule(key, pending)
+
+    def _schedule(self, key, pending):
+        """Start the timer for the unanswered messages; caller holds the lock"""
+        now = time.monotonic()
+        quiet = pending.messages[-1][0] + self.debounce - now
+        # The wait is counted from the oldest unanswered message, so it restarts per batch
+        remaining = pending.messages[0][0] + self.max_wait - now
+        delay = max(0.0, min(quiet, remaining))
+        pending.timer = threading.Timer(delay, self._fire, args=(key, pending.generation))
+        pending.timer.daemon = True
+        pending.timer.start()
+
+    def _fire(self, key, generation):
+        buyer_username, seller_username = key
+        with self._lock:
+            pending = self._pending.get(key)
+            if pending is None or pending.generation != generation or pending.running:
+                return
+            pending.timer = None
+            pending.running = True
+            batch = list(pending.messages)
+            self._in_flight += 1
+
+        try:
+            reply = self.generate("\n".join(text for _, text in batch), seller_username, buyer_username)
+        except Exception as e:
+            print(f"❌ AI generation error for {buyer_username} -> {seller_username}: {e}")
+            reply = None
+
+        with self._lock:
+            self._in_flight -= 1
+            pending.running = False
+            newer = len(pending.messages) > len(batch)
+            overdue = time.monotonic() >= batch[0][0] + self.max_wait
+            if newer and not overdue:
+                # The next reply covers this batch too
+                self._schedule(key, pending)
+                metrics.increment("ai_replies_superseded")
+                print(f"⏭️ AI reply for {buyer_username} -> {seller_username} superseded")
+                return
+            del pending.messages[:len(batch)]
+            if pending.messages:
+                self._schedule(key, pending)
+            else:
+                del self._pending[key]
+
+        metrics.increment("ai_reply_batches")
+        self.deliver(buyer_username, seller_username, reply)
+
+    def queue_depth(self):
+        """Number of conversations waiting on a reply (in flight ones included), for load shedding"""
+        with self._lock:
+            return len(self._pending)
+
+    def depth(self):
+        """Conversations waiting on a reply, including generations in flight"""
+        with self._lock:
+            return {"pending_conversations": len(self._pending), "in_flight": self._in_flight}
@@ -0,0 +1,138 @@
+"""
+Cache of AI seller replies keyed on seller persona and normalized buyer question
+"""
+
+import hashlib
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+import metrics
+
+AI_CACHE_ENABLED = os.getenv('AI_CACHE_ENABLED', 'True') == 'True'
+AI_CACHE_TTL_SECONDS = float(os.getenv('AI_CACHE_TTL_SECONDS', 3600))
+AI_CACHE_MAX_ENTRIES = int(os.getenv('AI_CACHE_MAX_ENTRIES', 2000))
+AI_CACHE_MAX_BYTES = int(os.getenv('AI_CACHE_MAX_BYTES', 2 * 1024 * 1024))
+# Longer questions rarely repeat and would only churn the cache
+AI_CACHE_MAX_QUESTION_CHARS = int(os.getenv('AI_CACHE_MAX_QUESTION_CHARS', 200))
+# Include a fingerprint of the last N context messages in the key (0 = question only)
+AI_CACHE_CONTEXT_MESSAGES = int(os.getenv('AI_CACHE_CONTEXT_MESSAGES', 0))
+# Comma-separated sellers whose replies are never cached
+AI_CACHE_OPT_OUT = {s.strip() for s in os.getenv('AI_CACHE_OPT_OUT', '').split(',') if s.strip()}
+
+# Replies address buyers by name; the name is swapped for this placeholder
+# when stored and filled back in for whoever gets the cached reply
+BUYER_PLACEHOLDER = "\u2063buyer\u2063"
+
+def _name_pattern(name):
+    """The name as a whole word only, so buyer1 neither matches inside buyer10 nor al inside total"""
+    return re.compile(rf"(?<!\w){re.escape(name)}(?!\w)")
+
+_PUNCTUATION = re.compile(r"[^\w\s]")
+_WHITESPACE = re.compile(r"\s+")
+
+def normalize_question(text):
+    """Lowercase, drop punctuation and collapse whitespace"""
+    text = _PUNCTUATION.sub(" ", text.lower())
+    return _WHITESPACE.sub(" ", text).strip()
+
+def context_fingerprint(history, messages=AI_CACHE_CONTEXT_MESSAGES):
+    """Short hash of the last few context messages, or "" when disabled"""
+    if messages <= 0 or not history:
+        return ""
+    digest = hashlib.sha1()
+    for msg in history[-messages:]:
+        digest.update(normalize_question(msg["message"]).encode())
+        digest.update(b"\x00")
+    return digest.hexdigest()[:12]
+
+class ResponseCache:
+    """TTL + LRU cache with an entry count and byte budget"""
+
+    def __init__(self, ttl=AI_CACHE_TTL_SECONDS, max_entries=AI_CACHE_MAX_ENTRIES,
+                 max_bytes=AI_CACHE_MAX_BYTES, opt_out=AI_CACHE_OPT_OUT, enabled=AI_CACHE_ENABLED):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.opt_out = set(opt_out)
+        self.enabled = enabled
+        # key -> (expires_at, reply_template, upstream_latency, size)
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def key(self, seller_username, question, fingerprint=""):
+        normalized = normalize_question(question)
+        if not normalized or len(normalized) > AI_CACHE_MAX_QUESTION_CHARS:
+            return None
+        return (seller_username, normalized, fingerprint)
+
+    def cacheable(self, seller_username):
+        return self.enabled and seller_username not in self.opt_out
+
+    def get(self, seller_username, question, buyer_username=None, fingerprint=""):
+        """Return a cached reply personalized for buyer_username, or None"""
+        if not self.cacheable(seller_username):
+            return None
+        key = self.key(seller_username, question, fingerprint)
+        if key is None:
+            return None
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] < time.monotonic():
+                self._remove(key)
+                entry = None
+            if entry is None:
+                metrics.increment("ai_cache_misses")
+                return None
+            self._entries.move_to_end(key)
+
+        _, template, latency, _ = entry
+        metrics.increment("ai_cache_hits")
+        metrics.increment("ai_cache_latency_saved_ms", int(latency * 1000))
+        return template.replace(BUYER_PLACEHOLDER, buyer_username or "there")
+
+    def put(self, seller_username, question, reply, upstream_latency, buyer_username=None, fingerprint=""):
+        """Store an upstream reply along with how long it took to produce"""
+        if not self.cacheable(seller_username):
+            return
+        key = self.key(seller_username, question, fingerprint)
+        if key is None:
+            return
+
+        template = _name_pattern(buyer_username).sub(BUYER_PLACEHOLDER, reply) if buyer_username else reply
+        size = len(template.encode()) + len(key[1])
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.monotonic() + self.ttl, template, upstream_latency, size)
+            self._bytes += size
+            while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+                self._remove(next(iter(self._entries)))
+                metrics.increment("ai_cache_evictions")
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        self._bytes -= entry[3]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        hits = metrics.get_counter("ai_cache_hits")
+        misses = metrics.get_counter("ai_cache_misses")
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "hit_rate": round(hits / (hits + misses), 4) if hits + misses else 0.0
+        }
+
+response_cache = ResponseCache()
+metrics.register_gauge("ai_cache", response_cache.stats)
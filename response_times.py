@@ -0,0 +1,123 @@
+"""
+Per-seller response-time tracking: pairs buyer messages with the next seller reply
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+import metrics
+from sketches import DDSketch
+
+RESPONSE_SKETCH_FLUSH_SECONDS = float(os.getenv('RESPONSE_SKETCH_FLUSH_SECONDS', 60))
+# Conversations waiting for a seller reply that are tracked in memory
+RESPONSE_PENDING_MAX = int(os.getenv('RESPONSE_PENDING_MAX', 100000))
+ANALYTICS_MAX_DAYS = int(os.getenv('ANALYTICS_MAX_DAYS', 365))
+
+KINDS = ("human", "ai")
+
+def utc_day(timestamp):
+    return datetime.fromtimestamp(timestamp, timezone.utc).date()
+
+class ResponseTimeTracker:
+    """
+    A buyer message starts the clock unless the buyer is already waiting; the
+    seller's next reply (human or AI) stops it. Latencies go into a DDSketch per
+    (seller, day, kind) that is periodically merged into the stored sketches.
+    Pairing is per node: a reply handled on another node than the buyer's
+    message is not counted.
+    """
+
+    def __init__(self, store, load, flush_interval=RESPONSE_SKETCH_FLUSH_SECONDS, max_pending=RESPONSE_PENDING_MAX):
+        self.store = store
+        self.load = load
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self._pending = OrderedDict()
+        self._deltas = {}
+        self._lock = threading.Lock()
+        self._flusher = None
+
+    def buyer_message(self, buyer_username, seller_username, at=None):
+        key = (buyer_username, seller_username)
+        with self._lock:
+            if key in self._pending:
+                return
+            self._pending[key] = at if at is not None else time.time()
+            while len(self._pending) > self.max_pending:
+                self._pending.popitem(last=False)
+
+    def seller_reply(self, buyer_username, seller_username, is_ai=False, at=None):
+        """Record the reply's latency; returns it in seconds, or None if nobody was waiting"""
+        at = at if at is not None else time.time()
+        kind = "ai" if is_ai else "human"
+        with self._lock:
+            started = self._pending.pop((buyer_username, seller_username), None)
+            if started is None:
+                return None
+            latency = max(0.0, at - started)
+            key = (seller_username, utc_day(at), kind)
+            sketch = self._deltas.get(key)
+            if sketch is None:
+                sketch = self._deltas[key] = DDSketch()
+            sketch.add(latency)
+        metrics.increment(f"response_times_{kind}")
+        self._ensure_flusher()
+        return latency
+
+    def _ensure_flusher(self):
+        if self._flusher is not None or self.flush_interval <= 0:
+            return
+        with self._lock:
+            if self._flusher is None:
+                self._flusher = threading.Thread(target=self._flush_loop, name="response-sketches", daemon=True)
+                self._flusher.start()
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+    def flush(self):
+        """Merge this node's deltas into the stored sketches; kept for the next try on failure"""
+        with self._lock:
+            deltas, self._deltas = self._deltas, {}
+        if not deltas:
+            return 0
+        try:
+            self.store(deltas)
+            return len(deltas)
+        except Exception as e:
+            print(f"⚠️ Response time flush failed: {e}")
+            with self._lock:
+                for key, sketch in deltas.items():
+                    current = self._deltas.get(key)
+                    self._deltas[key] = sketch.merge(current) if current is not None else sketch
+            return 0
+
+    def report(self, seller_username, days=30):
+        """Response-time percentiles over the last days days, stored and unflushed combined"""
+        days = max(1, min(days, ANALYTICS_MAX_DAYS))
+        since = utc_day(time.time()) - timedelta(days=days - 1)
+        rows = list(self.load(seller_username, since))
+        with self._lock:
+            rows += [(day, kind, DDSketch().merge(sketch)) for (seller, day, kind), sketch in self._deltas.items()
+                     if seller == seller_username and day >= since]
+
+        by_kind = {kind: DDSketch() for kind in KINDS}
+        by_day = {}
+        for day, kind, sketch in rows:
+            by_kind[kind].merge(sketch)
+            by_day.setdefault(day, DDSketch()).merge(sketch)
+        overall = DDSketch()
+        for sketch in by_kind.values():
+            overall.merge(sketch)
+
+        return {
+            "seller": seller_username,
+            "days": days,
+            "since": since.isoformat(),
+            "response_seconds": {"all": overall.summary(), **{kind: by_kind[kind].summary() for kind in KINDS}},
+            "daily": [{"day": day.isoformat(), **by_day[day].summary()} for day in sorted(by_day)]
+        }
@@ -2,7 +2,10 @@
 -- Run as postgres user or with proper privileges
 
 -- Drop existing tables if they exist
+DROP TABLE IF EXISTS response_time_sketches CASCADE;
+DROP TABLE IF EXISTS message_receipts CASCADE;
 DROP TABLE IF EXISTS messages CASCADE;
+DROP TABLE IF EXISTS attachments CASCADE;
 DROP TABLE IF EXISTS conversations CASCADE;
 DROP TABLE IF EXISTS users CASCADE;
 
@@ -21,24 +24,98 @@ CREATE TABLE conversations (
     buyer_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
     seller_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    -- Maintained on every insert so the inbox never scans messages
+    last_message_id INTEGER,
+    last_message_at TIMESTAMP,
+    buyer_unread INTEGER NOT NULL DEFAULT 0,
+    seller_unread INTEGER NOT NULL DEFAULT 0,
     UNIQUE(buyer_id, seller_id)
 );
 
--- Messages table with encryption and proper foreign keys
-CREATE TABLE messages (
+-- Uploaded files; the encrypted content lives on disk under its keyed content
+-- address (see attachments.py), so several rows may share one stored file
+CREATE TABLE attachments (
     id SERIAL PRIMARY KEY,
+    uploader_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    address CHAR(64) NOT NULL,
+    size BIGINT NOT NULL,
+    content_type VARCHAR(100) NOT NULL,
+    filename VARCHAR(255),
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Messages table with encryption and proper foreign keys, partitioned by month
+-- ciphertext holds raw binary ciphertext (see encryption.py);
+-- encrypted_content only holds legacy base64 tokens until they are converted
+CREATE TABLE messages (
+    id SERIAL,
     conversation_id INTEGER REFERENCES conversations(id) ON DELETE CASCADE,
     sender_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
     receiver_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
-    encrypted_content TEXT NOT NULL,
-    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    ciphertext BYTEA,
+    encrypted_content TEXT,
+    timestamp TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    attachment_id INTEGER REFERENCES attachments(id) ON DELETE SET NULL,
+    PRIMARY KEY (id, timestamp),
+    CONSTRAINT messages_content_present CHECK (ciphertext IS NOT NULL OR encrypted_content IS NOT NULL)
+) PARTITION BY RANGE (timestamp);
+
+-- Ciphertext does not compress, so skip TOAST compression attempts
+ALTER TABLE messages ALTER COLUMN ciphertext SET STORAGE EXTERNAL;
+
+-- Create monthly partitions messages_YYYY_MM from from_month up to months_ahead later
+CREATE OR REPLACE FUNCTION ensure_message_partitions(
+    months_ahead INTEGER DEFAULT 3,
+    from_month DATE DEFAULT CURRENT_DATE
+) RETURNS INTEGER AS $$
+DECLARE
+    month_start DATE;
+    partition_name TEXT;
+    created INTEGER := 0;
+BEGIN
+    FOR i IN 0..months_ahead LOOP
+        month_start := (date_trunc('month', from_month) + make_interval(months => i))::date;
+        partition_name := 'messages_' || to_char(month_start, 'YYYY_MM');
+        IF to_regclass(partition_name) IS NULL THEN
+            EXECUTE format('CREATE TABLE %I PARTITION OF messages FOR VALUES FROM (%L) TO (%L)',
+                           partition_name, month_start, (month_start + INTERVAL '1 month')::date);
+            EXECUTE format('ALTER TABLE %I ALTER COLUMN ciphertext SET STORAGE EXTERNAL', partition_name);
+            created := created + 1;
+        END IF;
+    END LOOP;
+    RETURN created;
+END;
+$$ LANGUAGE plpgsql;
+
+SELECT ensure_message_partitions(3);
+
+-- Mergeable DDSketch of seller response times per day; kind is human or ai
+CREATE TABLE response_time_sketches (
+    seller_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    day DATE NOT NULL,
+    kind VARCHAR(10) NOT NULL,
+    sketch BYTEA NOT NULL,
+    updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (seller_id, day, kind)
+);
+
+-- Client message IDs already stored, so retried sends are acknowledged, not re-inserted.
+-- Lives outside messages because a partitioned table cannot enforce this uniqueness.
+CREATE TABLE message_receipts (
+    sender_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    client_msg_id VARCHAR(64) NOT NULL,
+    message_id INTEGER NOT NULL,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (sender_id, client_msg_id)
 );
 
--- Indexes for performance
-CREATE INDEX idx_messages_conversation ON messages(conversation_id);
+-- Indexes for performance (created on every partition)
+CREATE INDEX idx_messages_conversation ON messages(conversation_id, timestamp);
 CREATE INDEX idx_messages_timestamp ON messages(timestamp);
+CREATE INDEX idx_messages_attachment ON messages(attachment_id) WHERE attachment_id IS NOT NULL;
 CREATE INDEX idx_conversations_buyer ON conversations(buyer_id);
 CREATE INDEX idx_conversations_seller ON conversations(seller_id);
+CREATE INDEX idx_message_receipts_created ON message_receipts(created_at);
 
 -- Insert sample users
 INSERT INTO users (username, password, role) VALUES
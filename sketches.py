@@ -0,0 +1,140 @@
+"""
+DDSketch: mergeable quantile sketch with relative-error guarantees
+"""
+
+import math
+import struct
+
+SKETCH_RELATIVE_ACCURACY = 0.01
+SKETCH_MAX_BINS = 2048
+# Values at or below this (seconds) are counted as zero
+SKETCH_MIN_VALUE = 1e-3
+
+_HEADER = struct.Struct(">BdQQddd")
+_FORMAT_VERSION = 1
+
+def _write_varint(out, value):
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return
+
+def _read_varint(data, pos):
+    value = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return value, pos
+        shift += 7
+
+class DDSketch:
+    """
+    Values fall into logarithmic bins of width gamma, so every quantile is within
+    relative_accuracy of the true value. Sketches with the same accuracy merge by
+    adding bin counts, which makes per-day and per-node sketches combinable.
+    """
+
+    def __init__(self, relative_accuracy=SKETCH_RELATIVE_ACCURACY, max_bins=SKETCH_MAX_BINS):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.max_bins = max_bins
+        self.bins = {}
+        self.zero_count = 0
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, value, weight=1):
+        if value <= SKETCH_MIN_VALUE:
+            self.zero_count += weight
+        else:
+            index = math.ceil(math.log(value) / self.log_gamma)
+            self.bins[index] = self.bins.get(index, 0) + weight
+            if len(self.bins) > self.max_bins:
+                self._collapse()
+        self.count += weight
+        self.sum += value * weight
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def _collapse(self):
+        """Fold the lowest bins together; only the smallest values lose accuracy"""
+        indexes = sorted(self.bins)
+        excess = len(indexes) - self.max_bins
+        folded = sum(self.bins.pop(index) for index in indexes[:excess + 1])
+        self.bins[indexes[excess]] = folded
+
+    def merge(self, other):
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError("Cannot merge sketches with different accuracy")
+        for index, count in other.bins.items():
+            self.bins[index] = self.bins.get(index, 0) + count
+        if len(self.bins) > self.max_bins:
+            self._collapse()
+        self.zero_count += other.zero_count
+        self.count += other.count
+        self.sum += other.sum
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        return self
+
+    def quantile(self, q):
+        """Value at quantile q (0-1), or None for an empty sketch"""
+        if self.count == 0:
+            return None
+        rank = q * (self.count - 1)
+        if rank < self.zero_count:
+            return 0.0
+        running = self.zero_count
+        for index in sorted(self.bins):
+            running += self.bins[index]
+            if running > rank:
+                value = 2 * self.gamma ** index / (self.gamma + 1)
+                return min(max(value, self.min), self.max)
+        return self.max
+
+    def summary(self, quantiles=(0.5, 0.9, 0.99)):
+        result = {"count": self.count, "mean": round(self.sum / self.count, 3) if self.count else None}
+        for q in quantiles:
+            value = self.quantile(q)
+            result[f"p{int(q * 100)}"] = round(value, 3) if value is not None else None
+        return result
+
+    def to_bytes(self):
+        """Header plus delta-encoded bin indexes and counts as varints"""
+        out = bytearray(_HEADER.pack(_FORMAT_VERSION, self.relative_accuracy, self.count, self.zero_count,
+                                     self.sum, self.min, self.max))
+        _write_varint(out, len(self.bins))
+        previous = 0
+        for index in sorted(self.bins):
+            delta = index - previous
+            # zigzag so negative indexes (sub-second values) stay small
+            _write_varint(out, (delta << 1) ^ (delta >> 63))
+            _write_varint(out, self.bins[index])
+            previous = index
+        return bytes(out)
+
+    @classmethod
+    def from_bytes(cls, data):
+        data = bytes(data)
+        version, accuracy, count, zero_count, total, low, high = _HEADER.unpack_from(data)
+        if version != _FORMAT_VERSION:
+            raise ValueError(f"Unknown sketch format {version}")
+        sketch = cls(accuracy)
+        sketch.count, sketch.zero_count, sketch.sum = count, zero_count, total
+        sketch.min, sketch.max = low, high
+        size, pos = _read_varint(data, _HEADER.size)
+        index = 0
+        for _ in range(size):
+            zigzag, pos = _read_varint(data, pos)
+            index += (zigzag >> 1) ^ -(zigzag & 1)
+            sketch.bins[index], pos = _read_varint(data, pos)
+        return sketch
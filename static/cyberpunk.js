@@ -427,13 +427,26 @@ class CyberpunkUI {
 // Initialize Cyberpunk UI
 let cyberpunkUI;
 
+// Sends are retried with the same client ID until the server acks them
+const SEND_ACK_TIMEOUT_MS = 8000;
+const SEND_MAX_ATTEMPTS = 5;
+// Messages kept per conversation in the local store
+const STORE_MAX_MESSAGES = 500;
+
 // Enhanced Socket.IO Integration
 class CyberpunkChat {
     constructor() {
         this.socket = io();
         this.currentUser = null;
+        this.sessionToken = null;       // lets reconnects log in without the password
         this.currentPartner = null;
         this.cyberpunkUI = null;
+        this.pendingSends = new Map();  // client_id -> { payload, element, attempts }
+        this.renderedIds = new Set();   // server message IDs already on screen
+        this.messageStores = new Map(); // partner -> { messages: Map(id -> message), lastSeenId }
+        this.unread = new Map();        // partner -> unread count from the inbox
+        this.markReadTimer = null;
+        this.hasConnected = false;
         this.init();
     }
 
@@ -461,6 +474,17 @@ class CyberpunkChat {
             sendButton.addEventListener('click', () => this.sendMessage());
         }
         
+        const attachButton = document.getElementById('attachButton');
+        const attachmentInput = document.getElementById('attachmentInput');
+        if (attachButton && attachmentInput) {
+            attachButton.addEventListener('click', () => attachmentInput.click());
+            attachmentInput.addEventListener('change', () => {
+                const file = attachmentInput.files[0];
+                attachmentInput.value = '';
+                if (file) this.sendAttachment(file);
+            });
+        }
+        
         if (messageInput) {
             messageInput.addEventListener('keypress', (e) => {
                 if (e.key === 'Enter') {
@@ -481,22 +505,116 @@ class CyberpunkChat {
         this.socket.on('connect', () => {
             this.cyberpunkUI.sounds.connect();
             this.cyberpunkUI.showNotification('Connected to secure network', 'success');
+            
+            // After a dropped socket only fetch what each open conversation missed
+            if (this.hasConnected && this.currentUser) {
+                this.socket.emit('login', { username: this.currentUser, token: this.sessionToken });
+                this.messageStores.forEach((store, partner) => this.joinChat(partner));
+            }
+            this.hasConnected = true;
+        });
+
+        this.socket.on('inbox', (data) => {
+            this.unread.clear();
+            data.conversations.forEach(conv => this.unread.set(conv.partner, conv.unread));
+            if (data.total_unread > 0) {
+                const waiting = data.conversations.filter(conv => conv.unread > 0).length;
+                this.cyberpunkUI.showNotification(
+                    `${data.total_unread} unread message(s) in ${waiting} conversation(s)`, 'info');
+            }
+        });
+
+        this.socket.on('inbox_update', (data) => {
+            if (data.partner === this.currentPartner && document.visibilityState === 'visible') {
+                this.markRead(data.partner);
+                return;
+            }
+            this.unread.set(data.partner, (this.unread.get(data.partner) || 0) + 1);
+            this.cyberpunkUI.showNotification(`New message from ${data.partner}`, 'info');
+        });
+
+        document.addEventListener('visibilitychange', () => {
+            if (document.visibilityState === 'visible' && this.currentPartner) {
+                this.markRead(this.currentPartner);
+            }
+        });
+
+        this.socket.on('chat_sync', (data) => {
+            const store = this.getStore(data.partner);
+            const fresh = data.messages.filter(msg => !store.messages.has(msg.id));
+            fresh.forEach(msg => this.storeMessage(data.partner, msg));
+            
+            if (data.partner === this.currentPartner) {
+                fresh.forEach(msg => {
+                    if (!this.renderedIds.has(msg.id)) {
+                        this.displayEnhancedMessage(msg, false);
+                        this.renderedIds.add(msg.id);
+                    }
+                });
+                this.markRead(data.partner);
+            }
+        });
+
+        this.socket.on('chat_resync', (data) => {
+            // Too far behind for a delta: drop the local copy and take a fresh snapshot
+            this.messageStores.delete(data.partner);
+            if (data.partner === this.currentPartner) {
+                document.getElementById('messagesArea').innerHTML = '';
+                this.renderedIds.clear();
+            }
+            this.joinChat(data.partner);
         });
 
         this.socket.on('login_success', (data) => {
+            this.sessionToken = data.token;
+            // A resumed session after a reconnect; the UI is already up
+            if (this.currentUser === data.username) return;
             this.currentUser = data.username;
+            // Start fetching the session while the login animation plays
+            this.bootstrapPromise = this.loadBootstrap();
             this.cyberpunkUI.sounds.success();
             this.transitionToMainInterface();
         });
 
         this.socket.on('login_error', (data) => {
+            if (data.expired && this.currentUser) {
+                this.cyberpunkUI.showNotification('Session expired, please log in again', 'error');
+                setTimeout(() => window.location.reload(), 2000);
+                return;
+            }
             this.cyberpunkUI.sounds.error();
             this.cyberpunkUI.showNotification('Access denied: ' + data.message, 'error');
             this.triggerErrorState();
         });
 
+        // Server is throttling this connection or shedding load; sends retry from their ack
+        this.socket.on('rate_limited', (data) => {
+            const seconds = Math.max(1, Math.ceil(data.retry_after || 1));
+            if (data.event === 'join_chat' && this.currentPartner) {
+                const partner = this.currentPartner;
+                setTimeout(() => {
+                    if (this.currentPartner === partner) this.joinChat(partner);
+                }, seconds * 1000);
+            }
+            if (data.event !== 'send_message') {
+                this.cyberpunkUI.showNotification(`Slow down: retrying in ${seconds}s`, 'info');
+            }
+        });
+
         this.socket.on('receive_message', (data) => {
+            if (data.id && this.renderedIds.has(data.id)) {
+                return;
+            }
+            // Our own message echoed back before its ack arrived
+            if (data.client_id && this.pendingSends.has(data.client_id)) {
+                this.markDelivered(data.client_id, data.id);
+                return;
+            }
             this.displayEnhancedMessage(data);
+            if (data.id) {
+                this.renderedIds.add(data.id);
+                this.storeMessage(data.sender === this.currentUser ? data.receiver : data.sender, data);
+            }
             this.cyberpunkUI.sounds.message();
         });
     }
@@ -521,24 +639,242 @@ class CyberpunkChat {
         const message = messageInput.value.trim();
         
         if (message && this.currentUser && this.currentPartner) {
-            // Add loading state
-            this.cyberpunkUI.showLoadingState(messageInput);
-            
-            this.socket.emit('send_message', {
+            const clientId = this.newClientId();
+            const payload = {
                 sender: this.currentUser,
                 receiver: this.currentPartner,
-                message: message
-            });
+                message: message,
+                client_id: clientId
+            };
+            
+            // Show the message right away, marked pending until the server acks it
+            const element = this.displayEnhancedMessage({ ...payload, pending: true });
+            this.pendingSends.set(clientId, { payload, element, attempts: 0 });
+            this.emitWithAck(clientId);
             
             messageInput.value = '';
-            this.cyberpunkUI.hideLoadingState(messageInput);
         }
     }
 
-    displayEnhancedMessage(data) {
+    sendAttachment(file) {
+        if (!this.currentUser || !this.currentPartner || !this.sessionToken) return;
+        const messageInput = document.getElementById('messageInput');
+        const message = messageInput.value.trim();
+        messageInput.value = '';
+        
+        // The file goes over HTTP as a raw body; only its ID travels over the socket
+        fetch('/api/attachments', {
+            method: 'POST',
+            headers: {
+                'X-Session-Token': this.sessionToken,
+                'X-Filename': encodeURIComponent(file.name)
+            },
+            body: file
+        })
+            .then(response => response.json().then(data => {
+                if (!response.ok) throw new Error(data.error || response.status);
+                return data;
+            }))
+            .then(attachment => {
+                const clientId = this.newClientId();
+                const payload = {
+                    sender: this.currentUser,
+                    receiver: this.currentPartner,
+                    message: message,
+                    client_id: clientId,
+                    attachment_id: attachment.id
+                };
+                const element = this.displayEnhancedMessage({ ...payload, attachment, pending: true });
+                this.pendingSends.set(clientId, { payload, element, attempts: 0 });
+                this.emitWithAck(clientId);
+            })
+            .catch(error => {
+                this.cyberpunkUI.showNotification(`Upload failed: ${error.message}`, 'error');
+            });
+    }
+
+    renderAttachment(attachment) {
+        const url = `/api/attachments/${attachment.id}?token=${encodeURIComponent(this.sessionToken || '')}`;
+        const name = attachment.filename || 'attachment';
+        const link = document.createElement('a');
+        link.className = 'message-attachment';
+        link.href = url;
+        link.target = '_blank';
+        link.rel = 'noopener';
+        if (attachment.content_type.startsWith('image/')) {
+            const img = document.createElement('img');
+            img.src = url;
+            img.alt = name;
+            img.loading = 'lazy';
+            img.style.maxWidth = '240px';
+            img.style.display = 'block';
+            link.appendChild(img);
+        } else {
+            link.textContent = `📎 ${name} (${Math.ceil(attachment.size / 1024)} KB)`;
+        }
+        return link;
+    }
+
+    newClientId() {
+        if (window.crypto && crypto.randomUUID) {
+            return crypto.randomUUID();
+        }
+        const bytes = new Uint8Array(16);
+        crypto.getRandomValues(bytes);
+        return Array.from(bytes, b => b.toString(16).padStart(2, '0')).join('');
+    }
+
+    emitWithAck(clientId) {
+        const pending = this.pendingSends.get(clientId);
+        if (!pending) return;
+        
+        pending.attempts += 1;
+        const attempt = pending.attempts;
+        
+        const timer = setTimeout(() => {
+            if (this.pendingSends.get(clientId) === pending && pending.attempts === attempt) {
+                this.retrySend(clientId);
+            }
+        }, SEND_ACK_TIMEOUT_MS);
+        
+        // The token rides along so a retry after a reconnect is accepted straight away
+        this.socket.emit('send_message', { ...pending.payload, token: this.sessionToken }, (ack) => {
+            clearTimeout(timer);
+            if (ack && ack.ok) {
+                // Late acks of earlier attempts are just as good
+                this.markDelivered(clientId, ack.id);
+            } else if (pending.attempts !== attempt) {
+                return;
+            } else if (ack && ack.error === 'retry') {
+                this.retrySend(clientId);
+            } else if (ack && ack.error === 'rate_limited') {
+                this.retrySend(clientId, ack.retry_after * 1000);
+            } else {
+                this.markFailed(clientId, ack ? ack.error : 'no_ack');
+            }
+        });
+    }
+
+    retrySend(clientId, minDelay = 0) {
+        const pending = this.pendingSends.get(clientId);
+        if (!pending) return;
+        
+        if (pending.attempts >= SEND_MAX_ATTEMPTS) {
+            this.markFailed(clientId, 'timeout');
+            return;
+        }
+        const backoff = Math.min(8000, 500 * 2 ** pending.attempts) * (0.5 + Math.random() / 2);
+        const delay = Math.max(backoff, minDelay);
+        setTimeout(() => this.emitWithAck(clientId), delay);
+    }
+
+    markDelivered(clientId, messageId) {
+        const pending = this.pendingSends.get(clientId);
+        if (!pending) return;
+        
+        this.pendingSends.delete(clientId);
+        if (messageId) {
+            this.renderedIds.add(messageId);
+            pending.element.dataset.messageId = messageId;
+            this.storeMessage(pending.payload.receiver, { ...pending.payload, id: messageId });
+        }
+        pending.element.classList.remove('pending', 'failed');
+        pending.element.classList.add('delivered');
+        this.setMessageStatus(pending.element, '✓');
+    }
+
+    markFailed(clientId, reason) {
+        const pending = this.pendingSends.get(clientId);
+        if (!pending) return;
+        
+        pending.element.classList.remove('pending');
+        pending.element.classList.add('failed');
+        this.setMessageStatus(pending.element, '⚠ not sent, tap to retry');
+        this.cyberpunkUI.showNotification('Message not delivered: ' + reason, 'error');
+        
+        pending.element.addEventListener('click', () => {
+            if (!pending.element.classList.contains('failed')) return;
+            pending.attempts = 0;
+            pending.element.classList.remove('failed');
+            pending.element.classList.add('pending');
+            this.setMessageStatus(pending.element, '⏳');
+            this.emitWithAck(clientId);
+        }, { once: true });
+    }
+
+    getStore(partner) {
+        let store = this.messageStores.get(partner);
+        if (!store) {
+            store = { messages: new Map(), lastSeenId: null };
+            this.messageStores.set(partner, store);
+        }
+        return store;
+    }
+
+    storeMessage(partner, message) {
+        const store = this.getStore(partner);
+        store.messages.set(message.id, message);
+        if (store.lastSeenId === null || message.id > store.lastSeenId) {
+            store.lastSeenId = message.id;
+        }
+        // Maps iterate in insertion order, so the first key is the oldest
+        while (store.messages.size > STORE_MAX_MESSAGES) {
+            store.messages.delete(store.messages.keys().next().value);
+        }
+    }
+
+    renderStore(partner) {
+        const store = this.messageStores.get(partner);
+        if (!store) return;
+        store.messages.forEach(msg => {
+            if (!this.renderedIds.has(msg.id)) {
+                this.displayEnhancedMessage(msg, false);
+                this.renderedIds.add(msg.id);
+            }
+        });
+    }
+
+    markRead(partner) {
+        // Coalesce bursts of incoming messages into one mark_read
+        clearTimeout(this.markReadTimer);
+        this.markReadTimer = setTimeout(() => {
+            const store = this.messageStores.get(partner);
+            this.socket.emit('mark_read', {
+                username: this.currentUser,
+                token: this.sessionToken,
+                partner: partner,
+                last_read_id: store ? store.lastSeenId : null
+            }, (ack) => {
+                if (ack && ack.ok) {
+                    this.unread.set(partner, ack.unread);
+                }
+            });
+        }, 500);
+    }
+
+    joinChat(partner) {
+        const store = this.messageStores.get(partner);
+        this.socket.emit('join_chat', {
+            username: this.currentUser,
+            token: this.sessionToken,
+            partner: partner,
+            sync: true,
+            last_seen_id: store ? store.lastSeenId : null
+        });
+    }
+
+    setMessageStatus(element, status) {
+        const statusSpan = element.querySelector('.message-status');
+        if (statusSpan) statusSpan.textContent = ' ' + status;
+    }
+
+    displayEnhancedMessage(data, animate = true) {
         const messagesArea = document.getElementById('messagesArea');
         const messageDiv = document.createElement('div');
         messageDiv.className = `message ${data.sender === this.currentUser ? 'buyer' : (data.is_ai ? 'ai' : 'seller')}`;
+        if (data.pending) messageDiv.classList.add('pending');
+        if (data.client_id) messageDiv.dataset.clientId = data.client_id;
+        if (data.id) messageDiv.dataset.messageId = data.id;
         
         const bubbleDiv = document.createElement('div');
         bubbleDiv.className = 'message-bubble';
@@ -549,11 +885,20 @@ class CyberpunkChat {
         
         const contentDiv = document.createElement('div');
         contentDiv.className = 'message-content';
-        contentDiv.textContent = data.message;
+        contentDiv.textContent = data.message || '';
+        if (data.attachment) {
+            contentDiv.appendChild(this.renderAttachment(data.attachment));
+        }
         
         const timeDiv = document.createElement('div');
         timeDiv.className = 'message-time';
-        timeDiv.textContent = new Date().toLocaleTimeString();
+        const sentAt = data.timestamp && data.timestamp !== 'now' ? new Date(data.timestamp) : new Date();
+        timeDiv.textContent = sentAt.toLocaleTimeString();
+        
+        const statusSpan = document.createElement('span');
+        statusSpan.className = 'message-status';
+        statusSpan.textContent = data.pending ? ' ⏳' : '';
+        timeDiv.appendChild(statusSpan);
         
         bubbleDiv.appendChild(senderDiv);
         bubbleDiv.appendChild(contentDiv);
@@ -563,8 +908,11 @@ class CyberpunkChat {
         messagesArea.appendChild(messageDiv);
         messagesArea.scrollTop = messagesArea.scrollHeight;
         
-        // Enhance with cyberpunk effects
-        this.cyberpunkUI.enhanceMessage(messageDiv);
+        // Enhance with cyberpunk effects; synced history is shown without them
+        if (animate) {
+            this.cyberpunkUI.enhanceMessage(messageDiv);
+        }
+        return messageDiv;
     }
 
     transitionToMainInterface() {
@@ -578,11 +926,34 @@ class CyberpunkChat {
             mainInterface.classList.remove('hidden');
             mainInterface.style.animation = 'fadeIn 0.5s ease';
             
-            this.loadContacts();
+            this.bootstrapPromise.then(bootstrap => {
+                if (bootstrap) {
+                    this.displayContacts(bootstrap.contacts, bootstrap.conversations);
+                } else {
+                    this.loadContacts();
+                }
+            });
             this.cyberpunkUI.initTerminal();
         }, 500);
     }
 
+    loadBootstrap() {
+        // Contacts, conversations, unread counts and recent messages in one request
+        return fetch('/api/bootstrap', { headers: { 'X-Session-Token': this.sessionToken } })
+            .then(response => {
+                if (!response.ok) throw new Error(response.status);
+                return response.json();
+            })
+            .then(data => {
+                data.conversations.forEach(conv => {
+                    this.unread.set(conv.partner, conv.unread);
+                    conv.messages.forEach(msg => this.storeMessage(conv.partner, msg));
+                });
+                return data;
+            })
+            .catch(() => null);
+    }
+
     loadContacts() {
         const userRole = this.currentUser.startsWith('buyer') ? 'seller' : 'buyer';
         
@@ -596,22 +967,24 @@ class CyberpunkChat {
             });
     }
 
-    displayContacts(users) {
+    displayContacts(users, conversations = []) {
         if (users.length > 0) {
-            this.currentPartner = users[0];
+            // Resume the most recent conversation, else start with the first contact
+            const recent = conversations.find(conv => users.includes(conv.partner));
+            this.currentPartner = recent ? recent.partner : users[0];
             document.getElementById('chatPartner').textContent = this.currentPartner;
             
             // Enable input
             const messageInput = document.getElementById('messageInput');
             const sendButton = document.getElementById('sendButton');
+            const attachButton = document.getElementById('attachButton');
             if (messageInput) messageInput.disabled = false;
             if (sendButton) sendButton.disabled = false;
+            if (attachButton) attachButton.disabled = false;
             
-            // Join chat room
-            this.socket.emit('join_chat', {
-                username: this.currentUser,
-                partner: this.currentPartner
-            });
+            // Show what the store already has, then join; the server sends only what is missing
+            this.renderStore(this.currentPartner);
+            this.joinChat(this.currentPartner);
         }
     }
 
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+Test script for socket rate limits, load shedding and the connection pool
+"""
+
+import threading
+import time
+from admission import SocketLimiter, AdmissionControl, parse_limits
+from db_pool import ConnectionPool, PoolTimeout
+from reply_scheduler import ReplyScheduler
+
+class FakeConnection:
+    def __init__(self):
+        self.closed = 0
+        self.autocommit = False
+        self.rollbacks = 0
+
+    def rollback(self):
+        self.rollbacks += 1
+
+    def close(self):
+        self.closed = 1
+
+def test_parse_limits():
+    """Limit specs parse into (rate, burst) per event"""
+    print("🧾 Testing limit parsing...")
+    limits = parse_limits("send_message=5/10, join_chat=2,")
+    assert limits == {"send_message": (5.0, 10.0), "join_chat": (2.0, 2.0)}
+    print("✅ Limits parsed")
+
+def test_socket_limiter():
+    """Each sid gets its burst, a user's tabs share a larger one"""
+    print("\n🚦 Testing socket limiter...")
+    limiter = SocketLimiter({"send_message": (1, 2)}, user_factor=1.5)
+    assert limiter.check("send_message", "sid1", "buyer1")[0]
+    assert limiter.check("send_message", "sid1", "buyer1")[0]
+    allowed, retry_after = limiter.check("send_message", "sid1", "buyer1")
+    assert not allowed and 0 < retry_after <= 1
+
+    # A second tab has its own sid bucket but shares buyer1's 3-token user bucket
+    assert limiter.check("send_message", "sid2", "buyer1")[0]
+    assert not limiter.check("send_message", "sid2", "buyer1")[0]
+    assert limiter.check("send_message", "sid3", "buyer2")[0]
+
+    # Events without a configured limit always pass
+    assert all(limiter.check("typing", "sid1")[0] for _ in range(100))
+    limiter.forget("sid1")
+    assert limiter.check("send_message", "sid1")[0]
+    print("✅ Per-sid and per-user buckets enforced")
+
+def test_admission_control():
+    """Expensive events are shed while the pool or AI queue is backed up"""
+    print("\n🧯 Testing admission control...")
+    state = {"wait": 0.0, "depth": 0}
+    admission = AdmissionControl(lambda: state["wait"], lambda: state["depth"],
+                                 max_pool_wait_ms=100, max_ai_queue_depth=10,
+                                 shed_events={"send_message"}, retry_after=3)
+    assert admission.check("send_message") == (True, None, 0.0)
+    state["wait"] = 150
+    assert admission.check("send_message") == (False, "db_pool", 3)
+    assert admission.check("mark_read")[0]
+    state["wait"], state["depth"] = 0, 11
+    assert admission.check("send_message")[1] == "ai_queue"
+    print("✅ Load shed on pool wait and AI queue depth")
+
+def test_admission_with_reply_scheduler():
+    """The AI queue gauge wired up as in app.py yields a number AdmissionControl can compare"""
+    print("\n🔗 Testing admission wiring...")
+    gate = threading.Event()
+    scheduler = ReplyScheduler(lambda message, seller, buyer: gate.wait(2) and "reply",
+                               lambda buyer, seller, reply: None, debounce=0.01, max_wait=1)
+    admission = AdmissionControl(lambda: 0.0, scheduler.queue_depth, max_pool_wait_ms=100,
+                                 max_ai_queue_depth=1, shed_events={"send_message"}, retry_after=3)
+    assert admission.check("send_message") == (True, None, 0.0)
+    scheduler.submit("buyer1", "seller1", "hi")
+    scheduler.submit("buyer2", "seller1", "hi")
+    assert admission.check("send_message") == (False, "ai_queue", 3)
+    gate.set()
+    print("✅ Reply scheduler depth drives admission")
+
+def test_connection_pool():
+    """Connections are reused, reset, bounded and waits are measured"""
+    print("\n🏊 Testing connection pool...")
+    created = []
+    def connect():
+        created.append(FakeConnection())
+        return created[-1]
+
+    pool = ConnectionPool(connect, size=2, timeout=0.2, half_life=0.1)
+    first = pool.acquire()
+    first.autocommit = True
+    first.close()
+    first.close()
+    second = pool.acquire()
+    assert len(created) == 1 and created[0].autocommit is False and created[0].rollbacks == 1
+    third = pool.acquire()
+    assert pool.stats()["in_use"] == 2
+
+    try:
+        pool.acquire()
+        assert False, "pool should be exhausted"
+    except PoolTimeout:
+        pass
+    assert pool.wait_ms() > 30
+
+    # A blocked caller gets the connection as soon as one is returned
+    got = []
+    waiter = threading.Thread(target=lambda: got.append(pool.acquire()))
+    waiter.start()
+    time.sleep(0.05)
+    second.close()
+    waiter.join(1)
+    assert got and pool.stats()["in_use"] == 2
+
+    # Broken idle connections are replaced rather than handed out again
+    got[0].close()
+    third.close()
+    created[0].closed = 1
+    held = [pool.acquire(), pool.acquire()]
+    assert len(created) == 3 and not any(conn.closed for conn in held)
+    # Dropping a wrapper without close() still returns its connection
+    del held
+    assert pool.stats()["in_use"] == 0
+
+    time.sleep(0.5)
+    assert pool.wait_ms() < 10
+    print(f"✅ Pool bounded at {pool.size} connections")
+
+def main():
+    """Run all admission tests"""
+    print("🚀 Running Admission Control Tests\n")
+    test_parse_limits()
+    test_socket_limiter()
+    test_admission_control()
+    test_admission_with_reply_scheduler()
+    test_connection_pool()
+    print("\n🎉 All admission control tests passed!")
+
+if __name__ == "__main__":
+    main()
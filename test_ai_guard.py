@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""
+Test script for the AI upstream guard against a local stub that injects latency and errors
+"""
+
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from ai_guard import AIUpstreamGuard, AIUnavailable, CircuitBreaker
+from ratelimit import TokenBucket, KeyedTokenBuckets
+
+class StubUpstream:
+    """Local chat-completions stub; each request pops the next scripted behaviour"""
+
+    def __init__(self):
+        self.script = []
+        self.requests = 0
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                stub.requests += 1
+                action = stub.script.pop(0) if stub.script else ("ok",)
+                if action[0] == "sleep":
+                    time.sleep(action[1])
+                    action = ("ok",)
+                if action[0] == "status":
+                    self.send_response(action[1])
+                    self.end_headers()
+                    return
+                body = json.dumps({"choices": [{"message": {"content": "stub reply"}}]}).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}/v1/chat/completions"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+def make_guard(url, **kwargs):
+    options = {
+        "connect_timeout": 0.5,
+        "read_timeout": 0.3,
+        "max_retries": 2,
+        "backoff_base": 0.01,
+        "backoff_max": 0.02,
+        "breaker": CircuitBreaker(failure_threshold=2, reset_timeout=0.2),
+        "global_bucket": TokenBucket(1000, 1000),
+        "seller_buckets": KeyedTokenBuckets(1000, 1000)
+    }
+    options.update(kwargs)
+    return AIUpstreamGuard(url, **options)
+
+def expect_unavailable(guard, reason):
+    try:
+        guard.post("seller1", {}, {})
+    except AIUnavailable as e:
+        assert e.reason == reason, e.reason
+        return
+    raise AssertionError(f"expected AIUnavailable({reason})")
+
+def test_retry_on_unavailable():
+    """503s are retried with backoff and then succeed"""
+    print("🔁 Testing retries...")
+    stub = StubUpstream()
+    try:
+        stub.script = [("status", 503), ("status", 503)]
+        guard = make_guard(stub.url)
+        assert guard.post("seller1", {}, {})["choices"][0]["message"]["content"] == "stub reply"
+        assert stub.requests == 3
+    finally:
+        stub.close()
+    print("✅ Transient upstream errors retried")
+
+def test_read_timeout_not_retried():
+    """A slow upstream hits the read deadline once and is not retried"""
+    print("\n⏱️ Testing read deadline...")
+    stub = StubUpstream()
+    try:
+        stub.script = [("sleep", 0.6)]
+        guard = make_guard(stub.url)
+        started = time.monotonic()
+        expect_unavailable(guard, "read_timeout")
+        assert time.monotonic() - started < 0.6
+        assert stub.requests == 1
+    finally:
+        stub.close()
+    print("✅ Read timeout enforced without retry")
+
+def test_breaker_fails_fast():
+    """After repeated failures the breaker opens and the stub is not called"""
+    print("\n🔌 Testing circuit breaker...")
+    stub = StubUpstream()
+    try:
+        guard = make_guard(stub.url, max_retries=0)
+        stub.script = [("status", 500), ("status", 500)]
+        expect_unavailable(guard, "http_500")
+        expect_unavailable(guard, "http_500")
+        calls = stub.requests
+        expect_unavailable(guard, "circuit_open")
+        assert stub.requests == calls
+        assert guard.breaker.state == CircuitBreaker.OPEN
+
+        # After the cooldown one trial call closes the breaker again
+        time.sleep(0.25)
+        assert guard.post("seller1", {}, {})
+        assert guard.breaker.state == CircuitBreaker.CLOSED
+    finally:
+        stub.close()
+    print("✅ Breaker opens, fails fast and recovers")
+
+def test_rate_limits_shed():
+    """Per-seller and global buckets shed excess calls"""
+    print("\n🪣 Testing rate limits...")
+    stub = StubUpstream()
+    try:
+        guard = make_guard(stub.url, seller_buckets=KeyedTokenBuckets(0.001, 1))
+        guard.post("seller1", {}, {})
+        expect_unavailable(guard, "seller_rate_limited")
+        assert guard.post("seller2", {}, {})
+
+        guard = make_guard(stub.url, global_bucket=TokenBucket(0.001, 1))
+        guard.post("seller1", {}, {})
+        expect_unavailable(guard, "global_rate_limited")
+    finally:
+        stub.close()
+    print("✅ Excess calls shed")
+
+def test_shed_calls_keep_seller_quota():
+    """Calls shed by the breaker or the global bucket do not use up the seller's tokens"""
+    print("\n🧾 Testing quota of shed calls...")
+    stub = StubUpstream()
+    try:
+        sellers = KeyedTokenBuckets(0.001, 2)
+        guard = make_guard(stub.url, seller_buckets=sellers, global_bucket=TokenBucket(0.001, 1))
+        guard.post("seller1", {}, {})
+        for _ in range(5):
+            expect_unavailable(guard, "global_rate_limited")
+        assert sellers.bucket("seller1").available() >= 0.99
+
+        sellers = KeyedTokenBuckets(0.001, 2)
+        guard = make_guard(stub.url, seller_buckets=sellers, max_retries=0)
+        guard.breaker.record_failure()
+        guard.breaker.record_failure()
+        for _ in range(5):
+            expect_unavailable(guard, "circuit_open")
+        assert sellers.bucket("seller1").available() >= 1.99
+    finally:
+        stub.close()
+    print("✅ Seller quota only spent on admitted calls")
+
+def main():
+    """Run all AI guard tests"""
+    print("🚀 Running AI Guard Tests\n")
+    test_retry_on_unavailable()
+    test_read_timeout_not_retried()
+    test_breaker_fails_fast()
+    test_rate_limits_shed()
+    test_shed_calls_keep_seller_quota()
+    print("\n🎉 All AI guard tests passed!")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""
+Test script for the fingerprinted static asset build
+"""
+
+import gzip
+import os
+import tempfile
+from assets import AssetManifest, PageCache, build, minify_css, minify_js
+
+def test_minify():
+    """Minifiers drop comments and whitespace but keep code intact"""
+    print("🗜️ Testing minifiers...")
+    css = "/* theme */\n.a , .b {\n    color : red;\n    margin: 0 auto;\n}\n"
+    assert minify_css(css) == ".a,.b{color : red;margin: 0 auto}"
+    js = "// header\nfunction f() {\n    // note\n    return `a\n        b`;\n}\n\n"
+    assert minify_js(js) == "function f() {\nreturn `a\nb`;\n}\n"
+    print("✅ Minified")
+
+def test_build_and_resolve():
+    """A build writes hashed files, gzip variants and a manifest the server can resolve"""
+    print("\n📦 Testing asset build...")
+    with tempfile.TemporaryDirectory() as root:
+        static_dir = os.path.join(root, "static")
+        dist_dir = os.path.join(static_dir, "dist")
+        os.makedirs(static_dir)
+        with open(os.path.join(static_dir, "app.js"), "w") as f:
+            f.write("// app\nconsole.log('hi');\n")
+
+        manifest = build(static_dir, dist_dir, ["app.js"])
+        hashed = manifest["app.js"]
+        assert hashed.startswith("app.") and hashed.endswith(".js") and len(hashed) == len("app..js") + 12
+        assert build(static_dir, dist_dir, ["app.js"]) == manifest
+
+        with open(os.path.join(dist_dir, hashed + ".gz"), "rb") as f:
+            assert gzip.decompress(f.read()) == b"console.log('hi');\n"
+
+        loaded = AssetManifest(dist_dir)
+        assert loaded.url("app.js") == f"/assets/{hashed}"
+        assert loaded.url("other.css") == "/static/other.css"
+        path, encoding = loaded.resolve(hashed, "gzip, deflate, br")
+        assert path.endswith(".gz") and encoding == "gzip"
+        assert loaded.resolve(hashed, "")[1] is None
+        assert loaded.resolve("../app.js", "gzip") == (None, None)
+
+        # Pages are re-rendered once the manifest changes
+        renders = []
+        cache = PageCache(loaded)
+        render = lambda template: renders.append(template) or f"<script src='{loaded.url('app.js')}'>"
+        first = cache.get("index.html", render)
+        assert cache.get("index.html", render) is first and len(renders) == 1
+        with open(os.path.join(static_dir, "app.js"), "a") as f:
+            f.write("console.log('again');\n")
+        build(static_dir, dist_dir, ["app.js"])
+        loaded.load()
+        assert cache.get("index.html", render).etag != first.etag and len(renders) == 2
+    print("✅ Build output resolves")
+
+def main():
+    """Run all asset tests"""
+    print("🚀 Running Asset Pipeline Tests\n")
+    test_minify()
+    test_build_and_resolve()
+    print("\n🎉 All asset tests passed!")
+
+if __name__ == "__main__":
+    main()
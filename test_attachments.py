@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+"""
+Test script for the encrypted, content-addressed attachment store
+"""
+
+import io
+import os
+import tempfile
+import tracemalloc
+from cryptography.fernet import InvalidToken
+from attachments import (AttachmentStore, AttachmentError, AttachmentTooLarge, UnsupportedType, FILE_HEADER,
+                         parse_range, record_size)
+from encryption import KeyRing
+
+PNG = b"\x89PNG\r\n\x1a\n"
+
+def make_store(chunk_size=1024, max_bytes=1 << 20):
+    directory = tempfile.mkdtemp()
+    keyring = KeyRing(os.path.join(directory, "test.keyring"), os.path.join(directory, "test.key"))
+    return AttachmentStore(os.path.join(directory, "store"), keyring, chunk_size=chunk_size,
+                           max_bytes=max_bytes, address_key=b"test-address-key")
+
+def png(size, seed=0):
+    body = bytes((i * 31 + seed) % 251 for i in range(size - len(PNG)))
+    return PNG + body
+
+class SlowStream:
+    """Hands out a few bytes per read, like a chunked request body"""
+
+    def __init__(self, data, step=333):
+        self.data = io.BytesIO(data)
+        self.step = step
+
+    def read(self, size=-1):
+        return self.data.read(min(size, self.step) if size >= 0 else self.step)
+
+def test_round_trip():
+    """Files come back byte for byte and are not stored in the clear"""
+    print("📎 Testing round trip...")
+    store = make_store()
+    data = png(5000)
+    address, size, content_type, created = store.put(SlowStream(data))
+    assert (size, content_type, created) == (5000, "image/png", True)
+    with store.open(address) as stored:
+        assert stored.size == 5000 and stored.read() == data
+    with open(store.path(address), "rb") as f:
+        raw = f.read()
+    assert data[100:200] not in raw
+    assert len(raw) == FILE_HEADER.size + 4 * record_size(1024) + record_size(5000 - 4 * 1024)
+    assert os.listdir(os.path.join(store.directory, "tmp")) == []
+    print("✅ Round trip intact")
+
+def test_deduplication():
+    """Identical content is stored once; different content gets its own address"""
+    print("\n🧬 Testing deduplication...")
+    store = make_store()
+    first = store.put(io.BytesIO(png(3000)))
+    second = store.put(io.BytesIO(png(3000)))
+    other = store.put(io.BytesIO(png(3000, seed=1)))
+    assert first[0] == second[0] and first[3] and not second[3]
+    assert other[0] != first[0]
+    # Keyed, so the address is not the plain hash of the file
+    assert make_store().put(io.BytesIO(png(3000)))[0] == first[0]
+    print("✅ Duplicate uploads share one file")
+
+def test_range_reads():
+    """Ranges spanning chunk boundaries decrypt only what they cover"""
+    print("\n✂️ Testing range reads...")
+    store = make_store()
+    data = png(5000)
+    address = store.put(io.BytesIO(data))[0]
+    with store.open(address) as stored:
+        for start, end in ((0, 1), (1000, 1100), (1020, 2050), (4090, 5000), (4999, 5000), (0, 5000)):
+            assert stored.read(start, end) == data[start:end], (start, end)
+        pieces = list(stored.iter_range(1020, 2050))
+        assert [len(piece) for piece in pieces] == [4, 1024, 2]
+    print("✅ Range reads correct")
+
+def test_parse_range():
+    """Range headers map to [start, end) or are rejected"""
+    print("\n📐 Testing Range parsing...")
+    assert parse_range(None, 100) is None
+    assert parse_range("bytes=0-9", 100) == (0, 10)
+    assert parse_range("bytes=90-", 100) == (90, 100)
+    assert parse_range("bytes=-10", 100) == (90, 100)
+    assert parse_range("bytes=-500", 100) == (0, 100)
+    assert parse_range("bytes=50-500", 100) == (50, 100)
+    assert parse_range("bytes=0-1,5-6", 100) is None
+    assert parse_range("items=0-1", 100) is None
+    for header in ("bytes=100-", "bytes=10-5", "bytes=-0"):
+        try:
+            parse_range(header, 100)
+            raise AssertionError(f"{header} should be unsatisfiable")
+        except ValueError:
+            pass
+    print("✅ Range parsing correct")
+
+def test_tampering():
+    """Swapped chunks are detected even though each one decrypts on its own"""
+    print("\n🛡️ Testing chunk binding...")
+    store = make_store()
+    address = store.put(io.BytesIO(png(4096)))[0]
+    path = store.path(address)
+    with open(path, "rb") as f:
+        raw = f.read()
+    record = record_size(1024)
+    first = FILE_HEADER.size
+    swapped = raw[:first] + raw[first + record:first + 2 * record] + raw[first:first + record] + raw[first + 2 * record:]
+    with open(path, "wb") as f:
+        f.write(swapped)
+    with store.open(address) as stored:
+        try:
+            stored.read(0, 10)
+            raise AssertionError("swapped chunk accepted")
+        except InvalidToken:
+            pass
+    print("✅ Chunks bound to their position")
+
+def test_rejected_uploads():
+    """Oversized, unknown and empty uploads fail and leave nothing behind"""
+    print("\n🚫 Testing rejected uploads...")
+    store = make_store(max_bytes=4000)
+    for stream, error in ((io.BytesIO(png(5000)), AttachmentTooLarge),
+                          (io.BytesIO(b"MZ\x90\x00" + b"\x00" * 100), UnsupportedType),
+                          (io.BytesIO(b""), AttachmentError)):
+        try:
+            store.put(stream)
+            raise AssertionError(f"{error.__name__} expected")
+        except error:
+            pass
+    assert os.listdir(os.path.join(store.directory, "tmp")) == []
+    assert sorted(os.listdir(store.directory)) == ["tmp"]
+    for address in ("../../etc/passwd", "A" * 64):
+        try:
+            store.path(address)
+            raise AssertionError("invalid address accepted")
+        except ValueError:
+            pass
+    print("✅ Bad uploads rejected")
+
+def test_key_rotation():
+    """Attachments stay readable after the keyring gets a new primary key"""
+    print("\n🔑 Testing key rotation...")
+    store = make_store()
+    data = png(3000)
+    old = store.put(io.BytesIO(data))[0]
+    store.keyring.rotate()
+    new = store.put(io.BytesIO(png(3000, seed=2)))[0]
+    with store.open(old) as stored:
+        assert stored.read() == data
+    with store.open(new) as stored:
+        assert stored.read(0, 8) == PNG
+    print("✅ Old attachments readable after rotation")
+
+def test_constant_memory():
+    """Peak memory of an upload and a full read does not grow with file size"""
+    print("\n📏 Testing memory per upload...")
+
+    class Generated:
+        def __init__(self, size):
+            self.left = size
+            self.first = True
+
+        def read(self, size):
+            size = min(size, self.left)
+            self.left -= size
+            if self.first and size:
+                self.first = False
+                return PNG + b"\x00" * (size - len(PNG))
+            return b"\x01" * size
+
+    peaks = []
+    for size in (2 << 20, 16 << 20):
+        store = make_store(chunk_size=64 * 1024, max_bytes=32 << 20)
+        tracemalloc.start()
+        address = store.put(Generated(size))[0]
+        with store.open(address) as stored:
+            for _ in stored.iter_range():
+                pass
+        peaks.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    assert peaks[1] < 1 << 20, peaks
+    assert peaks[1] < peaks[0] * 2, peaks
+    print(f"✅ Peak {peaks[0] // 1024} KiB for 2 MiB, {peaks[1] // 1024} KiB for 16 MiB")
+
+def test_download_endpoint():
+    """Downloads honour Range, and only participants get the file"""
+    print("\n🌐 Testing download endpoint...")
+    import app as app_module
+    client = app_module.create_app({"TESTING": True}).test_client()
+    store = make_store()
+    data = png(5000)
+    address = store.put(io.BytesIO(data))[0]
+    meta = {"id": 7, "address": address, "size": 5000, "content_type": "image/png", "filename": "photo 1.png"}
+    originals = app_module.attachment_store, app_module.get_attachment
+    try:
+        app_module.attachment_store = store
+        app_module.get_attachment = lambda attachment_id, username, sent_only=False: (
+            meta if attachment_id == 7 and username == "buyer1" else None)
+        assert client.get("/api/attachments/7").status_code == 401
+        token = app_module.sessions.issue("buyer1")
+        other = app_module.sessions.issue("buyer2")
+        assert client.get(f"/api/attachments/7?token={other}").status_code == 404
+
+        full = client.get(f"/api/attachments/7?token={token}")
+        assert full.status_code == 200 and full.data == data
+        assert full.headers["Accept-Ranges"] == "bytes"
+        assert full.headers["Content-Disposition"] == "inline; filename*=UTF-8''photo%201.png"
+        assert "immutable" in full.headers["Cache-Control"]
+
+        part = client.get("/api/attachments/7", headers={"X-Session-Token": token, "Range": "bytes=1000-2099"})
+        assert part.status_code == 206 and part.data == data[1000:2100]
+        assert part.headers["Content-Range"] == "bytes 1000-2099/5000"
+        bad = client.get("/api/attachments/7", headers={"X-Session-Token": token, "Range": "bytes=9000-"})
+        assert bad.status_code == 416 and bad.headers["Content-Range"] == "bytes */5000"
+        cached = client.get("/api/attachments/7", headers={"X-Session-Token": token, "If-None-Match": f'"{address}"'})
+        assert cached.status_code == 304
+    finally:
+        app_module.attachment_store, app_module.get_attachment = originals
+    print("✅ Download endpoint correct")
+
+def main():
+    """Run all attachment tests"""
+    print("🚀 Running Attachment Tests\n")
+    test_round_trip()
+    test_deduplication()
+    test_range_reads()
+    test_parse_range()
+    test_tampering()
+    test_rejected_uploads()
+    test_key_rotation()
+    test_constant_memory()
+    test_download_endpoint()
+    print("\n🎉 All attachment tests passed!")
+
+if __name__ == "__main__":
+    main()
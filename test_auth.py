@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+Test script for password hashing, offloaded verification and session tokens
+"""
+
+import os
+import tempfile
+import threading
+import time
+from auth import (Authenticator, SessionManager, LoginBusy, hash_password, verify_password,
+                  PASSWORD_SCRYPT_N)
+
+def test_hashing():
+    """Hashes verify, legacy plaintext and outdated parameters ask for a rehash"""
+    print("🔑 Testing password hashing...")
+    stored = hash_password("soweto311")
+    assert stored.startswith("scrypt$") and "soweto311" not in stored
+    assert hash_password("soweto311") != stored
+    assert verify_password("soweto311", stored) == (True, False)
+    assert verify_password("wrong", stored)[0] is False
+
+    assert verify_password("soweto311", "soweto311") == (True, True)
+    assert verify_password("wrong", "soweto311")[0] is False
+    assert verify_password("soweto311", hash_password("soweto311", n=PASSWORD_SCRYPT_N // 2)) == (True, True)
+    assert verify_password("soweto311", "scrypt$broken") == (False, False)
+    print("✅ Hashing and rehash detection work")
+
+def test_authenticator():
+    """Verification runs on the worker pool and upgrades legacy passwords"""
+    print("\n👷 Testing authenticator...")
+    users = {"buyer1": "soweto311"}
+    authenticator = Authenticator(users.get, users.__setitem__, workers=2, max_pending=0)
+
+    assert authenticator.verify("buyer1", "soweto311")
+    assert users["buyer1"].startswith("scrypt$")
+    assert authenticator.verify("buyer1", "soweto311")
+    assert not authenticator.verify("buyer1", "nope")
+    assert not authenticator.verify("nobody", "soweto311")
+
+    # Two workers and no queue: a third concurrent login is refused, not queued
+    gate = threading.Event()
+    slow = Authenticator(lambda name: gate.wait(2) and users["buyer1"], None, workers=2, max_pending=0)
+    threads = [threading.Thread(target=slow.verify, args=("buyer1", "soweto311")) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.1)
+    try:
+        slow.verify("buyer1", "soweto311")
+        assert False, "expected LoginBusy"
+    except LoginBusy:
+        pass
+    gate.set()
+    for thread in threads:
+        thread.join()
+    assert slow.verify("buyer1", "soweto311")
+    print("✅ Logins verified off-thread with bounded concurrency")
+
+def test_sessions():
+    """Tokens round-trip, reject tampering, expire and can be revoked"""
+    print("\n🎫 Testing session tokens...")
+    sessions = SessionManager("secret", ttl=60)
+    token = sessions.issue("buyer1")
+    assert sessions.verify(token) == "buyer1"
+
+    # A fresh manager with the same secret (another node, or after a restart) accepts it too
+    other = SessionManager("secret")
+    assert other.verify(token) == "buyer1" and len(other) == 1
+    assert SessionManager("different").verify(token) is None
+
+    encoded, signature = token.split(".")
+    assert sessions.verify(encoded + "." + signature[::-1]) is None
+    assert sessions.verify("garbage") is None and sessions.verify(None) is None
+
+    sessions.revoke(token)
+    assert sessions.verify(token) is None
+
+    expired = SessionManager("secret", ttl=-1).issue("buyer1")
+    assert SessionManager("secret").verify(expired) is None
+    # Correctly signed but valid for longer than any token this manager issues
+    assert SessionManager("secret", ttl=120).verify(SessionManager("secret", ttl=10 ** 9).issue("seller1")) is None
+    print("✅ Session tokens behave")
+
+def test_session_secret():
+    """Without FLASK_SECRET_KEY, tokens are signed with a generated, persisted secret"""
+    print("\n🔑 Testing session secret...")
+    import auth
+    original_env, original_file = os.environ.get("FLASK_SECRET_KEY"), auth.SESSION_KEY_FILE
+    auth.SESSION_KEY_FILE = os.path.join(tempfile.mkdtemp(), "session.key")
+    try:
+        for value in (None, auth.PUBLIC_DEFAULT_SECRET):
+            if value is None:
+                os.environ.pop("FLASK_SECRET_KEY", None)
+            else:
+                os.environ["FLASK_SECRET_KEY"] = value
+            secret = auth.session_secret()
+            assert secret != auth.PUBLIC_DEFAULT_SECRET.encode() and len(secret) >= 32
+            assert auth.session_secret() == secret, "the generated secret must survive restarts"
+        os.environ["FLASK_SECRET_KEY"] = "configured"
+        assert auth.session_secret() == "configured"
+    finally:
+        auth.SESSION_KEY_FILE = original_file
+        if original_env is None:
+            os.environ.pop("FLASK_SECRET_KEY", None)
+        else:
+            os.environ["FLASK_SECRET_KEY"] = original_env
+    print("✅ No public default secret")
+
+def test_routes_need_session():
+    """Routes returning a user's messages answer 401 without a valid session token"""
+    print("\n🚧 Testing route authentication...")
+    import app as app_module
+    client = app_module.create_app({"TESTING": True}).test_client()
+    batch = {"username": "buyer1", "items": [{"buyer": "buyer1", "seller": "seller1"}]}
+    assert client.post("/api/history/batch", json=batch).status_code == 401
+    assert client.post("/api/history/batch", json=batch, headers={"X-Session-Token": "forged"}).status_code == 401
+    assert client.get("/api/bootstrap").status_code == 401
+    assert client.get("/api/bootstrap/buyer1").status_code == 404
+    print("✅ Anonymous requests refused")
+
+def main():
+    """Run all auth tests"""
+    print("🚀 Running Auth Tests\n")
+    test_hashing()
+    test_authenticator()
+    test_sessions()
+    test_session_secret()
+    test_routes_need_session()
+    print("\n🎉 All auth tests passed!")
+
+if __name__ == "__main__":
+    main()
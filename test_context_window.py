@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""
+Test script for the in-memory AI context window store
+"""
+
+from context_window import ContextWindowStore
+
+def make_loader(rows, calls):
+    def loader(buyer_username, seller_username, limit):
+        calls.append((buyer_username, seller_username))
+        return [dict(row) for row in rows[-limit:]]
+    return loader
+
+def test_single_load_then_appends():
+    """A window is loaded once and then kept current by appends"""
+    print("🧠 Testing context window loading...")
+    calls = []
+    rows = [{"id": i, "sender": "buyer1", "message": f"m{i}"} for i in range(1, 4)]
+    store = ContextWindowStore(make_loader(rows, calls), window_size=3)
+
+    assert [m["id"] for m in store.get("buyer1", "seller1")] == [1, 2, 3]
+    assert store.append("buyer1", "seller1", {"id": 4, "sender": "seller1", "message": "m4"})
+    assert [m["id"] for m in store.get("buyer1", "seller1")] == [2, 3, 4]
+    assert calls == [("buyer1", "seller1")]
+    assert store.hits == 1 and store.misses == 1
+    print("✅ Steady-state reads skip the database")
+
+def test_append_to_uncached_window():
+    """Appends to uncached windows are dropped; the next load picks them up"""
+    print("\n📭 Testing appends to uncached windows...")
+    calls = []
+    store = ContextWindowStore(make_loader([], calls), window_size=3)
+    assert not store.append("buyer2", "seller2", {"id": 1, "message": "hi"})
+    assert len(store) == 0
+    print("✅ Uncached windows are not created by appends")
+
+def test_global_bound():
+    """The least recently used conversation is evicted past the global bound"""
+    print("\n📏 Testing global bound...")
+    calls = []
+    store = ContextWindowStore(make_loader([], calls), window_size=3, max_conversations=2)
+    store.get("buyer1", "seller1")
+    store.get("buyer2", "seller1")
+    store.get("buyer1", "seller1")
+    store.get("buyer3", "seller1")
+    assert len(store) == 2
+    assert not store.append("buyer2", "seller1", {"id": 1, "message": "evicted"})
+    assert store.append("buyer1", "seller1", {"id": 2, "message": "kept"})
+    print("✅ Store stays within its conversation budget")
+
+def main():
+    """Run all context window tests"""
+    print("🚀 Running Context Window Tests\n")
+    test_single_load_then_appends()
+    test_append_to_uncached_window()
+    test_global_bound()
+    print("\n🎉 All context window tests passed!")
+
+if __name__ == "__main__":
+    main()
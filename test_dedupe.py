@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+Test script for the client message ID dedupe window
+"""
+
+import threading
+import time
+from dedupe import DedupeWindow
+
+def test_retry_gets_original_id():
+    """A completed send is acknowledged again without a second insert"""
+    print("♻️ Testing completed sends...")
+    window = DedupeWindow(ttl=60)
+    owner, _ = window.claim(("buyer1", "c1"))
+    assert owner
+    window.complete(("buyer1", "c1"), 42)
+
+    owner, pending = window.claim(("buyer1", "c1"))
+    assert not owner and window.wait(pending, timeout=0) == 42
+    owner, _ = window.claim(("buyer2", "c1"))
+    assert owner
+    print("✅ Retries reuse the stored message ID")
+
+def test_concurrent_retry_waits():
+    """A retry racing the original send waits for its result"""
+    print("\n⏳ Testing in-flight retries...")
+    window = DedupeWindow(ttl=60)
+    window.claim(("buyer1", "c2"))
+    results = []
+
+    def retry():
+        owner, pending = window.claim(("buyer1", "c2"))
+        results.append((owner, window.wait(pending, timeout=2)))
+
+    thread = threading.Thread(target=retry)
+    thread.start()
+    time.sleep(0.05)
+    window.complete(("buyer1", "c2"), 7)
+    thread.join()
+    assert results == [(False, 7)]
+    print("✅ Retry acked with the original ID")
+
+def test_failed_send_and_expiry():
+    """Failed sends are released and entries expire after the TTL"""
+    print("\n🧹 Testing release and expiry...")
+    window = DedupeWindow(ttl=0.05)
+    window.claim(("buyer1", "c3"))
+    window.release(("buyer1", "c3"))
+    owner, _ = window.claim(("buyer1", "c3"))
+    assert owner
+
+    window.complete(("buyer1", "c3"), 9)
+    time.sleep(0.1)
+    owner, _ = window.claim(("buyer1", "c3"))
+    assert owner
+
+    bounded = DedupeWindow(ttl=60, max_entries=2)
+    for i in range(5):
+        bounded.claim(("buyer1", f"x{i}"))
+    assert len(bounded) == 2
+    print("✅ Window stays small and retries after failures proceed")
+
+def main():
+    """Run all dedupe tests"""
+    print("🚀 Running Dedupe Window Tests\n")
+    test_retry_gets_original_id()
+    test_concurrent_retry_waits()
+    test_failed_send_and_expiry()
+    print("\n🎉 All dedupe tests passed!")
+
+if __name__ == "__main__":
+    main()
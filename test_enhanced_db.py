@@ -3,10 +3,17 @@
 Test script for enhanced database functionality including message history and persistence
 """
 
+import datetime
 import psycopg2
+import database
+from db_pool import ConnectionPool, PoolTimeout
+from sketches import DDSketch
 from encryption import encrypt_message, decrypt_message
-from database import (get_connection, get_user_id, save_message, get_message_history, 
-                     get_recent_conversations, search_messages, get_message_statistics, delete_message)
+from database import (get_connection, get_user_id, save_message, get_message_history, get_messages_since,
+                     get_recent_conversations, search_messages, get_message_statistics, delete_message,
+                     get_inbox, mark_conversation_read, get_bootstrap, get_history_batch,
+                     execute_prepared, STATEMENTS, save_attachment, get_attachment, save_message_once,
+                     merge_response_sketches, get_response_sketches)
 
 def test_enhanced_message_operations():
     """Test enhanced message operations with persistence"""
@@ -120,24 +127,24 @@ def test_encryption_persistence():
     try:
         # Save an encrypted message
         original_message = "This is a secret test message with special chars: !@#$%^&*()"
-        message_id = save_message("buyer3", "seller3", original_message)
+        message_id = save_message("buyer3", "seller3", encrypt_message(original_message))
         
         # Check database directly to verify encryption
         conn = get_connection()
         cur = conn.cursor()
         cur.execute("""
-            SELECT encrypted_content FROM messages WHERE id = %s
+            SELECT ciphertext FROM messages WHERE id = %s
         """, (message_id,))
         result = cur.fetchone()
         cur.close()
         conn.close()
         
         if result:
-            encrypted_content = result[0]
-            print(f"✅ Message stored as encrypted: {encrypted_content[:50]}...")
+            encrypted_content = bytes(result[0])
+            print(f"✅ Message stored as encrypted: {encrypted_content[:50].hex()}...")
             
             # Verify it's not plain text
-            if original_message not in encrypted_content:
+            if original_message.encode() not in encrypted_content:
                 print("✅ Message is properly encrypted in database")
             else:
                 print("❌ Message not encrypted properly")
@@ -163,6 +170,245 @@ def test_encryption_persistence():
         print(f"❌ Encryption persistence error: {e}")
         return False
 
+def test_delta_sync():
+    """Test that reconnecting clients only receive messages after their last seen ID"""
+    print("\n🔁 Testing Delta Sync...")
+    
+    try:
+        first_id = save_message("buyer4", "seller4", encrypt_message("Before the disconnect"))
+        second_id = save_message("seller4", "buyer4", encrypt_message("Sent while offline"))
+        
+        snapshot = get_messages_since("buyer4", "seller4")
+        if snapshot["mode"] != "snapshot" or snapshot["latest_id"] != second_id:
+            print("❌ Snapshot does not end at the newest message")
+            return False
+        print(f"✅ Snapshot of {len(snapshot['messages'])} messages")
+        
+        delta = get_messages_since("buyer4", "seller4", last_seen_id=first_id)
+        if [m["id"] for m in delta["messages"]] != [second_id]:
+            print(f"❌ Delta returned {[m['id'] for m in delta['messages']]}")
+            return False
+        print("✅ Delta contains only the missed message")
+        
+        behind = get_messages_since("buyer4", "seller4", last_seen_id=0, limit=1)
+        if not behind["resync"] or behind["messages"]:
+            print("❌ Client far behind was not asked to refetch")
+            return False
+        print("✅ Far-behind client gets a resync signal")
+        return True
+        
+    except Exception as e:
+        print(f"❌ Delta sync error: {e}")
+        return False
+
+def test_inbox_counters():
+    """Test unread counters maintained on insert and cleared by mark_read"""
+    print("\n📥 Testing Inbox Counters...")
+    
+    try:
+        mark_conversation_read("seller5", "buyer5")
+        first_id = save_message("buyer5", "seller5", encrypt_message("Is this still available?"))
+        second_id = save_message("buyer5", "seller5", encrypt_message("I can pick it up today"))
+        
+        inbox = get_inbox("seller5")
+        conv = next((c for c in inbox["conversations"] if c["partner"] == "buyer5"), None)
+        if not conv or conv["unread"] != 2 or conv["last_message"]["id"] != second_id:
+            print(f"❌ Unexpected inbox entry: {conv}")
+            return False
+        print(f"✅ Inbox shows {conv['unread']} unread, last: '{conv['last_message']['preview']}'")
+        
+        buyer_conv = next(c for c in get_inbox("buyer5")["conversations"] if c["partner"] == "seller5")
+        if buyer_conv["unread"] != 0:
+            print("❌ Sender's own messages counted as unread")
+            return False
+        
+        if mark_conversation_read("seller5", "buyer5", last_read_id=first_id) != 1:
+            print("❌ Partial read not counted")
+            return False
+        if mark_conversation_read("seller5", "buyer5", last_read_id=second_id) != 0:
+            print("❌ mark_read did not clear the counter")
+            return False
+        print("✅ mark_read clears unread messages")
+        return True
+        
+    except Exception as e:
+        print(f"❌ Inbox counters error: {e}")
+        return False
+
+def test_session_bootstrap():
+    """Test the one-shot login payload"""
+    print("\n🚀 Testing Session Bootstrap...")
+    
+    try:
+        message_id = save_message("buyer1", "seller2", encrypt_message("Bootstrap preview"))
+        bootstrap = get_bootstrap("buyer1", preview_messages=3)
+        
+        if not bootstrap or "seller2" not in bootstrap["contacts"] or "buyer2" in bootstrap["contacts"]:
+            print(f"❌ Unexpected contacts: {bootstrap and bootstrap['contacts']}")
+            return False
+        
+        conv = next((c for c in bootstrap["conversations"] if c["partner"] == "seller2"), None)
+        if not conv or len(conv["messages"]) > 3 or conv["messages"][-1]["id"] != message_id:
+            print(f"❌ Conversation preview missing the newest message: {conv}")
+            return False
+        
+        print(f"✅ Bootstrap: {len(bootstrap['contacts'])} contacts, {len(bootstrap['conversations'])} conversations")
+        return get_bootstrap("nobody") is None
+        
+    except Exception as e:
+        print(f"❌ Session bootstrap error: {e}")
+        return False
+
+def test_history_batch():
+    """Test fetching several conversations with per-item cursors in one call"""
+    print("\n📚 Testing Batched History...")
+    
+    try:
+        first_id = save_message("seller3", "buyer4", encrypt_message("Batch one"))
+        second_id = save_message("seller3", "buyer4", encrypt_message("Batch two"))
+        save_message("buyer5", "seller3", encrypt_message("Batch other"))
+        
+        results = get_history_batch("seller3", [
+            {"buyer": "buyer4", "seller": "seller3"},
+            {"buyer": "buyer4", "seller": "seller3", "before_id": second_id},
+            {"buyer": "buyer5", "seller": "seller3"},
+            {"buyer": "buyer5", "seller": "seller1"}
+        ], limit=1)
+        
+        if len(results) != 4 or results[0]["messages"][-1]["id"] != second_id:
+            print(f"❌ Newest message missing from first page: {results[:1]}")
+            return False
+        if not results[0]["has_more"] or results[1]["messages"][0]["id"] != first_id:
+            print(f"❌ Cursor did not page backwards: {results[:2]}")
+            return False
+        if results[2]["messages"][0]["message"] != "Batch other" or results[3].get("error") != "not_found":
+            print(f"❌ Unexpected batch results: {results[2:]}")
+            return False
+        
+        print(f"✅ Batch returned {len(results)} pages in one query")
+        return True
+        
+    except Exception as e:
+        print(f"❌ Batched history error: {e}")
+        return False
+
+def test_prepared_statements():
+    """Test that hot statements are prepared once per connection and reused"""
+    print("\n⚡ Testing Prepared Statements...")
+    
+    try:
+        conn = get_connection()
+        cur = conn.cursor()
+        execute_prepared(cur, "user_by_name", ("buyer1",))
+        first = cur.fetchone()
+        execute_prepared(cur, "user_by_name", ("seller1",))
+        second = cur.fetchone()
+        cur.execute("SELECT name FROM pg_prepared_statements")
+        server_side = {row[0] for row in cur.fetchall()}
+        prepared = set(conn.prepared)
+        cur.close()
+        conn.close()
+        
+        if not first or not second or first[1] != "buyer" or second[1] != "seller":
+            print(f"❌ Unexpected lookups: {first}, {second}")
+            return False
+        if "user_by_name" not in prepared or not prepared <= server_side:
+            print(f"❌ Client and server disagree on prepared statements: {prepared} vs {server_side}")
+            return False
+        
+        # Every hot statement must at least parse and plan
+        conn = get_connection()
+        cur = conn.cursor()
+        for name in STATEMENTS:
+            if name not in conn.prepared:
+                cur.execute(f"PREPARE {name} AS {STATEMENTS[name]}")
+                conn.prepared.add(name)
+        conn.rollback()
+        cur.close()
+        conn.close()
+        
+        history = get_message_history("buyer1", "seller1", limit=2)
+        if history and len(history["messages"]) > 2:
+            print(f"❌ Prepared history ignored the limit: {history}")
+            return False
+        
+        print(f"✅ {len(STATEMENTS)} statements prepare and run with EXECUTE")
+        return True
+        
+    except Exception as e:
+        print(f"❌ Prepared statement error: {e}")
+        return False
+
+def test_attachment_references():
+    """Test that messages carry attachment metadata and only participants can see it"""
+    print("\n📎 Testing Attachment References...")
+    
+    try:
+        attachment_id = save_attachment("buyer5", "ab" * 32, 1234, "image/png", "photo.png")
+        if get_attachment(attachment_id, "seller5") is not None:
+            print("❌ Receiver sees the attachment before it was sent")
+            return False
+        if get_attachment(attachment_id, "buyer5", sent_only=True)["address"] != "ab" * 32:
+            print("❌ Uploader cannot attach their own file")
+            return False
+        
+        message_id = save_message("buyer5", "seller5", encrypt_message(""), attachment_id)
+        if get_attachment(attachment_id, "seller5") is None or get_attachment(attachment_id, "buyer4"):
+            print("❌ Attachment access does not follow the message")
+            return False
+        if get_attachment(attachment_id, "seller5", sent_only=True) is not None:
+            print("❌ Receiver may attach someone else's upload")
+            return False
+        
+        history = get_messages_since("buyer5", "seller5")
+        attached = [m for m in history["messages"] if m["id"] == message_id]
+        if not attached or attached[0]["attachment"]["filename"] != "photo.png":
+            print(f"❌ Synced message lacks its attachment: {attached}")
+            return False
+        print("✅ Attachment travels with the message reference")
+        return True
+        
+    except Exception as e:
+        print(f"❌ Attachment reference error: {e}")
+        return False
+
+def test_single_connection_pool():
+    """Test that no helper holds a pooled connection while waiting for another"""
+    print("\n🔒 Testing One-Connection Pool...")
+    
+    original = database.pool, database.router.primary
+    single = ConnectionPool(database._connect, size=1, timeout=2)
+    database.pool = database.router.primary = single
+    try:
+        # Cold caches, so every lookup needs a connection of its own
+        database._user_cache.clear()
+        database._conversation_cache.clear()
+        save_message("buyer3", "seller3", encrypt_message("One connection is enough"))
+        database._user_cache.clear()
+        database._conversation_cache.clear()
+        save_message_once("seller3", "buyer3", encrypt_message("Still enough"), "single-pool-test")
+        for call in (lambda: get_message_history("buyer3", "seller3"),
+                     lambda: get_recent_conversations("buyer3"),
+                     lambda: search_messages("buyer3", "seller3", "enough"),
+                     lambda: get_message_statistics("seller3"),
+                     lambda: merge_response_sketches({("seller3", datetime.date.today(), "human"): DDSketch()}),
+                     lambda: get_response_sketches("seller3", datetime.date.today()),
+                     lambda: save_attachment("buyer3", "cd" * 32, 10, "image/png")):
+            database._user_cache.clear()
+            call()
+        print("✅ Every helper finishes with a pool of one")
+        return True
+        
+    except PoolTimeout as e:
+        print(f"❌ Helper deadlocked on the pool: {e}")
+        return False
+    except Exception as e:
+        print(f"❌ One-connection pool error: {e}")
+        return False
+    finally:
+        database.pool, database.router.primary = original
+        single.close_all()
+
 def main():
     """Run all enhanced database tests"""
     print("🚀 Running Enhanced Database Tests\n")
@@ -170,7 +416,14 @@ def main():
     tests = [
         ("Enhanced Message Operations", test_enhanced_message_operations),
         ("Conversation Persistence", test_conversation_persistence),
-        ("Encryption Persistence", test_encryption_persistence)
+        ("Encryption Persistence", test_encryption_persistence),
+        ("Delta Sync", test_delta_sync),
+        ("Inbox Counters", test_inbox_counters),
+        ("Session Bootstrap", test_session_bootstrap),
+        ("Batched History", test_history_batch),
+        ("Prepared Statements", test_prepared_statements),
+        ("Attachment References", test_attachment_references),
+        ("One-Connection Pool", test_single_connection_pool)
     ]
     
     results = []
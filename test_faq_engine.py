@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Test script for the seller FAQ retrieval engine
+"""
+
+import json
+import os
+import tempfile
+from faq_engine import FAQEngine, FAQ_ANSWER_THRESHOLD
+
+FAQ = {
+    "seller1": [
+        {"id": "returns", "question": "What is your return policy?", "keywords": ["refund"],
+         "answer": "Returns within 30 days, {buyer}."},
+        {"id": "shipping", "question": "How long does shipping take?", "keywords": ["delivery", "ship"],
+         "answer": "2-4 business days."}
+    ],
+    "seller2": [
+        {"id": "bulk", "question": "Do you give bulk discounts?", "keywords": ["wholesale"],
+         "answer": "10% off 50+ units."}
+    ]
+}
+
+def write_faq(path, data):
+    with open(path, "w") as f:
+        json.dump(data, f)
+
+def test_direct_answer_and_hints():
+    """Confident matches are answered directly; weaker ones become prompt hints"""
+    print("📚 Testing FAQ answers...")
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "faq.json")
+        write_faq(path, FAQ)
+        engine = FAQEngine(path)
+
+        answer, hints = engine.answer("seller1", "what's the return policy??", "buyer1")
+        assert answer == "Returns within 30 days, buyer1."
+        assert engine.search("seller1", "refund")[0][0] >= FAQ_ANSWER_THRESHOLD
+
+        answer, hints = engine.answer("seller1", "can you ship to Berlin?", "buyer1")
+        assert answer is None and [h["id"] for h in hints] == ["shipping"]
+
+        assert engine.answer("seller1", "do you have red shoes", "buyer1") == (None, [])
+        assert engine.answer("seller9", "return policy?", "buyer1") == (None, [])
+    print("✅ Direct answers and hints behave")
+
+def test_incremental_rebuild():
+    """Only sellers whose entries changed are re-indexed"""
+    print("\n🔁 Testing incremental rebuild...")
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "faq.json")
+        write_faq(path, FAQ)
+        engine = FAQEngine(path)
+        seller1_index = engine._indexes["seller1"]
+        seller2_index = engine._indexes["seller2"]
+
+        changed = json.loads(json.dumps(FAQ))
+        changed["seller2"].append({"id": "stock", "question": "Is this in stock?", "keywords": [],
+                                   "answer": "Yes."})
+        write_faq(path, changed)
+        engine.load()
+        assert engine._indexes["seller1"] is seller1_index
+        assert engine._indexes["seller2"] is not seller2_index
+        assert engine.answer("seller2", "in stock?")[0] == "Yes."
+
+        os.remove(path)
+        engine.load()
+        assert engine.stats() == {}
+    print("✅ Unchanged sellers keep their index")
+
+def main():
+    """Run all FAQ engine tests"""
+    print("🚀 Running FAQ Engine Tests\n")
+    test_direct_answer_and_hints()
+    test_incremental_rebuild()
+    print("\n🎉 All FAQ engine tests passed!")
+
+if __name__ == "__main__":
+    main()
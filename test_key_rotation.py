@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Test script for versioned encryption keys and key rotation
+"""
+
+import os
+import tempfile
+from cryptography.fernet import Fernet
+from encryption import KeyRing, FLAG_ZSTD
+
+def make_keyring(tmpdir):
+    return KeyRing(os.path.join(tmpdir, "test.keyring"), os.path.join(tmpdir, "test.key"))
+
+def test_tagged_tokens():
+    """New tokens carry the primary key version"""
+    print("🔐 Testing tagged tokens...")
+    with tempfile.TemporaryDirectory() as tmpdir:
+        ring = make_keyring(tmpdir)
+        token = ring.encrypt("hello")
+        assert token[1] == 1
+        assert ring.decrypt(token) == "hello"
+        assert ring.decrypt(memoryview(token)) == "hello"
+        # Batches isolate bad rows instead of failing the whole page
+        assert ring.decrypt_many([token, None, b"\x00\x01garbage"]) == ["hello", None, None]
+    print("✅ Tokens tagged with key version")
+
+def test_legacy_tokens():
+    """Untagged tokens from the single-key era still decrypt"""
+    print("\n📜 Testing legacy tokens...")
+    with tempfile.TemporaryDirectory() as tmpdir:
+        legacy_key = Fernet.generate_key()
+        with open(os.path.join(tmpdir, "test.key"), 'wb') as f:
+            f.write(legacy_key)
+        legacy_token = Fernet(legacy_key).encrypt(b"old message").decode()
+
+        ring = make_keyring(tmpdir)
+        assert ring.decrypt(legacy_token) == "old message"
+        assert ring.decrypt("v1:" + legacy_token) == "old message"
+        assert ring.decrypt(legacy_token.encode()) == "old message"
+        # Text rows are rewritten to the binary format
+        assert ring.needs_reencryption(legacy_token)
+        converted = ring.reencrypt(legacy_token)
+        assert not ring.needs_reencryption(converted)
+        assert ring.decrypt(converted) == "old message"
+    print("✅ Legacy tokens readable as v1")
+
+def test_rotation():
+    """Old versions stay readable and re-encrypt to the new primary"""
+    print("\n🔄 Testing key rotation...")
+    with tempfile.TemporaryDirectory() as tmpdir:
+        ring = make_keyring(tmpdir)
+        old_token = ring.encrypt("before rotation")
+
+        assert ring.rotate() == 2
+        assert ring.current_version == 2
+        assert ring.decrypt(old_token) == "before rotation"
+        assert ring.needs_reencryption(old_token)
+
+        new_token = ring.reencrypt(old_token)
+        assert new_token[1] == 2
+        assert not ring.needs_reencryption(new_token)
+        assert ring.decrypt(new_token) == "before rotation"
+    print("✅ Rotation keeps old tokens readable")
+
+def test_reload_from_other_process():
+    """A second ring sees keys rotated by the first"""
+    print("\n🔁 Testing keyring reload...")
+    with tempfile.TemporaryDirectory() as tmpdir:
+        writer = make_keyring(tmpdir)
+        reader = make_keyring(tmpdir)
+        writer.rotate()
+        token = writer.encrypt("from another node")
+        # Unknown versions force a reload instead of failing
+        assert reader.decrypt(token) == "from another node"
+        assert reader.current_version == 2
+    print("✅ Rotated keys picked up on demand")
+
+def test_compression():
+    """Long messages are compressed before encryption and flagged"""
+    print("\n🗜️ Testing compression...")
+    with tempfile.TemporaryDirectory() as tmpdir:
+        ring = make_keyring(tmpdir)
+        long_message = "Brand new laptop, 16GB RAM, 512GB SSD. " * 40
+        short_message = "is this available?"
+
+        long_token = ring.encrypt(long_message)
+        assert long_token[0] & FLAG_ZSTD
+        assert len(long_token) < len(long_message)
+        assert ring.decrypt(long_token) == long_message
+
+        short_token = ring.encrypt(short_message)
+        assert not short_token[0] & FLAG_ZSTD
+        assert ring.decrypt(short_token) == short_message
+
+        ring.rotate()
+        rotated = ring.reencrypt(long_token)
+        assert rotated[0] & FLAG_ZSTD
+        assert ring.decrypt(rotated) == long_message
+    print("✅ Long messages stored compressed")
+
+def main():
+    """Run all key rotation tests"""
+    print("🚀 Running Key Rotation Tests\n")
+    test_tagged_tokens()
+    test_legacy_tokens()
+    test_rotation()
+    test_reload_from_other_process()
+    test_compression()
+    print("\n🎉 All key rotation tests passed!")
+
+if __name__ == "__main__":
+    main()
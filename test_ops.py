@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+Test script for the ops snapshot: handler timings and per-tick broadcasting
+"""
+
+import threading
+from ops import HandlerStats, OpsBroadcaster
+
+class FakeSocketIO:
+    def __init__(self):
+        self.emits = []
+        self.tasks = []
+
+    def emit(self, event, data, namespace=None):
+        self.emits.append((event, data, namespace))
+
+    def start_background_task(self, target):
+        self.tasks.append(target)
+
+    def sleep(self, seconds):
+        pass
+
+def test_handler_stats():
+    """Draining counts events and sketches their latency, then starts over"""
+    print("⏱️ Testing handler stats...")
+    stats = HandlerStats()
+    for i in range(1, 101):
+        stats.record("send_message", i / 1000)
+    stats.record("join_chat", 0.5)
+
+    elapsed, counts, latency = stats.drain()
+    assert elapsed > 0
+    assert counts == {"send_message": 100, "join_chat": 1}
+    assert latency.count == 101
+    assert abs(latency.quantile(0.5) - 51) / 51 < 0.02
+    assert latency.quantile(0.99) >= 99
+
+    _, counts, latency = stats.drain()
+    assert counts == {} and latency.count == 0
+    print("✅ Counts and percentiles drained per tick")
+
+def test_handler_stats_concurrent():
+    """Records from many threads are never lost"""
+    print("\n🧵 Testing concurrent recording...")
+    stats = HandlerStats()
+    threads = [threading.Thread(target=lambda: [stats.record("mark_read", 0.002) for _ in range(1000)])
+               for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    _, counts, _ = stats.drain()
+    assert counts == {"mark_read": 8000}
+    print("✅ 8000 records from 8 threads")
+
+def test_broadcaster():
+    """One snapshot and one emit per tick, however many subscribers"""
+    print("\n📡 Testing broadcaster...")
+    socketio = FakeSocketIO()
+    calls = []
+    broadcaster = OpsBroadcaster(socketio, lambda: calls.append(1) or {"tick": len(calls)}, interval=0)
+
+    assert broadcaster.subscribe() is None
+    for _ in range(49):
+        broadcaster.subscribe()
+    assert len(socketio.tasks) == 1, "one loop for all subscribers"
+
+    broadcaster.tick()
+    assert len(calls) == 1 and len(socketio.emits) == 1
+    assert socketio.emits[0] == ("snapshot", {"tick": 1}, "/ops")
+    assert broadcaster.subscribe() == {"tick": 1}, "new subscribers get the latest snapshot"
+
+    # The loop stops once the last subscriber leaves and restarts on the next one
+    for _ in range(51):
+        broadcaster.unsubscribe()
+    socketio.tasks[0]()
+    assert len(calls) == 1
+    broadcaster.subscribe()
+    assert len(socketio.tasks) == 2
+    print("✅ 50 subscribers, one snapshot per tick")
+
+def test_access_needs_token():
+    """The dashboard, its namespace and /api/metrics are refused unless OPS_TOKEN is set and presented"""
+    print("\n🔐 Testing ops access...")
+    import app as app_module
+    flask_app = app_module.create_app({"TESTING": True})
+    client = flask_app.test_client()
+    original = app_module.OPS_TOKEN
+    try:
+        app_module.OPS_TOKEN = None
+        assert client.get("/ops").status_code == 403
+        assert client.get("/ops?token=").status_code == 403
+        assert client.get("/api/metrics", headers={"X-Ops-Token": ""}).status_code == 403
+        subscriber = app_module.socketio.test_client(flask_app, namespace="/ops", auth={"token": ""})
+        assert not subscriber.is_connected("/ops")
+
+        app_module.OPS_TOKEN = "secret"
+        assert client.get("/ops?token=wrong").status_code == 403
+        assert client.get("/api/metrics", headers={"X-Ops-Token": "wrong"}).status_code == 403
+        assert client.get("/ops?token=secret").status_code == 200
+        assert client.get("/api/metrics", headers={"X-Ops-Token": "secret"}).status_code == 200
+        subscriber = app_module.socketio.test_client(flask_app, namespace="/ops", auth={"token": "secret"})
+        assert subscriber.is_connected("/ops")
+        subscriber.disconnect(namespace="/ops")
+    finally:
+        app_module.OPS_TOKEN = original
+    print("✅ Ops views denied without OPS_TOKEN")
+
+def main():
+    """Run all ops tests"""
+    print("🚀 Running Ops Tests\n")
+    test_handler_stats()
+    test_handler_stats_concurrent()
+    test_broadcaster()
+    test_access_needs_token()
+    print("\n🎉 All ops tests passed!")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+"""
+Test script for on-demand handler profiling
+"""
+
+import json
+import os
+import tempfile
+import threading
+import time
+from profiling import Profiler, fold
+
+def busy(seconds):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        sum(range(1000))
+
+def run_handler(profiler, label, seconds):
+    token = profiler.begin(label)
+    try:
+        busy(seconds)
+    finally:
+        if token is not None:
+            profiler.end(token)
+
+def test_disabled():
+    """An idle profiler hands out no tokens and writes nothing"""
+    print("💤 Testing disabled profiler...")
+    profiler = Profiler(directory=tempfile.mkdtemp())
+    assert not profiler.active and profiler.begin("send_message") is None
+    assert profiler.stop() is None
+    assert os.listdir(profiler.directory) == []
+    print("✅ Nothing recorded while disabled")
+
+def test_sampling():
+    """Samples are attributed to the handler and written as folded stacks"""
+    print("\n📈 Testing stack sampling...")
+    profiler = Profiler(directory=tempfile.mkdtemp(), interval=0.002)
+    session = profiler.start("sample", seconds=5)
+    assert session and profiler.start() is None, "one session at a time"
+    workers = [threading.Thread(target=run_handler, args=(profiler, label, 0.3))
+               for label in ("send_message", "web.get_history")]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    busy(0.05)  # outside any handler, never sampled
+    session = profiler.stop()
+
+    path = os.path.join(profiler.directory, session["id"])
+    assert {"all.folded", "send_message.folded", "web.get_history.folded"} <= set(session["files"])
+    assert set(session["samples"]) == {"send_message", "web.get_history"}
+    with open(os.path.join(path, "send_message.folded")) as f:
+        lines = f.read().splitlines()
+    assert lines and all(line.startswith("send_message;") for line in lines)
+    assert any("busy (test_profiling.py" in line for line in lines)
+    stack, count = lines[0].rsplit(" ", 1)
+    assert int(count) > 0
+    with open(os.path.join(path, "session.json")) as f:
+        assert json.load(f)["mode"] == "sample"
+    print(f"✅ {sum(session['samples'].values())} samples across {len(session['samples'])} handlers")
+
+def test_cprofile_one_in_n():
+    """cprofile mode profiles every Nth event and dumps pstats per handler"""
+    print("\n🧪 Testing cProfile sampling...")
+    profiler = Profiler(directory=tempfile.mkdtemp())
+    profiler.start("cprofile", seconds=5, every=3)
+    for _ in range(9):
+        run_handler(profiler, "join_chat", 0.001)
+    session = profiler.stop()
+    assert session["calls"] == {"join_chat": 3}
+    assert {"join_chat.pstats", "join_chat.txt"} <= set(session["files"])
+    import pstats
+    stats = pstats.Stats(os.path.join(profiler.directory, session["id"], "join_chat.pstats"))
+    assert any(func[2] == "busy" for func in stats.stats)
+    print("✅ 3 of 9 events profiled")
+
+def test_time_bound():
+    """Sessions end by themselves after at most max_seconds"""
+    print("\n⏲️ Testing session bound...")
+    profiler = Profiler(directory=tempfile.mkdtemp(), interval=0.01, max_seconds=0.1)
+    session = profiler.start("sample", seconds=3600)
+    assert session["seconds"] == 0.1
+    deadline = time.monotonic() + 5
+    while profiler.active and time.monotonic() < deadline:
+        time.sleep(0.02)
+    assert not profiler.active and profiler.last["id"] == session["id"]
+    assert profiler.toggle()["mode"] == "sample" and profiler.toggle()["id"]
+    print("✅ Session stopped after its bound")
+
+def test_stop_during_events():
+    """Handlers finishing after stop() neither break nor change the written profile"""
+    print("\n🏁 Testing stop with events in flight...")
+    profiler = Profiler(directory=tempfile.mkdtemp(), interval=0.001)
+    profiler.start("cprofile", seconds=5, every=1)
+    late = profiler.begin("send_message")
+    run_handler(profiler, "send_message", 0.01)
+    session = profiler.stop()
+    profiler.end(late)
+    assert session["calls"] == {"send_message": 1}
+
+    for _ in range(5):
+        profiler.start("sample", seconds=5)
+        stop = threading.Event()
+
+        def handler_loop():
+            while not stop.is_set():
+                run_handler(profiler, "join_chat", 0.002)
+        workers = [threading.Thread(target=handler_loop) for _ in range(4)]
+        for worker in workers:
+            worker.start()
+        time.sleep(0.05)
+        session = profiler.stop()
+        stop.set()
+        for worker in workers:
+            worker.join()
+        assert "error" not in session and "session.json" in session["files"]
+    print("✅ Written profiles are not touched by late events")
+
+def test_fold():
+    """Folded stacks run from the handler label down to the innermost frame"""
+    print("\n🪵 Testing stack folding...")
+    import sys
+    def inner():
+        return fold(sys._getframe(), "mark_read")
+    stack = inner()
+    frames = stack.split(";")
+    assert frames[0] == "mark_read" and frames[-1].startswith("inner (test_profiling.py:")
+    print("✅ Stack folded")
+
+def test_admin_endpoint():
+    """Only OPS_TOKEN holders can start and stop sessions over HTTP"""
+    print("\n🔐 Testing admin endpoint...")
+    import app as app_module
+    client = app_module.create_app({"TESTING": True}).test_client()
+    app_module.profiler.directory = tempfile.mkdtemp()
+    original = app_module.OPS_TOKEN
+    try:
+        app_module.OPS_TOKEN = None
+        assert client.post("/api/admin/profile", headers={"X-Ops-Token": ""}).status_code == 403
+        app_module.OPS_TOKEN = "secret"
+        assert client.post("/api/admin/profile", headers={"X-Ops-Token": "wrong"}).status_code == 403
+        
+        headers = {"X-Ops-Token": "secret"}
+        assert client.post("/api/admin/profile", json={"mode": "flame"}, headers=headers).status_code == 400
+        started = client.post("/api/admin/profile", json={"seconds": 5}, headers=headers)
+        assert started.status_code == 200 and started.get_json()["started"]["mode"] == "sample"
+        assert client.post("/api/admin/profile", headers=headers).status_code == 409
+        client.get("/readyz")  # a profiled request
+        stopped = client.post("/api/admin/profile", json={"action": "stop"}, headers=headers)
+        assert stopped.status_code == 200 and "session.json" in stopped.get_json()["stopped"]["files"]
+        assert client.get("/api/admin/profile", headers=headers).get_json()["active"] is False
+    finally:
+        app_module.OPS_TOKEN = original
+        app_module.profiler.stop()
+    print("✅ Endpoint guarded by OPS_TOKEN")
+
+def main():
+    """Run all profiling tests"""
+    print("🚀 Running Profiling Tests\n")
+    test_disabled()
+    test_sampling()
+    test_cprofile_one_in_n()
+    test_time_bound()
+    test_stop_during_events()
+    test_fold()
+    test_admin_endpoint()
+    print("\n🎉 All profiling tests passed!")
+
+if __name__ == "__main__":
+    main()
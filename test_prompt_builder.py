@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Test script for the token-budgeted prompt builder
+"""
+
+from prompt_builder import PromptBuilder, RollingSummary, estimate_tokens, truncate_tokens
+
+SELLER_INFO = {"name": "TechPro", "personality": "You are a polite seller.", "style": "professional"}
+
+def make_history(pairs):
+    return [{"id": i, "sender": sender, "message": text} for i, (sender, text) in enumerate(pairs, 1)]
+
+def test_estimates_and_truncation():
+    """Token estimates grow with text and truncation respects the limit"""
+    print("🔢 Testing token estimates...")
+    assert estimate_tokens("") == 0
+    assert estimate_tokens("hello, world!") == 4
+    long_text = "spec " * 500
+    cut = truncate_tokens(long_text, 50)
+    assert estimate_tokens(cut) <= 52 and cut.endswith("…")
+    assert truncate_tokens("short", 50) == "short"
+    print("✅ Estimates and truncation behave")
+
+def test_budget_with_pasted_listing():
+    """A pasted listing cannot push the prompt past its budget"""
+    print("\n📏 Testing prompt budget...")
+    builder = PromptBuilder(budget=300, summary_budget=60, max_turn_tokens=60)
+    history = make_history([
+        ("buyer1", "Do you have laptops?"),
+        ("seller1", "Yes, several."),
+        ("buyer1", "Listing: " + "16GB RAM, 512GB SSD, OLED display. " * 200),
+        ("seller1", "That one is $1,450."),
+        ("buyer1", "Any discount?")
+    ])
+    messages, stats = builder.build(SELLER_INFO, "buyer1", "seller1", history, "Any discount?")
+    assert stats["prompt_tokens"] <= 300
+    assert "Any discount?" not in messages[0]["content"]
+    assert messages[1]["content"] == "Any discount?"
+    print(f"✅ Prompt held to {stats['prompt_tokens']} tokens")
+
+def test_rolling_summary():
+    """Turns that scroll out of the prompt survive in the summary"""
+    print("\n🧾 Testing rolling summary...")
+    builder = PromptBuilder(budget=260, summary_budget=80, max_turns=2)
+    pairs = [
+        ("buyer1", "My budget is $900 and I need 16GB RAM."),
+        ("seller1", "Noted."),
+        ("buyer1", "ok"),
+        ("seller1", "Anything else?"),
+        ("buyer1", "Can you ship to Berlin?")
+    ]
+    history = []
+    for i, (sender, text) in enumerate(pairs, 1):
+        history.append({"id": i, "sender": sender, "message": text})
+        if sender == "buyer1":
+            messages, stats = builder.build(SELLER_INFO, "buyer1", "seller1", history, text)
+    system_prompt = messages[0]["content"]
+    assert "$900" in system_prompt and "16GB" in system_prompt
+    assert stats["turns"] == 2 and stats["summary_tokens"] > 0
+
+    summary = RollingSummary(budget=20)
+    summary.absorb(make_history([("buyer1", "hi"), ("buyer1", "I want 3 red chairs for $200.")]))
+    assert "$200" in summary.render()
+    summary.absorb(make_history([("buyer1", "hi")]))
+    assert summary.last_id == 2
+    print("✅ Summary keeps the salient facts")
+
+def main():
+    """Run all prompt builder tests"""
+    print("🚀 Running Prompt Builder Tests\n")
+    test_estimates_and_truncation()
+    test_budget_with_pasted_listing()
+    test_rolling_summary()
+    print("\n🎉 All prompt builder tests passed!")
+
+if __name__ == "__main__":
+    main()
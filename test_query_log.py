@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Test script for query fingerprints, the slow-query log and query budgets
+"""
+
+import threading
+from query_log import QueryLog, fingerprint, helper, assert_max_queries, _caller
+
+def test_fingerprint():
+    """Literals, placeholders and IN lists collapse so repeated statements group together"""
+    print("🔎 Testing fingerprints...")
+    assert fingerprint("SELECT id FROM users WHERE username = %s") == "SELECT id FROM users WHERE username = ?"
+    assert fingerprint("SELECT *  FROM t\n WHERE a = 'x''y' AND b = 42 AND c IN (1, 2, 3)") == \
+        "SELECT * FROM t WHERE a = ? AND b = ? AND c IN (...)"
+    assert fingerprint(b"EXECUTE user_by_name ('buyer1')") == "EXECUTE user_by_name (?)"
+    assert fingerprint("SELECT * FROM messages_2024_01 WHERE id = $1") == "SELECT * FROM messages_2024_01 WHERE id = ?"
+    print("✅ Fingerprints normalized")
+
+def test_caller():
+    """Queries are attributed to the code that issued them, skipping helpers"""
+    print("\n📍 Testing caller attribution...")
+    def execute():
+        return _caller()
+
+    @helper
+    def run_prepared():
+        return execute()
+
+    def save_message():
+        return run_prepared()
+
+    caller = save_message()
+    assert caller.startswith("test_query_log.py:save_message <- test_query_log.py:test_caller"), caller
+    print(f"✅ Attributed to {caller}")
+
+def test_capture_and_stats():
+    """Captures only see their own thread; stats aggregate per fingerprint"""
+    print("\n📊 Testing capture and stats...")
+    log = QueryLog(slow_ms=0, max_fingerprints=2)
+    with log.capture() as scope:
+        log.connection_acquired()
+        log.record("SELECT 1 FROM users WHERE id = %s", 0.002, 1, "a")
+        log.record("SELECT 1 FROM users WHERE id = %s", 0.004, 1, "a")
+        other = threading.Thread(target=log.record, args=("SELECT 2", 0.001, 1, "b"))
+        other.start()
+        other.join()
+    log.record("SELECT 3", 0.001, 1, "c")
+
+    assert len(scope) == 2 and scope.connections == 1
+    stats = log.stats()
+    assert stats["fingerprints"] == 2, "new fingerprints beyond the limit are not aggregated"
+    top = stats["top"][0]
+    assert top["fingerprint"] == "SELECT ? FROM users WHERE id = ?" and top["count"] == 2
+    assert top["total_ms"] == 6.0 and top["max_ms"] == 4.0
+    assert stats["slow"] == []
+    print("✅ Captured 2 of 4 queries, aggregated 2 fingerprints")
+
+def test_slow_log():
+    """Slow statements are logged with their plan when explain is on"""
+    print("\n🐢 Testing slow-query log...")
+    log = QueryLog(slow_ms=100, explain=True, slow_log_size=2)
+    explained = []
+    explain = lambda: explained.append(1) or "Seq Scan on messages"
+    log.record("SELECT fast", 0.01, 1, "a", explain)
+    log.record("SELECT slow", 0.25, 1, "b", explain)
+    assert explained == [1], "only slow statements are explained"
+    assert log.slow[-1]["plan"] == "Seq Scan on messages" and log.slow[-1]["caller"] == "b"
+
+    quiet = QueryLog(slow_ms=100, explain=False)
+    quiet.record("SELECT slow", 0.25, 1, "b", explain)
+    assert explained == [1] and "plan" not in quiet.slow[-1]
+    print("✅ Slow queries logged, plans captured on demand")
+
+def test_assert_max_queries():
+    """Budgets fail with the offending statements listed"""
+    print("\n🧮 Testing query budgets...")
+    log = QueryLog(slow_ms=0)
+    with assert_max_queries(2, max_connections=1, log=log):
+        log.connection_acquired()
+        log.record("SELECT 1", 0.001, 1, "a")
+
+    try:
+        with assert_max_queries(2, log=log):
+            for user_id in range(3):
+                log.record(f"SELECT * FROM users WHERE id = {user_id}", 0.001, 1, "app.py:inbox")
+        raise RuntimeError("budget not enforced")
+    except AssertionError as e:
+        assert "3x app.py:inbox: SELECT * FROM users WHERE id = ?" in str(e), str(e)
+
+    try:
+        with assert_max_queries(5, max_connections=1, log=log):
+            log.connection_acquired()
+            log.connection_acquired()
+        raise RuntimeError("connection budget not enforced")
+    except AssertionError as e:
+        assert "2 connections" in str(e)
+    print("✅ N+1 patterns fail the budget")
+
+def main():
+    """Run all query log tests"""
+    print("🚀 Running Query Log Tests\n")
+    test_fingerprint()
+    test_caller()
+    test_capture_and_stats()
+    test_slow_log()
+    test_assert_max_queries()
+    print("\n🎉 All query log tests passed!")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Test script for read-replica routing, health checks and read-your-writes
+"""
+
+import threading
+import time
+import psycopg2
+from replication import ReadRouter, parse_hosts
+
+class FakePool:
+    def __init__(self, name, fail=False):
+        self.name = name
+        self.fail = fail
+        self.acquired = 0
+
+    def acquire(self):
+        if self.fail:
+            raise psycopg2.OperationalError(f"{self.name} is down")
+        self.acquired += 1
+        return self.name
+
+def test_parse_hosts():
+    """Replica specs accept an optional port"""
+    print("🧾 Testing replica host parsing...")
+    assert parse_hosts("") == []
+    assert parse_hosts("db-r1, db-r2:5433,") == [("db-r1", None), ("db-r2", 5433)]
+    print("✅ Hosts parsed")
+
+def test_round_robin():
+    """Reads alternate over replicas; without replicas they use the primary"""
+    print("\n🔁 Testing round robin...")
+    primary, r1, r2 = FakePool("primary"), FakePool("r1"), FakePool("r2")
+    router = ReadRouter(primary, [r1, r2], check=lambda pool: 0.0, check_interval=60)
+    router.check_replicas()
+    assert [router.acquire_read() for _ in range(4)] == ["r1", "r2", "r1", "r2"]
+    assert ReadRouter(primary).acquire_read("buyer1") == "primary"
+    print("✅ Reads spread over replicas")
+
+def test_read_your_writes():
+    """A writer's reads go to the primary until the window passes"""
+    print("\n✍️ Testing read-your-writes...")
+    primary, replica = FakePool("primary"), FakePool("replica")
+    router = ReadRouter(primary, [replica], window=0.2, check=lambda pool: 0.0, check_interval=60)
+    router.check_replicas()
+    router.note_write("buyer1")
+    assert router.acquire_read("buyer1", "seller1") == "primary"
+    assert router.acquire_read("seller1") == "replica", "other users are unaffected"
+    time.sleep(0.25)
+    assert router.acquire_read("buyer1") == "replica"
+    print("✅ Writer pinned to the primary for the window")
+
+def test_health_checks():
+    """Lagging or unreachable replicas are skipped until their next check passes"""
+    print("\n🩺 Testing health checks...")
+    primary, slow, fast = FakePool("primary"), FakePool("slow"), FakePool("fast")
+    lags = {"slow": 10.0, "fast": 0.1}
+    checks = []
+    router = ReadRouter(primary, [slow, fast], check=lambda pool: checks.append(pool.name) or lags[pool.name],
+                        check_interval=60, max_lag=2)
+    router.check_replicas()
+    assert [router.acquire_read() for _ in range(3)] == ["fast", "fast", "fast"]
+    assert checks == ["slow", "fast"], "reads do not check again within the interval"
+    assert router.stats()["replicas"][0] == {"healthy": False, "lag": 10.0}
+
+    down = FakePool("down", fail=True)
+    router = ReadRouter(primary, [down], check=lambda pool: 0.0, check_interval=60)
+    router.check_replicas()
+    assert router.acquire_read() == "primary"
+    assert router.reader() is primary, "a failed acquire marks the replica down"
+
+    router = ReadRouter(primary, [FakePool("broken")], check=lambda pool: 1 / 0, check_interval=60)
+    router.check_replicas()
+    assert router.acquire_read() == "primary"
+    print("✅ Unhealthy replicas fall back to the primary")
+
+def test_checks_off_request_path():
+    """A hanging health check never delays reads; they use the primary until it passes"""
+    print("\n🧵 Testing background health checks...")
+    primary, replica = FakePool("primary"), FakePool("replica")
+    gate = threading.Event()
+    router = ReadRouter(primary, [replica], check=lambda pool: gate.wait(2) and 0.0, check_interval=60)
+    started = time.monotonic()
+    assert router.acquire_read() == "primary"
+    assert time.monotonic() - started < 0.5, "the read waited for the check"
+    gate.set()
+    deadline = time.monotonic() + 2
+    while not router.stats()["replicas"][0]["healthy"] and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert router.acquire_read() == "replica"
+    print("✅ Checks run in the background")
+
+def main():
+    """Run all replication tests"""
+    print("🚀 Running Replication Tests\n")
+    test_parse_hosts()
+    test_round_robin()
+    test_read_your_writes()
+    test_health_checks()
+    test_checks_off_request_path()
+    print("\n🎉 All replication tests passed!")
+
+if __name__ == "__main__":
+    main()
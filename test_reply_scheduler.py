@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Test script for debounced AI reply scheduling
+"""
+
+import threading
+import time
+from reply_scheduler import ReplyScheduler
+
+def make_scheduler(debounce=0.1, max_wait=5, gate=None):
+    calls = []
+    delivered = []
+    done = threading.Event()
+
+    def generate(message, seller_username, buyer_username):
+        calls.append(message)
+        if gate is not None and len(calls) == 1:
+            gate.wait(2)
+        return f"reply to {message!r}"
+
+    def deliver(buyer_username, seller_username, reply):
+        delivered.append((buyer_username, seller_username, reply))
+        done.set()
+
+    scheduler = ReplyScheduler(generate, deliver, debounce=debounce, max_wait=max_wait)
+    return scheduler, calls, delivered, done
+
+def test_burst_is_coalesced():
+    """Messages inside the debounce window produce one combined reply"""
+    print("⏱️ Testing burst coalescing...")
+    scheduler, calls, delivered, done = make_scheduler()
+    for text in ("hi", "is this available?", "what's the price?"):
+        scheduler.submit("buyer1", "seller1", text)
+    assert done.wait(2)
+    time.sleep(0.2)
+    assert calls == ["hi\nis this available?\nwhat's the price?"]
+    assert len(delivered) == 1 and delivered[0][:2] == ("buyer1", "seller1")
+    assert scheduler.depth() == {"pending_conversations": 0, "in_flight": 0}
+    assert scheduler.queue_depth() == 0
+    print("✅ Three messages, one AI call")
+
+def test_in_flight_reply_superseded():
+    """A buyer message during generation drops the stale reply"""
+    print("\n⏭️ Testing superseded generations...")
+    gate = threading.Event()
+    scheduler, calls, delivered, done = make_scheduler(debounce=0.05, gate=gate)
+    scheduler.submit("buyer1", "seller1", "first")
+    time.sleep(0.2)
+    assert calls == ["first"]
+    scheduler.submit("buyer1", "seller1", "second")
+    time.sleep(0.2)
+    gate.set()
+    assert done.wait(2)
+    time.sleep(0.2)
+    assert calls == ["first", "first\nsecond"]
+    assert [r[2] for r in delivered] == ["reply to 'first\\nsecond'"]
+    print("✅ Only the newest reply is delivered")
+
+def test_max_wait_caps_delay():
+    """A buyer who keeps typing still gets a reply after max_wait"""
+    print("\n⌛ Testing max wait...")
+    scheduler, calls, delivered, done = make_scheduler(debounce=0.3, max_wait=0.5)
+    started = time.monotonic()
+    for i in range(6):
+        scheduler.submit("buyer1", "seller1", f"m{i}")
+        time.sleep(0.15)
+    assert done.wait(2)
+    assert time.monotonic() - started < 1.2
+    assert len(calls) >= 1
+    print("✅ Debounce is bounded")
+
+def test_debounce_after_max_wait():
+    """Once a batch is answered the wait restarts, so later bursts coalesce again"""
+    print("\n🔁 Testing debounce after max wait...")
+    scheduler, calls, delivered, done = make_scheduler(debounce=0.1, max_wait=0.2)
+    for i in range(4):
+        scheduler.submit("buyer1", "seller1", f"m{i}")
+        time.sleep(0.08)
+    time.sleep(0.3)
+    answered = len(calls)
+    for text in ("later", "burst"):
+        scheduler.submit("buyer1", "seller1", text)
+    time.sleep(0.3)
+    assert calls[answered:] == ["later\nburst"], calls
+    print("✅ Later burst is one AI call")
+
+def test_fast_typer_is_answered():
+    """A buyer typing faster than the model still gets replies, one generation at a time"""
+    print("\n🏃 Testing fast typer...")
+    running = []
+    overlapped = []
+    delivered = []
+
+    def generate(message, seller_username, buyer_username):
+        running.append(message)
+        if len(running) > 1:
+            overlapped.append(message)
+        time.sleep(0.15)
+        running.remove(message)
+        return f"reply to {message!r}"
+
+    def deliver(buyer_username, seller_username, reply):
+        delivered.append(reply)
+
+    scheduler = ReplyScheduler(generate, deliver, debounce=0.05, max_wait=0.3)
+    for i in range(20):
+        scheduler.submit("buyer1", "seller1", f"m{i}")
+        time.sleep(0.05)
+    typed_for = len(delivered)
+    time.sleep(0.5)
+    assert typed_for >= 1, "no reply while the buyer kept typing"
+    assert not overlapped, "two generations ran for one conversation"
+    assert delivered and "m19" in delivered[-1]
+    assert scheduler.depth() == {"pending_conversations": 0, "in_flight": 0}
+    print(f"✅ {typed_for} replies during a one second burst, none concurrent")
+
+def main():
+    """Run all reply scheduler tests"""
+    print("🚀 Running Reply Scheduler Tests\n")
+    test_burst_is_coalesced()
+    test_in_flight_reply_superseded()
+    test_max_wait_caps_delay()
+    test_debounce_after_max_wait()
+    test_fast_typer_is_answered()
+    print("\n🎉 All reply scheduler tests passed!")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Test script for the AI seller reply cache
+"""
+
+import time
+import metrics
+from response_cache import ResponseCache, normalize_question, context_fingerprint
+
+def test_normalization():
+    """Punctuation, case and spacing do not change the key"""
+    print("🔤 Testing question normalization...")
+    assert normalize_question("Is this   AVAILABLE??") == "is this available"
+    assert normalize_question(" price? ") == normalize_question("Price!")
+    print("✅ Questions normalized")
+
+def test_hit_personalized_per_buyer():
+    """Cached replies are re-addressed to the asking buyer"""
+    print("\n⚡ Testing cache hits...")
+    cache = ResponseCache(ttl=60, max_entries=10, max_bytes=10000, opt_out=[], enabled=True)
+    assert cache.get("seller1", "Is this available?", "buyer1") is None
+    cache.put("seller1", "Is this available?", "Yes buyer1, it is in stock!", 1.5, "buyer1")
+
+    saved_before = metrics.get_counter("ai_cache_latency_saved_ms")
+    assert cache.get("seller1", "is this available", "buyer2") == "Yes buyer2, it is in stock!"
+    assert metrics.get_counter("ai_cache_latency_saved_ms") - saved_before == 1500
+    # Another seller's persona never shares replies
+    assert cache.get("seller2", "is this available", "buyer2") is None
+    print("✅ Hits personalized and counted")
+
+def test_name_is_whole_word():
+    """Only the buyer's name as a word is replaced, not names or words containing it"""
+    print("\n🔠 Testing buyer name replacement...")
+    cache = ResponseCache(ttl=60, max_entries=10, max_bytes=10000, opt_out=[], enabled=True)
+    cache.put("seller1", "price?", "Hi buyer1, the price for buyer10 is the same.", 1.0, "buyer1")
+    assert cache.get("seller1", "price?", "al") == "Hi al, the price for buyer10 is the same."
+    cache.put("seller1", "total?", "Hi al, the total is final.", 1.0, "al")
+    assert cache.get("seller1", "total?", "buyer2") == "Hi buyer2, the total is final."
+    print("✅ Prefixes and words left alone")
+
+def test_ttl_lru_and_budget():
+    """Entries expire, and the least recently used go first when over budget"""
+    print("\n⏳ Testing expiry and eviction...")
+    cache = ResponseCache(ttl=0.05, max_entries=2, max_bytes=10000, opt_out=[], enabled=True)
+    cache.put("seller1", "price?", "100", 1.0)
+    time.sleep(0.06)
+    assert cache.get("seller1", "price?") is None
+
+    cache = ResponseCache(ttl=60, max_entries=2, max_bytes=10000, opt_out=[], enabled=True)
+    cache.put("seller1", "a", "1", 1.0)
+    cache.put("seller1", "b", "2", 1.0)
+    cache.get("seller1", "a")
+    cache.put("seller1", "c", "3", 1.0)
+    assert cache.get("seller1", "a") == "1"
+    assert cache.get("seller1", "b") is None
+
+    cache = ResponseCache(ttl=60, max_entries=100, max_bytes=40, opt_out=[], enabled=True)
+    cache.put("seller1", "q1", "x" * 20, 1.0)
+    cache.put("seller1", "q2", "y" * 20, 1.0)
+    assert cache.stats()["bytes"] <= 40
+    assert cache.get("seller1", "q1") is None
+    print("✅ TTL, LRU and byte budget enforced")
+
+def test_opt_out_and_fingerprint():
+    """Opted-out sellers are never cached; context fingerprints split keys"""
+    print("\n🚫 Testing opt-out and context fingerprints...")
+    cache = ResponseCache(ttl=60, max_entries=10, max_bytes=10000, opt_out=["seller3"], enabled=True)
+    cache.put("seller3", "price?", "50", 1.0)
+    assert cache.get("seller3", "price?") is None
+
+    history = [{"message": "I want the red one"}]
+    fingerprint = context_fingerprint(history, messages=1)
+    cache.put("seller1", "price?", "50", 1.0, fingerprint=fingerprint)
+    assert cache.get("seller1", "price?", fingerprint=fingerprint) == "50"
+    assert cache.get("seller1", "price?", fingerprint="") is None
+    print("✅ Opt-out and fingerprints respected")
+
+def main():
+    """Run all response cache tests"""
+    print("🚀 Running Response Cache Tests\n")
+    test_normalization()
+    test_hit_personalized_per_buyer()
+    test_name_is_whole_word()
+    test_ttl_lru_and_budget()
+    test_opt_out_and_fingerprint()
+    print("\n🎉 All response cache tests passed!")
+
+if __name__ == "__main__":
+    main()
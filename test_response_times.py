@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Test script for DDSketch and seller response-time tracking
+"""
+
+import random
+import time
+from datetime import timedelta
+from sketches import DDSketch
+from response_times import ResponseTimeTracker, utc_day
+
+def exact_quantile(values, q):
+    ordered = sorted(values)
+    return ordered[int(q * (len(ordered) - 1))]
+
+def test_sketch_accuracy_and_merge():
+    """Quantiles stay within the relative accuracy, merged or not"""
+    print("📐 Testing DDSketch accuracy...")
+    rng = random.Random(7)
+    values = [rng.lognormvariate(1.5, 1.2) for _ in range(20000)] + [0.0] * 50
+    whole = DDSketch()
+    parts = [DDSketch() for _ in range(4)]
+    for i, value in enumerate(values):
+        whole.add(value)
+        parts[i % 4].add(value)
+    merged = DDSketch()
+    for part in parts:
+        merged.merge(part)
+
+    for q in (0.5, 0.9, 0.99):
+        exact = exact_quantile(values, q)
+        assert abs(whole.quantile(q) - exact) <= 0.011 * exact, (q, whole.quantile(q), exact)
+        assert merged.quantile(q) == whole.quantile(q)
+    assert merged.count == len(values) and whole.quantile(0) == 0.0
+    assert DDSketch().quantile(0.5) is None
+    print(f"✅ p99 {whole.quantile(0.99):.2f}s vs exact {exact_quantile(values, 0.99):.2f}s")
+
+def test_sketch_serialization():
+    """Sketches round-trip through a compact binary form"""
+    print("\n💾 Testing sketch serialization...")
+    sketch = DDSketch()
+    for value in (0.0005, 0.2, 1.5, 3.0, 45.0, 3600.0, 86400.0 * 3):
+        sketch.add(value)
+    data = sketch.to_bytes()
+    restored = DDSketch.from_bytes(data)
+    assert restored.bins == sketch.bins and restored.count == sketch.count
+    assert restored.quantile(0.5) == sketch.quantile(0.5) and restored.max == sketch.max
+
+    big = DDSketch()
+    for i in range(100000):
+        big.add(1 + i % 600)
+    assert len(big.to_bytes()) < 2000, len(big.to_bytes())
+    print(f"✅ 100k samples stored in {len(big.to_bytes())} bytes")
+
+def test_tracker():
+    """Buyer messages pair with the next seller reply and reports merge stored and unflushed data"""
+    print("\n⏱️ Testing response time tracker...")
+    stored = {}
+    def store(deltas):
+        for key, sketch in deltas.items():
+            stored.setdefault(key, DDSketch()).merge(sketch)
+    def load(seller, since):
+        return [(day, kind, sketch) for (s, day, kind), sketch in stored.items() if s == seller and day >= since]
+
+    tracker = ResponseTimeTracker(store, load, flush_interval=0)
+    now = time.time()
+    tracker.buyer_message("buyer1", "seller1", at=now - 30)
+    tracker.buyer_message("buyer1", "seller1", at=now - 10)   # still waiting: clock keeps running
+    assert tracker.seller_reply("buyer1", "seller1", is_ai=True, at=now) == 30
+    assert tracker.seller_reply("buyer1", "seller1", at=now + 5) is None
+
+    tracker.buyer_message("buyer2", "seller1", at=now - 120)
+    tracker.seller_reply("buyer2", "seller1", at=now)
+    assert tracker.flush() == 2 and tracker.flush() == 0
+
+    tracker.buyer_message("buyer3", "seller1", at=now - 60)
+    tracker.seller_reply("buyer3", "seller1", at=now)
+    report = tracker.report("seller1", days=7)
+    assert report["response_seconds"]["all"]["count"] == 3
+    assert report["response_seconds"]["ai"]["count"] == 1
+    assert abs(report["response_seconds"]["human"]["p50"] - 60) <= 1.2
+    assert report["daily"][0]["day"] == utc_day(now).isoformat()
+    assert tracker.report("seller2")["response_seconds"]["all"]["count"] == 0
+
+    # A failed flush keeps the deltas for the next one
+    failing = ResponseTimeTracker(lambda deltas: 1 / 0, load, flush_interval=0)
+    failing.buyer_message("buyer1", "seller2", at=now - 1)
+    failing.seller_reply("buyer1", "seller2", at=now)
+    assert failing.flush() == 0
+    failing.store = store
+    assert failing.flush() == 1
+    assert utc_day(now) - timedelta(days=29) == utc_day(now - 29 * 86400)
+    print("✅ Response times paired and reported")
+
+def main():
+    """Run all response time tests"""
+    print("🚀 Running Response Time Tests\n")
+    test_sketch_accuracy_and_merge()
+    test_sketch_serialization()
+    test_tracker()
+    print("\n🎉 All response time tests passed!")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Smoke test for the Socket.IO chat handlers, with the database layer replaced by an in-memory fake
+"""
+
+import itertools
+from contextlib import contextmanager
+import app as app_module
+
+USERS = {"buyer1": (1, "buyer"), "seller1": (2, "seller")}
+
+@contextmanager
+def fake_database():
+    """Swap the database functions app.py calls for in-memory ones"""
+    ids = itertools.count(1)
+    saved = []
+    fakes = {
+        "get_user_id": USERS.get,
+        "get_inbox": lambda username: {"total_unread": 0, "conversations": []},
+        "get_message_history": lambda buyer, seller, limit=50, offset=0: {"messages": [], "total": 0},
+        "get_messages_since": lambda buyer, seller, last_seen_id=None: {
+            "mode": "delta", "messages": [], "latest_id": last_seen_id, "resync": False},
+        "get_message_receipt": lambda sender, client_id: None,
+        "save_message": lambda sender, receiver, content, attachment_id=None: saved.append(content) or next(ids),
+        "save_message_once": lambda sender, receiver, content, client_id, attachment_id=None: (
+            saved.append(content) or next(ids), True),
+        "mark_conversation_read": lambda username, partner, last_read_id=None: 0
+    }
+    originals = {name: getattr(app_module, name) for name in fakes}
+    try:
+        for name, fake in fakes.items():
+            setattr(app_module, name, fake)
+        yield saved
+    finally:
+        for name, original in originals.items():
+            setattr(app_module, name, original)
+
+def events(client, name):
+    return [event["args"][0] for event in client.get_received() if event["name"] == name]
+
+def test_login_join_send():
+    """A token login can join a chat and send a message that reaches the room"""
+    print("💬 Testing login, join and send...")
+    with fake_database() as saved:
+        flask_app = app_module.create_app({"TESTING": True})
+        client = app_module.socketio.test_client(flask_app)
+        token = app_module.sessions.issue("seller1")
+        try:
+            client.emit("login", {"token": token})
+            assert events(client, "login_success")[0]["username"] == "seller1"
+
+            client.emit("join_chat", {"username": "seller1", "partner": "buyer1", "token": token})
+            assert events(client, "joined_chat") == [{"room": "buyer1_seller1", "partner": "buyer1"}]
+
+            # seller -> buyer, so no AI reply is queued
+            ack = client.emit("send_message", {"sender": "seller1", "receiver": "buyer1", "message": "In stock",
+                                               "client_id": "smoke-1", "token": token}, callback=True)
+            assert ack["ok"] and ack["client_id"] == "smoke-1", ack
+            received = events(client, "receive_message")
+            assert [m["message"] for m in received] == ["In stock"] and len(saved) == 1
+
+            forged = client.emit("send_message", {"sender": "buyer1", "receiver": "seller1", "message": "hi",
+                                                  "client_id": "smoke-2"}, callback=True)
+            assert forged["error"] == "unauthorized"
+        finally:
+            client.disconnect()
+    print("✅ Handlers run end to end")
+
+def test_sync_read_leave():
+    """Delta sync, mark_read and leave_chat work without a database, and bad sessions are refused"""
+    print("\n🔁 Testing sync, mark_read and leave...")
+    with fake_database():
+        flask_app = app_module.create_app({"TESTING": True})
+        client = app_module.socketio.test_client(flask_app)
+        token = app_module.sessions.issue("buyer1")
+        try:
+            client.emit("login", {"token": "forged"})
+            assert events(client, "login_error")[0]["expired"]
+
+            client.emit("login", {"token": token})
+            client.get_received()
+            join = {"username": "buyer1", "partner": "seller1", "token": token, "sync": True, "last_seen_id": 5}
+            client.emit("join_chat", join)
+            received = client.get_received()
+            sync = [event["args"][0] for event in received if event["name"] == "chat_sync"]
+            assert sync == [{"partner": "seller1", "room": "buyer1_seller1", "mode": "delta",
+                             "messages": [], "latest_id": 5}], received
+
+            ack = client.emit("mark_read", {"username": "buyer1", "partner": "seller1", "last_read_id": 5,
+                                            "token": token}, callback=True)
+            assert ack == {"ok": True, "partner": "seller1", "unread": 0}
+            ack = client.emit("mark_read", {"username": "buyer1", "partner": "seller1", "last_read_id": "5",
+                                            "token": token}, callback=True)
+            assert ack["error"] == "invalid_last_read_id"
+
+            client.emit("leave_chat", {"username": "buyer1", "partner": "seller1"})
+            assert "buyer1_seller1" not in app_module.user_rooms.get("buyer1", [])
+        finally:
+            client.disconnect()
+    print("✅ Sync, mark_read and leave correct")
+
+def main():
+    """Run all socket handler tests"""
+    print("🚀 Running Socket Handler Tests\n")
+    test_login_join_send()
+    test_sync_read_leave()
+    print("\n🎉 All socket handler tests passed!")
+
+if __name__ == "__main__":
+    main()